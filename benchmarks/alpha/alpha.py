@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Time insertions into a fact class matched by many rules.
+#
+######################################################################
+
+"""
+alpha.py - time insertions into a fact class matched by many rules
+
+The benchmark compiles a rule set in which every rule matches the same
+Sighting fact class with a few constant tests: on the sighting's kind, on its
+grade, and, for every fourth rule, on its note with a regular
+expression. Rules share their tests on kinds, so that an engine that
+tests each rule's predicate in turn repeats them. Sightings of twice as
+many kinds as the rules test are inserted, so that about half of them
+match no rule and are discarded as they arrive.
+
+Each rule set is compiled twice: with a trigger for every rule's match,
+and with dispatcher triggers shared by the rules that test for the same
+kind (see giles -d). The benchmark checks that each engine produces an Alert fact
+for every rule that each sighting matches, and reports the time taken to
+parse its schema and the time taken per sighting.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+
+######################################################################
+#
+# Rule Set Generation
+#
+######################################################################
+
+
+def rule_tests(i, kinds):
+    """Return the kind, minimum grade, and note pattern (or None) tested by a rule."""
+
+    return "kind%d" % (i % kinds), i % 10, "^m%d" % (i % 7) if i % 4 == 0 else None
+
+
+def generate_rules(rules, kinds):
+    """Return the text of a rule set with the given number of rules matching Sighting facts."""
+
+    lines = ["Description: A rule set for benchmarking alpha tests.",
+             "",
+             "Facts:",
+             "    Sighting:",
+             "        Kind:    STRING",
+             "        Grade:   INTEGER",
+             "        Note:    STRING",
+             "",
+             "    Alert:",
+             "        Name:    STRING",
+             "        Note:    STRING",
+             "",
+             "Rules:"]
+
+    for i in range(rules):
+        kind, grade, pattern = rule_tests(i, kinds)
+        when = "This.Kind == \"%s\" AND This.Grade >= %d" % (kind, grade)
+        if pattern is not None:
+            when += " AND This.Note ~ \"%s\"" % pattern
+
+        lines += ["    Rule%d:" % i,
+                  "        Description: Sightings of kind %s at grade %d or above." % (kind, grade),
+                  "        MatchAll:",
+                  "            - Fact:    Sighting",
+                  "              Meaning: A sighting.",
+                  "              When:    !expr %s" % when,
+                  "              Assign:",
+                  "                Note: !expr This.Note",
+                  "        Assert:",
+                  "            Alert:",
+                  "                Name:    Rule%d" % i,
+                  "                Note: !expr Locals.Note",
+                  ""]
+
+    return "\n".join(lines) + "\n"
+
+
+def compile_rules(text, directory, options):
+    """Compile a rule set, returning the schema."""
+
+    rules_file = os.path.join(directory, "alpha.yml")
+    schema_file = os.path.join(directory, "alpha.sql")
+    with open(rules_file, "w") as output:
+        output.write(text)
+
+    try:
+        compile_main(*(options + ["-r", "-p", "Giles", "-o", schema_file, rules_file]))
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The generated rule set did not compile")
+
+    with open(schema_file, "r") as schema:
+        return schema.read()
+
+######################################################################
+#
+# Running the Benchmark
+#
+######################################################################
+
+
+def run_rules(schema, rules, kinds, facts, seed, batch, directory):
+    """Load a schema and insert the given number of Sighting facts, returning the results."""
+
+    rng = random.Random(seed)
+    sightings = [("kind%d" % rng.randrange(2 * kinds), rng.randrange(10), "m%d note" % rng.randrange(10)) for i in range(facts)]
+
+    expected = 0
+    tests = [rule_tests(i, kinds) for i in range(rules)]
+    for kind, grade, note in sightings:
+        expected += sum(1 for x in tests if x[0] == kind and grade >= x[1] and (x[2] is None or re.search(x[2], note)))
+
+    path = os.path.join(directory, "alpha.db")
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.executescript(schema)
+    db.close()
+
+    # SQLite parses the whole schema the first time a new connection uses the database.
+    db = sqlite3.connect(path, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) is not None else 0)
+    started = time.perf_counter()
+    db.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    parse = time.perf_counter() - started
+    db.execute("PRAGMA foreign_keys = 1")
+    db.execute("PRAGMA recursive_triggers = 1")
+
+    elapsed = 0.0
+    for i in range(0, facts, batch):
+        started = time.perf_counter()
+        db.execute("BEGIN")
+        db.executemany("INSERT INTO Giles_Sighting_facts(Kind, Grade, Note) VALUES(?, ?, ?)", sightings[i:i + batch])
+        db.execute("COMMIT")
+        elapsed += time.perf_counter() - started
+
+    alerts = db.execute("SELECT COUNT(*) FROM Giles_Alert_facts").fetchone()[0]
+    kept = db.execute("SELECT COUNT(*) FROM Giles_Sighting_facts").fetchone()[0]
+    db.close()
+
+    if alerts != expected:
+        raise Exception("expected %d Alert facts, found %d" % (expected, alerts))
+
+    return {"facts": facts, "kept": kept, "alerts": alerts, "parse_ms": 1e3 * parse, "seconds": elapsed,
+            "insert_us": 1e6 * elapsed / max(1, facts)}
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Time insertions into a fact class matched by many rules")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-f', '--compact-frames', dest='compact_frames', default=False,
+                            action='store_const', const=True, help="compile the engine with compact frames")
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the rule set, schema, and database in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-n', '--facts', dest='facts', default=10000, type=int,
+                            help="insert this many Sighting facts", metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=None, type=argparse.FileType('w'),
+                            help="write the results to this file as JSON", metavar="OUTPUT")
+    arg_parser.add_argument('-r', '--rules', dest='rules', default=[], type=int, action='append',
+                            help="match Sighting facts with this many rules (may be given more than once; the default is 20 and 200)",
+                            metavar="RULES")
+    arg_parser.add_argument('-t', '--kinds', dest='kinds', default=20, type=int,
+                            help="the number of kinds of sighting the rules test for", metavar="KINDS")
+    arg_parser.add_argument('--batch', dest='batch', default=1000, type=int,
+                            help="the number of facts inserted in each transaction", metavar="COUNT")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the contents of the facts", metavar="SEED")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if min(arguments.facts, arguments.kinds, arguments.batch, *(arguments.rules or [1])) < 1:
+        arg_parser.error("the numbers of facts, rules, and kinds, and the batch size, must be at least 1")
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-alpha-")
+    os.makedirs(directory, exist_ok=True)
+
+    results = {"giles": get_release_string(), "sqlite": sqlite3.sqlite_version, "kinds": arguments.kinds,
+               "seed": arguments.seed, "runs": []}
+
+    sys.stdout.write("%10s %10s %10s %10s %10s %10s %12s\n" % ("rules", "layout", "facts", "kept", "alerts", "parse ms", "insert us"))
+    try:
+        for rules in arguments.rules or [20, 200]:
+            for layout, options in (("triggers", []), ("dispatch", ["-d"])):
+                options = options + (["-f"] if arguments.compact_frames else [])
+                schema = compile_rules(generate_rules(rules, arguments.kinds), directory, options)
+                run = run_rules(schema, rules, arguments.kinds, arguments.facts, arguments.seed, arguments.batch, directory)
+                run["rules"] = rules
+                run["layout"] = layout
+                results["runs"].append(run)
+                sys.stdout.write("%10d %10s %10d %10d %10d %10.1f %12.1f\n" % (rules, layout, run["facts"], run["kept"], run["alerts"],
+                                                                            run["parse_ms"], run["insert_us"]))
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    if arguments.results_file is not None:
+        json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+        arguments.results_file.write("\n")
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Check and time the bundled examples on generated data.
+#
+######################################################################
+
+"""
+corpus.py - check and time the bundled examples on generated data
+
+Each of the bundled examples has a generator here that produces input
+facts for it at any scale, along with the output facts the example should
+derive from them, computed directly in Python rather than by the engine.
+The harness compiles each example, inserts the generated facts, checks the
+engine's outputs against the expected ones, and then retracts every input
+fact and checks that nothing derived from them remains. Both insertion and
+retraction are timed.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+
+######################################################################
+#
+# Generators
+#
+# Each generator takes a random number generator and the approximate
+# number of input facts to produce, and returns a list of input facts
+# as (fact class, {field: value}) pairs and a dictionary mapping each
+# output fact class to the sorted list of the field tuples it should
+# hold. Fields in the tuples are in the order given by "outputs".
+#
+######################################################################
+
+
+def word(n):
+    """Return a lowercase name made of letters for a number."""
+
+    result = ""
+    while True:
+        result = chr(ord("a") + n % 26) + result
+        n = n // 26 - 1
+        if n < 0:
+            return result
+
+
+def titlecase(s):
+    """Capitalize the first letter of a string and lowercase the rest, as the family example does."""
+
+    return s[:1].upper() + s[1:].lower()
+
+
+def pets(rng, scale):
+    """Generate people and animals sharing domiciles."""
+
+    domiciles = max(1, scale // 12)
+    people = max(1, scale // 4)
+    animals = max(1, scale // 4)
+    facts = []
+    home = {}
+
+    for i in range(people):
+        facts.append(("PersonExists", {"Name": "P%d" % i, "Age": rng.randrange(1, 100)}))
+    for i in range(animals):
+        facts.append(("AnimalExists", {"Name": "A%d" % i, "Age": rng.randrange(1, 20)}))
+
+    # Most people and animals live somewhere; a few live in two places.
+    for name in ["P%d" % i for i in range(people)] + ["A%d" % i for i in range(animals)]:
+        for domicile in rng.sample(range(domiciles), min(domiciles, 2 if rng.random() < 0.05 else 1)):
+            if rng.random() < 0.95:
+                facts.append(("Inhabits", {"Name": name, "Domicile": "D%d" % domicile}))
+                home.setdefault(name, []).append(domicile)
+
+    residents = collections.defaultdict(list)
+    for name, places in home.items():
+        if name.startswith("P"):
+            for domicile in places:
+                residents[domicile].append(name)
+
+    expected = []
+    for i in range(animals):
+        pet = "A%d" % i
+        for domicile in home.get(pet, []):
+            expected += [(person, pet) for person in residents[domicile]]
+
+    rng.shuffle(facts)
+    return facts, {"IsAPet": sorted(expected)}
+
+
+def family(rng, scale):
+    """Generate people whose last names may name known families, and exceptions to their membership."""
+
+    families = max(1, scale // 10)
+    people = max(1, scale * 7 // 10)
+    facts = [("KnownFamilies", {"Family": titlecase(word(i + 1000))}) for i in range(families)]
+    persons = []
+
+    for i in range(people):
+        first = titlecase(word(rng.randrange(5000)))
+        last = word(rng.randrange(families * 5 // 4 + 1) + 1000)
+        last = "".join(x.upper() if rng.random() < 0.2 else x for x in last)
+        persons.append((first, last))
+        facts.append(("PersonIsNamed", {"FirstName": first, "LastName": last}))
+
+    # Exceptions are written in each of the three forms the example recognizes, and some in none of them.
+    exceptions = set()
+    for first, last in rng.sample(persons, min(len(persons), scale // 5)):
+        form = rng.randrange(4)
+        if form == 0:
+            exception = (first.upper(), titlecase(last).upper())
+        elif form == 1:
+            exception = (first.lower(), titlecase(last).lower())
+        elif form == 2:
+            exception = (titlecase(first), titlecase(last))
+        else:
+            exception = (first + "x", titlecase(last))
+        if exception not in exceptions:
+            exceptions.add(exception)
+            facts.append(("KnownException", {"FirstName": exception[0], "Family": exception[1]}))
+
+    known = set(x[1]["Family"] for x in facts if x[0] == "KnownFamilies")
+    expected = []
+    for first, last in persons:
+        family_name = titlecase(last)
+        if family_name not in known:
+            continue
+        if (first.upper(), family_name.upper()) in exceptions or (first.lower(), family_name.lower()) in exceptions:
+            continue
+        if (titlecase(first), titlecase(last)) in exceptions:
+            continue
+        expected.append((first, family_name))
+
+    rng.shuffle(facts)
+    return facts, {"MightBelongToFamily": sorted(expected)}
+
+
+def ancestry(rng, scale):
+    """Generate villages of five generations in which each child has two parents."""
+
+    generations = 5
+    size = 8
+    facts = []
+    expected = set()
+    village = 0
+
+    while len(facts) < scale:
+        people = [["V%dG%dP%d" % (village, g, i) for i in range(size)] for g in range(generations)]
+        parents = collections.defaultdict(list)
+        for g in range(1, generations):
+            for child in people[g]:
+                for parent in rng.sample(people[g - 1], 2):
+                    parents[child].append(parent)
+                    facts.append(("IsAncestor", {"Descendant": child, "Ancestor": parent}))
+
+        for g in range(1, generations):
+            for child in people[g]:
+                ancestors = set()
+                pending = list(parents[child])
+                while len(pending) > 0:
+                    ancestor = pending.pop()
+                    if ancestor not in ancestors:
+                        ancestors.add(ancestor)
+                        pending += parents[ancestor]
+                expected.update((child, x) for x in ancestors)
+
+        village += 1
+
+    rng.shuffle(facts)
+    return facts, {"IsAncestor": sorted(expected)}
+
+
+def tarnis(rng, scale):
+    """Generate clusters of connected networks, with orphans, loopbacks, undeclared networks, and exceptions."""
+
+    facts = []
+    levels = {}
+    connections = []
+    cluster = 0
+
+    # Retracting a connection from a cycle of data flows longer than two networks can rederive the flows around the
+    # cycle from one another without end (see "Recursive Rules" in the user manual), so each cluster's unidirectional
+    # connections only run from lower to higher numbered networks, and its one bidirectional connection, if any, is to
+    # a network connected to nothing else.
+    while len(facts) < scale:
+        names = ["C%dN%d" % (cluster, i) for i in range(rng.randrange(2, 9))]
+        for name in names:
+            # Networks that are connected but never declared are inferred to exist, at level 0.
+            if rng.random() < 0.9:
+                levels[name] = rng.randrange(101)
+                facts.append(("NetworkExists", {"NetworkName": name, "SecurityLevel": levels[name]}))
+
+        edges = set()
+        for i in range(1, len(names)):
+            edges.add(("UnidirectionalNetworkConnection", names[rng.randrange(i)], names[i]))
+        for i in range(len(names) // 3):
+            a, b = sorted(rng.sample(range(len(names)), 2))
+            edges.add(("UnidirectionalNetworkConnection", names[a], names[b]))
+        if rng.random() < 0.3:
+            names.append("C%dN%d" % (cluster, len(names)))
+            edges.add(("BidirectionalNetworkConnection", rng.choice(names[:-1]), names[-1]))
+        if rng.random() < 0.05:
+            edges.add((rng.choice(["BidirectionalNetworkConnection", "UnidirectionalNetworkConnection"]), names[0], names[0]))
+
+        for kind, a, b in sorted(edges):
+            connections.append((kind, a, b))
+            facts.append((kind, {"NetworkA": a, "NetworkB": b}))
+
+        if rng.random() < 0.1:
+            name = "C%dOrphan" % cluster
+            levels[name] = rng.randrange(101)
+            facts.append(("NetworkExists", {"NetworkName": name, "SecurityLevel": levels[name]}))
+
+        if rng.random() < 0.2:
+            a, b = rng.sample(names, 2)
+            facts.append(("AllowException", {"NetworkA": a, "NetworkB": b}))
+
+        cluster += 1
+
+    exceptions = set((x[1]["NetworkA"], x[1]["NetworkB"]) for x in facts if x[0] == "AllowException")
+    endpoints = set(x[1] for x in connections) | set(x[2] for x in connections)
+    for name in endpoints:
+        levels.setdefault(name, 0)
+
+    flows = collections.defaultdict(set)
+    for kind, a, b in connections:
+        flows[a].add(b)
+        if kind == "BidirectionalNetworkConnection":
+            flows[b].add(a)
+
+    alerts = []
+    for name in sorted(levels):
+        if name not in endpoints:
+            alerts.append('Network "%s" exists but is connected to no other network.' % name)
+
+    for kind, a, b in connections:
+        if a == b:
+            alerts.append("A connection exists that connects a network to itself (%s -> %s)." % (a, a))
+
+    # Data flows between every pair of distinct networks joined by a path, and from a network to itself only
+    # if it is directly connected to itself.
+    for a in sorted(flows):
+        reached = set()
+        pending = list(flows[a])
+        while len(pending) > 0:
+            b = pending.pop()
+            if b not in reached:
+                reached.add(b)
+                pending += flows[b]
+        for b in reached:
+            if (b != a or a in flows[a]) and levels[b] < levels[a] and (a, b) not in exceptions:
+                alerts.append("Data can flow from a more-secure network (%s, level %d) to a less-secure network (%s, level %d)" %
+                              (a, levels[a], b, levels[b]))
+
+    rng.shuffle(facts)
+    return facts, {"Alert": sorted((x,) for x in alerts)}
+
+corpus = collections.OrderedDict([
+    ("pets", (pets, {"IsAPet": ["Person", "Pet"]})),
+    ("family", (family, {"MightBelongToFamily": ["FirstName", "Family"]})),
+    ("ancestry", (ancestry, {"IsAncestor": ["Descendant", "Ancestor"]})),
+    ("tarnis", (tarnis, {"Alert": ["Message"]}))
+])
+
+######################################################################
+#
+# Running an Example
+#
+######################################################################
+
+
+class Mismatch(Exception):
+    pass
+
+
+def compile_example(name, directory, options):
+    """Compile a bundled example, returning its schema."""
+
+    rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "examples", name, name + ".yml")
+    schema_file = os.path.join(directory, name + ".sql")
+
+    try:
+        compile_main(*(options + ["-r", "-c", "-p", "Giles", "-o", schema_file, rules_file]))
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The %s example did not compile" % name)
+
+    with open(schema_file, "r") as schema:
+        return schema.read()
+
+
+def check(db, outputs, expected):
+    """Check the engine's output facts against the expected ones."""
+
+    for fact, fields in sorted(outputs.items()):
+        actual = sorted(db.execute("SELECT %s FROM Giles_%s_Facts" % (", ".join(fields), fact)).fetchall())
+        wanted = expected.get(fact, [])
+        if actual != wanted:
+            missing = collections.Counter(wanted) - collections.Counter(actual)
+            extra = collections.Counter(actual) - collections.Counter(wanted)
+            raise Mismatch("%s: expected %d facts, found %d (%d missing, e.g. %s; %d unexpected, e.g. %s)" %
+                           (fact, len(wanted), len(actual), sum(missing.values()), list(missing)[:1],
+                            sum(extra.values()), list(extra)[:1]))
+
+
+def remaining(db):
+    """Return the number of facts remaining in each fact class, other than the parameters and the initial fact."""
+
+    try:
+        parameters = set(x[0].lower() for x in db.execute("SELECT Name FROM Giles_Parameters"))
+    except sqlite3.Error:
+        parameters = set()
+
+    result = {}
+    for table, in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        if table.lower().startswith("_giles_") and table.lower().endswith(("_actual", "_shadow")):
+            fact = table[len("_giles_"):].rsplit("_", 1)[0]
+            if fact.lower() not in parameters and fact.lower() != "initialfact":
+                count = db.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+                if count > 0:
+                    result[table] = count
+
+    return result
+
+
+def run_example(name, scale, seed, batch, directory, options):
+    """Insert, check, and retract a generated data set for an example, returning the results."""
+
+    generator, outputs = corpus[name]
+    rng = random.Random(seed)
+    facts, expected = generator(rng, scale)
+
+    path = os.path.join(directory, name + ".db")
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) is not None else 0)
+    db.execute("PRAGMA foreign_keys = 1")
+    db.execute("PRAGMA recursive_triggers = 1")
+    db.executescript(compile_example(name, directory, options))
+
+    results = {"facts": len(facts), "expected": dict((x, len(y)) for x, y in expected.items())}
+
+    started = time.perf_counter()
+    for i, (fact, fields) in enumerate(facts):
+        if i % batch == 0:
+            db.execute("BEGIN")
+        names = sorted(fields)
+        db.execute("INSERT INTO Giles_%s_Facts(%s) VALUES(%s)" % (fact, ", ".join(names), ", ".join("?" * len(names))),
+                   [fields[x] for x in names])
+        if i % batch == batch - 1 or i == len(facts) - 1:
+            db.execute("COMMIT")
+    results["insert_seconds"] = time.perf_counter() - started
+
+    check(db, outputs, expected)
+
+    # Facts asserted by rules have a producing rule; only those asserted here are retracted.
+    inserted = []
+    for fact in sorted(set(x[0] for x in facts)):
+        inserted += [(fact, x[0]) for x in db.execute("SELECT id FROM _Giles_%s_actual WHERE rule IS NULL" % fact)]
+    rng.shuffle(inserted)
+
+    started = time.perf_counter()
+    for i, (fact, fact_id) in enumerate(inserted):
+        if i % batch == 0:
+            db.execute("BEGIN")
+        db.execute("DELETE FROM Giles_%s_Facts WHERE id = ?" % fact, (fact_id,))
+        if i % batch == batch - 1 or i == len(inserted) - 1:
+            db.execute("COMMIT")
+    results["retract_seconds"] = time.perf_counter() - started
+    results["retracted"] = len(inserted)
+
+    left = remaining(db)
+    if len(left) > 0:
+        raise Mismatch("facts remain after retraction: %s" % ", ".join("%s (%d)" % x for x in sorted(left.items())))
+
+    db.close()
+    return results
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Check and time the bundled examples on generated data")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-f', '--compact-frames', dest='compact_frames', default=False,
+                            action='store_const', const=True, help="compile the examples with compact frames")
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the schemas and databases in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-n', '--scale', dest='scales', default=[], type=int, action='append',
+                            help="generate about this many input facts (may be given more than once; the default is 1000)",
+                            metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=None, type=argparse.FileType('w'),
+                            help="write the results to this file as JSON", metavar="OUTPUT")
+    arg_parser.add_argument('--batch', dest='batch', default=1000, type=int,
+                            help="the number of facts inserted or retracted in each transaction", metavar="COUNT")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the generated data", metavar="SEED")
+    arg_parser.add_argument('examples', type=str, nargs='*',
+                            help="the examples to run: %s (by default, all of them)" % ", ".join(corpus.keys()), metavar="EXAMPLE")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    for name in arguments.examples:
+        if name not in corpus:
+            arg_parser.error("unknown example: %s" % name)
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-corpus-")
+    os.makedirs(directory, exist_ok=True)
+
+    results = {"giles": get_release_string(), "sqlite": sqlite3.sqlite_version, "seed": arguments.seed, "runs": []}
+    failed = False
+
+    sys.stdout.write("%-10s %10s %10s %12s %10s %12s  %s\n" % ("example", "facts", "insert", "facts/sec", "retract", "facts/sec", "result"))
+    try:
+        for scale in arguments.scales or [1000]:
+            for name in arguments.examples or list(corpus.keys()):
+                try:
+                    run = run_example(name, scale, arguments.seed, arguments.batch, directory,
+                                      ["-f"] if arguments.compact_frames else [])
+                    run["result"] = "ok"
+                except (Mismatch, sqlite3.Error) as e:
+                    run = {"result": str(e)}
+                    failed = True
+
+                run.update({"example": name, "scale": scale})
+                results["runs"].append(run)
+
+                if "retract_seconds" in run:
+                    sys.stdout.write("%-10s %10d %9.2fs %12.0f %9.2fs %12.0f  ok\n" %
+                                     (name, run["facts"], run["insert_seconds"], run["facts"] / max(run["insert_seconds"], 1e-9),
+                                      run["retract_seconds"], run["retracted"] / max(run["retract_seconds"], 1e-9)))
+                else:
+                    sys.stdout.write("%-10s %10d %10s %12s %10s %12s  FAILED: %s\n" % (name, scale, "-", "-", "-", "-", run["result"]))
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    if arguments.results_file is not None:
+        json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+        arguments.results_file.write("\n")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Time distinct productions as the number of produced facts
+#          grows.
+#
+######################################################################
+
+"""
+distinct.py - time distinct productions as the number of produced facts grows
+
+The benchmark compiles a rule set with a single rule that copies the name
+of each Word fact into every field of a wide Record fact, distinctly. Each
+name is inserted more than once, so that by default half of the rule's firings
+find an identical Record fact already present. Before it produces a fact,
+and whenever a produced fact is retracted, the engine looks for an
+identical Record fact by all of its fields; if that lookup had to scan the
+Record facts, the time taken by each insertion and retraction would grow
+with the number of Record facts.
+
+For each scale, the benchmark inserts that many Word facts into an empty
+engine and then retracts them all, timing each, and reports the time per
+fact over the whole run and over its last tenth, when the most Record facts
+are present.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+
+######################################################################
+#
+# Rule Set Generation
+#
+######################################################################
+
+
+def generate_rules(fields):
+    """Return the text of a rule set whose distinctly-produced fact has the given number of fields."""
+
+    lines = ["Description: A rule set for benchmarking distinct productions.",
+             "",
+             "Facts:",
+             "    Word:",
+             "        Name: STRING",
+             "",
+             "    Record:"]
+    lines += ["        Field%d: STRING" % i for i in range(fields)]
+
+    lines += ["",
+              "Rules:",
+              "    Spread:",
+              "        Description: Every word is spread across the fields of a record, once.",
+              "        MatchAll:",
+              "            - Fact:    Word",
+              "              Meaning: A word.",
+              "              Assign:",
+              "                Name: !expr This.Name",
+              "        Assert: !distinct",
+              "            Record:"]
+    lines += ["                Field%d: !expr Locals.Name . \"/%d\"" % (i, i) for i in range(fields)]
+
+    return "\n".join(lines) + "\n"
+
+
+def compile_rules(text, directory, options):
+    """Compile a rule set, returning the schema."""
+
+    rules_file = os.path.join(directory, "distinct.yml")
+    schema_file = os.path.join(directory, "distinct.sql")
+    with open(rules_file, "w") as output:
+        output.write(text)
+
+    try:
+        compile_main(*(options + ["-p", "Giles", "-o", schema_file, rules_file]))
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The generated rule set did not compile")
+
+    with open(schema_file, "r") as schema:
+        return schema.read()
+
+######################################################################
+#
+# Running a Scale
+#
+######################################################################
+
+
+def timed(db, statements, batch):
+    """Execute some statements in batches, each in its own transaction, returning the time each one took."""
+
+    latencies = []
+    for i, (statement, parameters) in enumerate(statements):
+        if i % batch == 0:
+            db.execute("BEGIN")
+
+        started = time.perf_counter()
+        db.execute(statement, parameters)
+        latencies.append(time.perf_counter() - started)
+
+        if i % batch == batch - 1 or i == len(statements) - 1:
+            db.execute("COMMIT")
+
+    return latencies
+
+
+def summarize(latencies):
+    """Return the mean time per fact, in microseconds, over a run and over its last tenth."""
+
+    tail = latencies[-max(1, len(latencies) // 10):]
+    return 1e6 * sum(latencies) / max(1, len(latencies)), 1e6 * sum(tail) / len(tail)
+
+
+def run_scale(schema, scale, copies, length, seed, batch, directory):
+    """Insert and retract the given number of Word facts, returning the results."""
+
+    rng = random.Random(seed)
+    names = ["%0*d" % (length, i) for i in range(max(1, scale // copies))]
+    words = [names[i % len(names)] for i in range(scale)]
+    rng.shuffle(words)
+
+    path = os.path.join(directory, "distinct.db")
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA foreign_keys = 1")
+    db.execute("PRAGMA recursive_triggers = 1")
+    db.executescript(schema)
+
+    inserted = timed(db, [("INSERT INTO Giles_Word_Facts(Name) VALUES(?)", (x,)) for x in words], batch)
+    records = db.execute("SELECT COUNT(*) FROM Giles_Record_Facts").fetchone()[0]
+    if records != len(names):
+        raise Exception("expected %d Record facts, found %d" % (len(names), records))
+
+    ids = [x[0] for x in db.execute("SELECT id FROM Giles_Word_Facts")]
+    rng.shuffle(ids)
+    retracted = timed(db, [("DELETE FROM Giles_Word_Facts WHERE id = ?", (x,)) for x in ids], batch)
+    left = db.execute("SELECT COUNT(*) FROM Giles_Record_Facts").fetchone()[0]
+    if left != 0:
+        raise Exception("%d Record facts remain after retraction" % left)
+
+    db.close()
+
+    insert_mean, insert_tail = summarize(inserted)
+    retract_mean, retract_tail = summarize(retracted)
+    return {"facts": scale, "records": records, "insert_us": insert_mean, "insert_tail_us": insert_tail,
+            "retract_us": retract_mean, "retract_tail_us": retract_tail}
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Time distinct productions as the number of produced facts grows")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-c', '--copies', dest='copies', default=2, type=int,
+                            help="the number of times each name is inserted", metavar="COUNT")
+    arg_parser.add_argument('-f', '--compact-frames', dest='compact_frames', default=False,
+                            action='store_const', const=True, help="compile the engine with compact frames")
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the rule set, schema, and database in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-l', '--length', dest='length', default=32, type=int,
+                            help="the length of each name", metavar="LENGTH")
+    arg_parser.add_argument('-n', '--scale', dest='scales', default=[], type=int, action='append',
+                            help="insert this many Word facts (may be given more than once; the default is 1000, 10000, and 50000)",
+                            metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=None, type=argparse.FileType('w'),
+                            help="write the results to this file as JSON", metavar="OUTPUT")
+    arg_parser.add_argument('-w', '--width', dest='width', default=4, type=int,
+                            help="the number of fields in the produced fact", metavar="FIELDS")
+    arg_parser.add_argument('--batch', dest='batch', default=1000, type=int,
+                            help="the number of facts inserted or retracted in each transaction", metavar="COUNT")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the order of the facts", metavar="SEED")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if min(arguments.copies, arguments.length, arguments.width, arguments.batch) < 1:
+        arg_parser.error("the copies, length, width, and batch size must be at least 1")
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-distinct-")
+    os.makedirs(directory, exist_ok=True)
+
+    results = {"giles": get_release_string(), "sqlite": sqlite3.sqlite_version, "copies": arguments.copies,
+               "length": arguments.length, "width": arguments.width, "seed": arguments.seed, "runs": []}
+
+    sys.stdout.write("%10s %10s %12s %12s %12s %12s\n" % ("facts", "records", "insert us", "last tenth", "retract us", "last tenth"))
+    try:
+        schema = compile_rules(generate_rules(arguments.width), directory, ["-f"] if arguments.compact_frames else [])
+        for scale in arguments.scales or [1000, 10000, 50000]:
+            run = run_scale(schema, scale, arguments.copies, arguments.length, arguments.seed, arguments.batch, directory)
+            results["runs"].append(run)
+            sys.stdout.write("%10d %10d %12.1f %12.1f %12.1f %12.1f\n" % (run["facts"], run["records"], run["insert_us"],
+                                                                          run["insert_tail_us"], run["retract_us"],
+                                                                          run["retract_tail_us"]))
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    if arguments.results_file is not None:
+        json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+        arguments.results_file.write("\n")
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
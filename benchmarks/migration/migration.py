@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Time the migration of facts from one engine to another.
+#
+######################################################################
+
+"""
+migration.py - time the migration of facts from one engine to another
+
+The benchmark compiles two versions of a rule set whose Reading fact
+class is an output, so that no rule stands between a fact and its table:
+the new version adds a field to the Reading facts. For each scale, it
+fills an engine compiled from the old version with that many Reading
+facts and then copies them into an engine compiled from the new version,
+once through the engines' own serialization tables and once with
+giles-migrate, checking that both copy every fact and give the new field
+its default value.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+from giles.migrate import main as migrate_main
+
+######################################################################
+#
+# Rule Set Generation
+#
+######################################################################
+
+
+def generate_rules(fields, added):
+    """Return the text of a rule set whose Reading facts have the given number of fields, plus one if added is true."""
+
+    lines = ["Description: A rule set for benchmarking migrations.",
+             "",
+             "Facts:",
+             "    Reading: !output"]
+    lines += ["        Field%d: %s" % (i, ("STRING", "INTEGER", "REAL")[i % 3]) for i in range(fields)]
+    if added:
+        lines += ["        Added: INTEGER"]
+
+    lines += ["",
+              "    Alarm:",
+              "        Name: STRING",
+              "",
+              "Rules:",
+              "    Raise:",
+              "        Description: Every alarm is a reading.",
+              "        MatchAll:",
+              "            - Fact:    Alarm",
+              "              Meaning: An alarm.",
+              "              Assign:",
+              "                Name: !expr This.Name",
+              "        Assert:",
+              "            Reading:"]
+    lines += ["                Field%d: %s" % (i, ("!expr Locals.Name", "0", "0.0")[i % 3]) for i in range(fields)]
+    if added:
+        lines += ["                Added: 0"]
+
+    return "\n".join(lines) + "\n"
+
+
+def compile_rules(text, directory, name):
+    """Compile a rule set, returning the path of the schema."""
+
+    rules_file = os.path.join(directory, name + ".yml")
+    schema_file = os.path.join(directory, name + ".sql")
+    with open(rules_file, "w") as output:
+        output.write(text)
+
+    try:
+        compile_main("-p", "Giles", "-o", schema_file, rules_file)
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The generated rule set did not compile")
+
+    return schema_file
+
+######################################################################
+#
+# Running a Scale
+#
+######################################################################
+
+
+def connect(path, schema_file):
+    """Create a database holding an engine compiled from a schema."""
+
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA foreign_keys = 1")
+    db.execute("PRAGMA recursive_triggers = 1")
+    with open(schema_file, "r") as schema:
+        db.executescript(schema.read())
+
+    return db
+
+
+def verify(path, scale, default):
+    """Check that a migrated engine holds every Reading fact, with the new field set to its default."""
+
+    db = sqlite3.connect(path)
+    count, wrong = db.execute("SELECT COUNT(*), SUM(Added != ?) FROM Giles_Reading_facts", (default,)).fetchone()
+    db.close()
+
+    if count != scale or wrong:
+        raise Exception("expected %d migrated Reading facts, found %d (%d with the wrong default)" % (scale, count, wrong or 0))
+
+
+def run_scale(old_schema, new_schema, scale, fields, seed, batch, directory):
+    """Fill an old engine with the given number of Reading facts and time their migration both ways."""
+
+    rng = random.Random(seed)
+    old_path = os.path.join(directory, "old.db")
+    db = connect(old_path, old_schema)
+    db.execute("BEGIN")
+    db.executemany("INSERT INTO Giles_Reading_facts(%s) VALUES(%s)" % (", ".join("Field%d" % i for i in range(fields)),
+                                                                         ", ".join("?" * fields)),
+                   ([("%016x" % rng.getrandbits(64), rng.randrange(1 << 31), rng.random())[i % 3] for i in range(fields)]
+                    for _ in range(scale)))
+    db.execute("COMMIT")
+    db.close()
+
+    # The engines' own upgrade path: serialize the old engine, then copy its serialization into the new one.
+    builtin_path = os.path.join(directory, "builtin.db")
+    destination = connect(builtin_path, new_schema)
+    started = time.perf_counter()
+    db = sqlite3.connect(old_path, isolation_level=None)
+    db.execute("INSERT INTO Giles_do_serialization VALUES(NULL)")
+    db.close()
+
+    destination.execute("ATTACH DATABASE ? AS source", (old_path,))
+    destination.execute("BEGIN")
+    destination.execute("INSERT INTO Giles_serialization_destination SELECT * FROM source.Giles_serialization_source ORDER BY rowid")
+    destination.execute("COMMIT")
+    destination.close()
+    builtin = time.perf_counter() - started
+    verify(builtin_path, scale, 0)
+
+    # The migration tool.
+    migrated_path = os.path.join(directory, "migrated.db")
+    connect(migrated_path, new_schema).close()
+    started = time.perf_counter()
+    try:
+        migrate_main("-q", "-b", str(batch), "-d", "Reading.Added=7", old_path, migrated_path)
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("giles-migrate failed")
+    migrated = time.perf_counter() - started
+    verify(migrated_path, scale, 7)
+
+    return {"facts": scale, "builtin_s": builtin, "migrate_s": migrated}
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Time the migration of facts from one engine to another")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the rule sets, schemas, and databases in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-n', '--scale', dest='scales', default=[], type=int, action='append',
+                            help="migrate this many Reading facts (may be given more than once; the default is 10000 and 100000)",
+                            metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=None, type=argparse.FileType('w'),
+                            help="write the results to this file as JSON", metavar="OUTPUT")
+    arg_parser.add_argument('-w', '--width', dest='width', default=8, type=int,
+                            help="the number of fields in the old Reading facts", metavar="FIELDS")
+    arg_parser.add_argument('--batch', dest='batch', default=10000, type=int,
+                            help="the number of facts giles-migrate copies in each transaction", metavar="COUNT")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the contents of the facts", metavar="SEED")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if min(arguments.width, arguments.batch) < 1:
+        arg_parser.error("the width and batch size must be at least 1")
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-migration-")
+    os.makedirs(directory, exist_ok=True)
+
+    results = {"giles": get_release_string(), "sqlite": sqlite3.sqlite_version, "width": arguments.width,
+               "batch": arguments.batch, "seed": arguments.seed, "runs": []}
+
+    sys.stdout.write("%10s %12s %12s %12s %12s %8s\n" % ("facts", "builtin s", "us/fact", "migrate s", "us/fact", "speedup"))
+    try:
+        old_schema = compile_rules(generate_rules(arguments.width, False), directory, "old")
+        new_schema = compile_rules(generate_rules(arguments.width, True), directory, "new")
+        for scale in arguments.scales or [10000, 100000]:
+            run = run_scale(old_schema, new_schema, scale, arguments.width, arguments.seed, arguments.batch, directory)
+            results["runs"].append(run)
+            sys.stdout.write("%10d %12.2f %12.1f %12.2f %12.1f %7.1fx\n" %
+                             (run["facts"], run["builtin_s"], 1e6 * run["builtin_s"] / max(1, scale), run["migrate_s"],
+                              1e6 * run["migrate_s"] / max(1, scale), run["builtin_s"] / max(run["migrate_s"], 1e-9)))
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    if arguments.results_file is not None:
+        json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+        arguments.results_file.write("\n")
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
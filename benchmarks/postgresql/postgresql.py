@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Compare insertions into SQLite and PostgreSQL engines.
+#
+######################################################################
+
+"""
+postgresql.py - compare insertions into SQLite and PostgreSQL engines
+
+The benchmark compiles a rule set with both the sqlite and the postgresql
+backends. Its rule joins each Sighting fact of a high enough grade with
+the Site it was made at, is blocked by a Cleared fact for the site, and
+distinctly asserts an Alert fact for the site and the kind of sighting.
+The Site and Cleared facts are inserted first, and then the Sighting facts
+are inserted in batches and timed.
+
+The SQLite engine is given each batch with executemany in a transaction.
+The PostgreSQL engine is given each batch twice over, in separate schemas:
+one INSERT statement per fact, and one INSERT statement for the whole
+batch, which its statement-level triggers propagate as a set. The
+benchmark checks that every engine asserts the Alert facts expected, and
+reports the time taken per sighting.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+
+######################################################################
+#
+# Rule Set
+#
+######################################################################
+
+RULES = """Description: A rule set for comparing the SQLite and PostgreSQL backends.
+
+Facts:
+    Site:
+        Name:    STRING
+        Region:  INTEGER
+
+    Cleared:
+        Site:    STRING
+
+    Sighting:
+        Site:    STRING
+        Kind:    STRING
+        Grade:   INTEGER
+
+    Alert:
+        Site:    STRING
+        Kind:    STRING
+
+Rules:
+    Watch:
+        Description: Sightings of grade 5 or above at uncleared sites in a region.
+        MatchAll:
+            - Fact:    Sighting
+              Meaning: A sighting of grade 5 or above.
+              When:    !expr This.Grade >= 5
+              Assign:
+                SiteName: !expr This.Site
+                Kind:     !expr This.Kind
+
+            - Fact:    Site
+              Meaning: The site of the sighting is in a region.
+              When:    !expr This.Name == Locals.SiteName AND This.Region > 0
+
+        MatchNone:
+            - Fact:    Cleared
+              Meaning: The site has not been cleared.
+              When:    !expr This.Site == Locals.SiteName
+
+        Assert: !distinct
+            Alert:
+                Site: !expr Locals.SiteName
+                Kind: !expr Locals.Kind
+"""
+
+
+def compile_rules(directory, backend):
+    """Compile the rule set with a backend, returning the schema."""
+
+    rules_file = os.path.join(directory, "postgresql.yml")
+    schema_file = os.path.join(directory, "postgresql.%s" % backend)
+    with open(rules_file, "w") as output:
+        output.write(RULES)
+
+    try:
+        compile_main("-r", "-b", backend, "-p", "Giles", "-o", schema_file, rules_file)
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The rule set did not compile with the %s backend" % backend)
+
+    with open(schema_file, "r") as schema:
+        return schema.read()
+
+
+def generate_facts(sites, facts, seed):
+    """Return the Site, Cleared, and Sighting facts to insert, and the Alert facts expected."""
+
+    rng = random.Random(seed)
+    site_facts = [("site%d" % i, rng.randrange(4)) for i in range(sites)]
+    cleared_facts = [(name,) for name, region in site_facts if rng.randrange(10) == 0]
+    sightings = [("site%d" % rng.randrange(sites), "kind%d" % rng.randrange(20), rng.randrange(10)) for i in range(facts)]
+
+    watched = set(name for name, region in site_facts if region > 0) - set(name for (name,) in cleared_facts)
+    expected = sorted(set((site, kind) for site, kind, grade in sightings if grade >= 5 and site in watched))
+    return site_facts, cleared_facts, sightings, expected
+
+######################################################################
+#
+# Running the Benchmark
+#
+######################################################################
+
+SITE = "INSERT INTO Giles_Site_facts(Name, Region) VALUES(%s, %s)"
+CLEARED = "INSERT INTO Giles_Cleared_facts(Site) VALUES(%s)"
+SIGHTING = "INSERT INTO Giles_Sighting_facts(Site, Kind, Grade) VALUES"
+
+
+def run_sqlite(schema, facts, batch, directory):
+    """Insert the facts into an SQLite engine, returning the Alert facts and the time taken."""
+
+    site_facts, cleared_facts, sightings, expected = facts
+
+    path = os.path.join(directory, "postgresql.db")
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.executescript(schema)
+    db.execute("PRAGMA foreign_keys = 1")
+    db.execute("PRAGMA recursive_triggers = 1")
+
+    db.execute("BEGIN")
+    db.executemany(SITE.replace("%s", "?"), site_facts)
+    db.executemany(CLEARED.replace("%s", "?"), cleared_facts)
+    db.execute("COMMIT")
+
+    elapsed = 0.0
+    for i in range(0, len(sightings), batch):
+        started = time.perf_counter()
+        db.execute("BEGIN")
+        db.executemany(SIGHTING + "(?, ?, ?)", sightings[i:i + batch])
+        db.execute("COMMIT")
+        elapsed += time.perf_counter() - started
+
+    alerts = sorted(db.execute("SELECT Site, Kind FROM Giles_Alert_facts").fetchall())
+    db.close()
+    return alerts, elapsed
+
+
+def run_postgresql(schema, facts, batch, dsn, mode):
+    """Insert the facts into a PostgreSQL engine, returning the Alert facts and the time taken."""
+
+    site_facts, cleared_facts, sightings, expected = facts
+
+    db = psycopg2.connect(dsn)
+    cursor = db.cursor()
+    cursor.execute("DROP SCHEMA IF EXISTS giles_benchmark CASCADE")
+    cursor.execute("CREATE SCHEMA giles_benchmark")
+    cursor.execute("SET search_path TO giles_benchmark")
+    cursor.execute(schema)
+    cursor.executemany(SITE, site_facts)
+    cursor.executemany(CLEARED, cleared_facts)
+    db.commit()
+
+    try:
+        elapsed = 0.0
+        for i in range(0, len(sightings), batch):
+            rows = sightings[i:i + batch]
+            if mode == "batches":
+                statement = SIGHTING + ",".join(cursor.mogrify("(%s, %s, %s)", x).decode("utf-8") for x in rows)
+
+            started = time.perf_counter()
+            if mode == "batches":
+                cursor.execute(statement)
+            else:
+                cursor.executemany(SIGHTING + "(%s, %s, %s)", rows)
+            db.commit()
+            elapsed += time.perf_counter() - started
+
+        cursor.execute("SELECT Site, Kind FROM Giles_Alert_facts")
+        alerts = sorted(cursor.fetchall())
+
+    finally:
+        db.rollback()
+        cursor.execute("DROP SCHEMA giles_benchmark CASCADE")
+        db.commit()
+        db.close()
+
+    return alerts, elapsed
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Compare insertions into SQLite and PostgreSQL engines")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-D', '--database', dest='dsn', default=os.environ.get("GILES_POSTGRESQL"),
+                            help="the PostgreSQL connection string (the default is $GILES_POSTGRESQL)", metavar="DSN")
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the rule set, schemas, and SQLite database in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-n', '--facts', dest='facts', default=[], type=int, action='append',
+                            help="insert this many Sighting facts (may be given more than once; the default is 10000)",
+                            metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=None, type=argparse.FileType('w'),
+                            help="write the results to this file as JSON", metavar="OUTPUT")
+    arg_parser.add_argument('-s', '--sites', dest='sites', default=1000, type=int,
+                            help="the number of Site facts", metavar="SITES")
+    arg_parser.add_argument('--batch', dest='batch', default=[], type=int, action='append',
+                            help="the number of facts inserted in each transaction (may be given more than once; the default is 1 and 1000)",
+                            metavar="COUNT")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the contents of the facts", metavar="SEED")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if min(arguments.sites, *(arguments.facts + arguments.batch + [1])) < 1:
+        arg_parser.error("the numbers of facts and sites, and the batch sizes, must be at least 1")
+
+    if psycopg2 is None:
+        arg_parser.error("the psycopg2 module is required to connect to PostgreSQL")
+
+    if arguments.dsn is None:
+        arg_parser.error("no PostgreSQL connection string was given with -D or $GILES_POSTGRESQL")
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-postgresql-")
+    os.makedirs(directory, exist_ok=True)
+
+    results = {"giles": get_release_string(), "sqlite": sqlite3.sqlite_version, "sites": arguments.sites,
+               "seed": arguments.seed, "runs": []}
+
+    sys.stdout.write("%10s %10s %12s %10s %12s\n" % ("facts", "batch", "engine", "alerts", "insert us"))
+    try:
+        schemas = {"sqlite": compile_rules(directory, "sqlite"), "postgresql": compile_rules(directory, "postgresql")}
+        with psycopg2.connect(arguments.dsn) as db:
+            results["postgresql"] = db.server_version
+
+        for count in arguments.facts or [10000]:
+            facts = generate_facts(arguments.sites, count, arguments.seed)
+            for batch in arguments.batch or [1, 1000]:
+                for engine in ("sqlite", "pg-rows", "pg-batches"):
+                    if engine == "sqlite":
+                        alerts, elapsed = run_sqlite(schemas["sqlite"], facts, batch, directory)
+                    else:
+                        alerts, elapsed = run_postgresql(schemas["postgresql"], facts, batch, arguments.dsn, engine[3:])
+
+                    if alerts != facts[3]:
+                        raise Exception("expected %d Alert facts from %s, found %d" % (len(facts[3]), engine, len(alerts)))
+
+                    run = {"facts": count, "batch": batch, "engine": engine, "alerts": len(alerts), "seconds": elapsed,
+                           "insert_us": 1e6 * elapsed / count}
+                    results["runs"].append(run)
+                    sys.stdout.write("%10d %10d %12s %10d %12.1f\n" % (count, batch, engine, run["alerts"], run["insert_us"]))
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    if arguments.results_file is not None:
+        json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+        arguments.results_file.write("\n")
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
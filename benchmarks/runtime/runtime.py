@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Benchmark compiled engines on synthetic rule sets.
+#
+######################################################################
+
+"""
+runtime.py - benchmark compiled engines on synthetic rule sets
+
+The benchmark generates a rule set from a handful of parameters, compiles
+it with the SQLite backend, and drives the resulting engine with insert,
+delete, and mixed workloads. The results are written as JSON, so that runs
+made against different revisions of the compiler can be compared.
+
+The generated rule set has these parts:
+
+    Level0 ... LevelN   Input facts joined on their Item fields, one
+                        MatchAll clause per level (the match depth).
+    Block0 ... BlockN   Input facts matched by MatchNone clauses.
+    Threshold0 ...      Integer parameters matched by every rule.
+    Combine             A rule that asserts a Product fact for every match.
+    Distinct0 ...       Rules with the same predicate as Combine that make
+                        distinct productions of a Shared fact.
+    Veto, Suppress0 ... Suppression rules that suppress Product facts
+                        whose Item matches a Veto fact.
+
+Items are drawn uniformly from a range sized by the join selectivity: the
+probability that two facts join is the selectivity.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from giles import get_release_string
+from giles.giles import main as compile_main
+
+######################################################################
+#
+# Rule Set Generation
+#
+######################################################################
+
+
+def generate_rules(depth, match_none, distinct, suppress, parameters):
+    """Return the text of a rule set with the given shape."""
+
+    lines = ["Description: A synthetic rule set for benchmarking.", ""]
+
+    if parameters > 0:
+        lines.append("Parameters:")
+        for i in range(parameters):
+            lines += ["    Threshold%d:" % i, "        Default: 0", "        Lower:   0", "        Upper:   1000", ""]
+
+    lines.append("Facts:")
+    for name in ["Level%d" % i for i in range(depth)] + ["Block%d" % i for i in range(match_none)] + ["Product"]:
+        lines += ["    %s:" % name, "        Item:   INTEGER", "        Weight: INTEGER", ""]
+    if distinct > 0:
+        lines += ["    Shared:", "        Item:   INTEGER", ""]
+    if suppress > 0:
+        lines += ["    Veto:", "        Item:   INTEGER", ""]
+
+    predicate = ["        MatchAll:",
+                 "            - Fact:    Level0",
+                 "              Meaning: A fact at the first level.",
+                 "              Assign:",
+                 "                Item:   !expr This.Item",
+                 "                Weight: !expr This.Weight"]
+    for i in range(1, depth):
+        predicate += ["            - Fact:    Level%d" % i,
+                      "              Meaning: A fact at level %d with the same item." % i,
+                      "              When:    !expr This.Item == Locals.Item"]
+    for i in range(parameters):
+        predicate += ["            - Fact:    Threshold%d" % i,
+                      "              Meaning: The weight is at least the threshold.",
+                      "              When:    !expr This.Value <= Locals.Weight"]
+    if match_none > 0:
+        predicate.append("        MatchNone:")
+        for i in range(match_none):
+            predicate += ["            - Fact:    Block%d" % i,
+                          "              Meaning: The item is not blocked.",
+                          "              When:    !expr This.Item == Locals.Item"]
+
+    lines += ["Rules:",
+              "    Combine:",
+              "        Description: Every item at every level produces a product."] + predicate + [
+              "        Assert:",
+              "            Product:",
+              "                Item:   !expr Locals.Item",
+              "                Weight: !expr Locals.Weight",
+              ""]
+
+    for i in range(distinct):
+        lines += ["    Distinct%d:" % i,
+                  "        Description: Every item at every level is shared, once."] + predicate + [
+                  "        Assert: !distinct",
+                  "            Shared:",
+                  "                Item: !expr Locals.Item",
+                  ""]
+
+    for i in range(suppress):
+        lines += ["    Suppress%d:" % i,
+                  "        Description: Vetoed items produce no products.",
+                  "        MatchAll:",
+                  "            - Fact:    Veto",
+                  "              Meaning: The item is vetoed.",
+                  "              Assign:",
+                  "                Item: !expr This.Item",
+                  "        Suppress:",
+                  "            Fact: Product",
+                  "            When: !expr This.Item == Locals.Item AND This.Weight %% %d == %d" % (suppress, i),
+                  ""]
+
+    return "\n".join(lines)
+
+
+def compile_rules(text, directory, prefix, options):
+    """Compile a rule set, returning the schema."""
+
+    rules_file = os.path.join(directory, "bench.yml")
+    schema_file = os.path.join(directory, "bench.sql")
+    with open(rules_file, "w") as output:
+        output.write(text)
+
+    try:
+        compile_main(*(options + ["-p", prefix, "-o", schema_file, rules_file]))
+    except SystemExit as e:
+        if e.code != 0:
+            raise Exception("The generated rule set did not compile")
+
+    with open(schema_file, "r") as schema:
+        return schema.read()
+
+######################################################################
+#
+# Workloads
+#
+######################################################################
+
+
+class Engine:
+    """A compiled engine in a fresh database file."""
+
+    def __init__(self, path, schema, prefix):
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA foreign_keys = 1")
+        self.db.execute("PRAGMA recursive_triggers = 1")
+        self.db.executescript(schema)
+        self.prefix = prefix
+        self.live = []
+
+    def insert(self, fact, item, weight):
+        """Insert a fact, returning the time it took."""
+
+        fields = ("Item, Weight", "?, ?", (item, weight)) if fact.startswith(("Level", "Block")) else ("Item", "?", (item,))
+        started = time.perf_counter()
+        self.db.execute("INSERT INTO %s_%s_Facts(%s) VALUES(%s)" % (self.prefix, fact, fields[0], fields[1]), fields[2])
+        elapsed = time.perf_counter() - started
+
+        self.live.append((fact, self.db.execute("SELECT MAX(id) FROM _%s_%s_actual" % (self.prefix, fact)).fetchone()[0]))
+        return elapsed
+
+    def delete(self, index):
+        """Delete the fact at a position in the list of live facts, returning the time it took."""
+
+        fact, fact_id = self.live[index]
+        self.live[index] = self.live[-1]
+        self.live.pop()
+
+        started = time.perf_counter()
+        self.db.execute("DELETE FROM %s_%s_Facts WHERE id = ?" % (self.prefix, fact), (fact_id,))
+        return time.perf_counter() - started
+
+    def measure(self):
+        """Return the size of the database and the number of rows in each frames table."""
+
+        page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.db.execute("PRAGMA page_count").fetchone()[0]
+
+        frames = {}
+        for name, in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            if name.lower().endswith("_frames"):
+                frames[name] = self.db.execute("SELECT COUNT(*) FROM %s" % name).fetchone()[0]
+
+        return {"database_bytes": page_size * page_count, "frames_rows": sum(frames.values()), "frames": frames}
+
+    def close(self):
+        self.db.close()
+
+
+def percentile(values, p):
+    """Return the p-th percentile of some values, by the nearest-rank method."""
+
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(operations, latencies, elapsed, engine):
+    """Return the results of a workload."""
+
+    result = {
+        "operations": operations,
+        "seconds": elapsed,
+        "facts_per_second": operations / elapsed if elapsed > 0 else None
+    }
+
+    for kind, values in sorted(latencies.items()):
+        if len(values) > 0:
+            result["%s_p50_ms" % kind] = percentile(values, 50) * 1000.0
+            result["%s_p99_ms" % kind] = percentile(values, 99) * 1000.0
+
+    result.update(engine.measure())
+    return result
+
+
+def run(engine, operations, batch):
+    """Run some operations against an engine in batches, each in its own transaction."""
+
+    latencies = {"insert": [], "delete": []}
+    started = time.perf_counter()
+
+    for i, (kind, arguments) in enumerate(operations):
+        if i % batch == 0:
+            engine.db.execute("BEGIN")
+
+        latencies[kind].append(engine.insert(*arguments) if kind == "insert" else engine.delete(*arguments))
+
+        if i % batch == batch - 1 or i == len(operations) - 1:
+            engine.db.execute("COMMIT")
+
+    return latencies, time.perf_counter() - started
+
+
+def random_fact(rng, classes, items):
+    """Return the arguments for inserting a random fact."""
+
+    return ("insert", (rng.choice(classes), rng.randrange(items), rng.randrange(1000)))
+
+
+def workloads(arguments, schema, directory):
+    """Run the insert, delete, and mixed workloads, returning their results."""
+
+    rng = random.Random(arguments.seed)
+    items = max(1, int(round(1.0 / arguments.selectivity)))
+    classes = ["Level%d" % i for i in range(arguments.depth)] + ["Block%d" % i for i in range(arguments.match_none)]
+    classes += ["Veto"] if arguments.suppress > 0 else []
+    results = {}
+
+    engine = Engine(os.path.join(directory, "bench.db"), schema, arguments.prefix)
+    latencies, elapsed = run(engine, [random_fact(rng, classes, items) for i in range(arguments.facts)], arguments.batch)
+    results["insert"] = summarize(arguments.facts, latencies, elapsed, engine)
+
+    deletions = [("delete", (rng.randrange(len(engine.live) - i),)) for i in range(len(engine.live))]
+    latencies, elapsed = run(engine, deletions, arguments.batch)
+    results["delete"] = summarize(len(deletions), latencies, elapsed, engine)
+    engine.close()
+
+    engine = Engine(os.path.join(directory, "bench.db"), schema, arguments.prefix)
+    latencies = {"insert": [], "delete": []}
+    elapsed = 0.0
+    for i in range(0, arguments.facts, arguments.batch):
+        # Deletions are drawn from the facts that are live when the batch is built.
+        live = len(engine.live)
+        batch = []
+        for j in range(i, min(arguments.facts, i + arguments.batch)):
+            if live > 0 and rng.random() < arguments.delete_ratio:
+                batch.append(("delete", (rng.randrange(live),)))
+                live -= 1
+            else:
+                batch.append(random_fact(rng, classes, items))
+
+        more, seconds = run(engine, batch, arguments.batch)
+        elapsed += seconds
+        for kind, values in more.items():
+            latencies[kind] += values
+
+    results["mixed"] = summarize(arguments.facts, latencies, elapsed, engine)
+    engine.close()
+
+    return results
+
+######################################################################
+#
+# Comparison
+#
+######################################################################
+
+compared = ["facts_per_second", "insert_p50_ms", "insert_p99_ms", "delete_p50_ms", "delete_p99_ms", "database_bytes", "frames_rows"]
+
+
+def compare(output, baseline, results):
+    """Write a comparison of two sets of results."""
+
+    output.write("%-8s %-18s %14s %14s %9s\n" % ("workload", "metric", "baseline", "current", "change"))
+    for workload in sorted(results["workloads"]):
+        for metric in compared:
+            old = baseline.get("workloads", {}).get(workload, {}).get(metric)
+            new = results["workloads"][workload].get(metric)
+            if old is None or new is None:
+                continue
+            change = "%+.1f%%" % (100.0 * (new - old) / old) if old != 0 else "-"
+            output.write("%-8s %-18s %14.3f %14.3f %9s\n" % (workload, metric, old, new, change))
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def revision():
+    """Return the revision of the source tree, if it can be determined."""
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Benchmark a compiled engine on a synthetic rule set and workload")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-b', '--baseline', dest='baseline_file', default=None, type=argparse.FileType('r'),
+                            help="compare the results against these earlier results", metavar="BASELINE")
+    arg_parser.add_argument('-d', '--depth', dest='depth', default=3, type=int,
+                            help="the number of MatchAll clauses joined in each rule", metavar="DEPTH")
+    arg_parser.add_argument('-f', '--compact-frames', dest='compact_frames', default=False,
+                            action='store_const', const=True, help="compile the engine with compact frames")
+    arg_parser.add_argument('-k', '--keep', dest='keep', default=None,
+                            help="keep the rule set, schema, and database in this directory", metavar="DIRECTORY")
+    arg_parser.add_argument('-m', '--match-none', dest='match_none', default=1, type=int,
+                            help="the number of MatchNone clauses in each rule", metavar="COUNT")
+    arg_parser.add_argument('-n', '--facts', dest='facts', default=2000, type=int,
+                            help="the number of facts inserted by each workload", metavar="FACTS")
+    arg_parser.add_argument('-o', '--output', dest='results_file', default=sys.stdout, type=argparse.FileType('w'),
+                            help="write the results to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-p', '--parameters', dest='parameters', default=1, type=int,
+                            help="the number of parameters matched by each rule", metavar="COUNT")
+    arg_parser.add_argument('-r', '--distinct', dest='distinct', default=1, type=int,
+                            help="the number of rules making distinct productions", metavar="COUNT")
+    arg_parser.add_argument('-s', '--selectivity', dest='selectivity', default=0.001, type=float,
+                            help="the probability that two facts join", metavar="SELECTIVITY")
+    arg_parser.add_argument('-u', '--suppress', dest='suppress', default=1, type=int,
+                            help="the number of suppression rules", metavar="COUNT")
+    arg_parser.add_argument('-x', '--delete-ratio', dest='delete_ratio', default=0.3, type=float,
+                            help="the fraction of operations in the mixed workload that are deletions", metavar="RATIO")
+    arg_parser.add_argument('--batch', dest='batch', default=1000, type=int,
+                            help="the number of operations in each transaction", metavar="COUNT")
+    arg_parser.add_argument('--prefix', dest='prefix', default="Bench",
+                            help="the prefix to compile the engine with", metavar="PREFIX")
+    arg_parser.add_argument('--seed', dest='seed', default=0, type=int,
+                            help="the seed for the random workloads", metavar="SEED")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if arguments.depth < 1 or min(arguments.match_none, arguments.parameters, arguments.distinct, arguments.suppress) < 0:
+        arg_parser.error("the depth must be at least 1 and the counts must not be negative")
+    if not 0.0 < arguments.selectivity <= 1.0:
+        arg_parser.error("the selectivity must be greater than 0 and at most 1")
+
+    directory = arguments.keep if arguments.keep is not None else tempfile.mkdtemp(prefix="giles-bench-")
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        text = generate_rules(arguments.depth, arguments.match_none, arguments.distinct, arguments.suppress, arguments.parameters)
+        options = ["-f"] if arguments.compact_frames else []
+        started = time.perf_counter()
+        schema = compile_rules(text, directory, arguments.prefix, options)
+        compile_seconds = time.perf_counter() - started
+
+        results = {
+            "giles": get_release_string(),
+            "revision": revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "parameters": {
+                "batch": arguments.batch,
+                "compact_frames": arguments.compact_frames,
+                "delete_ratio": arguments.delete_ratio,
+                "depth": arguments.depth,
+                "distinct": arguments.distinct,
+                "facts": arguments.facts,
+                "match_none": arguments.match_none,
+                "parameters": arguments.parameters,
+                "seed": arguments.seed,
+                "selectivity": arguments.selectivity,
+                "suppress": arguments.suppress
+            },
+            "compile_seconds": compile_seconds,
+            "schema_bytes": len(schema),
+            "workloads": workloads(arguments, schema, directory)
+        }
+
+    finally:
+        if arguments.keep is None:
+            shutil.rmtree(directory)
+
+    json.dump(results, arguments.results_file, indent=4, sort_keys=True)
+    arguments.results_file.write("\n")
+
+    if arguments.baseline_file is not None:
+        compare(sys.stderr, json.load(arguments.baseline_file), results)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Audit the query plans of a compiled engine's triggers.
+#
+######################################################################
+
+"""
+audit.py - audit the query plans of a compiled engine's triggers
+
+The auditor loads a compiled schema into an in-memory database and asks
+SQLite for the query plan of every statement (and WHEN clause) in every
+trigger. References to the NEW and OLD rows are replaced by bound
+parameters, which stand for the values of the row that fires the
+trigger. Any plan that scans a fact or frames table is reported.
+
+Some scans are expected (an unconstrained join must scan, and so must
+the serialization triggers), so scans can be compared against a baseline
+of known scans; only scans missing from the baseline are considered new.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import re
+import sqlite3
+import sys
+
+from giles import get_release_string
+from giles.profile import split_trigger_name
+
+######################################################################
+#
+# Extracting Trigger Statements
+#
+######################################################################
+
+
+def trigger_statements(sql):
+    """Return the WHEN clause (or None) and the statements of a trigger.
+
+    >>> trigger_statements("CREATE TRIGGER t AFTER INSERT ON x WHEN new.a > 1 BEGIN DELETE FROM y; SELECT ';'; END")
+    ('new.a > 1', ['DELETE FROM y', "SELECT ';'"])
+    >>> trigger_statements("CREATE TRIGGER t AFTER INSERT ON x BEGIN DELETE FROM y; END")
+    (None, ['DELETE FROM y'])
+    """
+
+    begin = re.search(r"\bBEGIN\b", sql, re.IGNORECASE)
+    end = re.search(r"\bEND\s*;?\s*$", sql, re.IGNORECASE)
+    when = re.search(r"\bWHEN\b(.*)$", sql[:begin.start()], re.IGNORECASE | re.DOTALL)
+
+    statements = []
+    buffer = ""
+    for piece in sql[begin.end():end.start()].split(";"):
+        buffer += piece + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \t\r\n;") != "":
+                statements.append(buffer.strip(" \t\r\n;"))
+            buffer = ""
+
+    return when.group(1).strip() if when is not None else None, statements
+
+
+def standalone(statement):
+    """Rewrite a trigger statement so that it can be prepared outside of its trigger.
+
+    >>> standalone("DELETE FROM y WHERE id = old.id AND a = NEW.a")
+    'DELETE FROM y WHERE id = :old_id AND a = :new_a'
+    >>> standalone("SELECT RAISE(ROLLBACK, 'No.') WHERE new.a IS NULL")
+    'SELECT NULL WHERE :new_a IS NULL'
+    """
+
+    statement = re.sub(r"\b(new|old)\.(\w+)", lambda x: ":%s_%s" % (x.group(1).lower(), x.group(2)), statement, flags=re.IGNORECASE)
+    return re.sub(r"\bRAISE\s*\((?:[^()']|'[^']*')*\)", "NULL", statement, flags=re.IGNORECASE)
+
+######################################################################
+#
+# Auditing
+#
+######################################################################
+
+scan_pattern = re.compile(r"^SCAN (?:TABLE )?(\S+)(.*)$")
+audited_pattern = re.compile(r"_(actual|shadow|frames)$", re.IGNORECASE)
+
+
+def audit(db):
+    """Return the scans of fact and frames tables as (trigger, statement, table, detail) tuples.
+
+    The statement is "when" for a trigger's WHEN clause and the statement's
+    position within the trigger otherwise.
+    """
+
+    scans = []
+    for name, sql in db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name").fetchall():
+        when, statements = trigger_statements(sql)
+        queries = [("when", "SELECT " + when)] if when is not None else []
+        queries += [(str(i), x) for i, x in enumerate(statements)]
+
+        for position, query in queries:
+            query = standalone(query)
+            parameters = dict((x, None) for x in re.findall(r":(\w+)", query))
+            for row in db.execute("EXPLAIN QUERY PLAN " + query, parameters):
+                match = scan_pattern.match(row[-1])
+                if match is not None and audited_pattern.search(match.group(1)):
+                    scans.append((name, position, match.group(1), row[-1]))
+
+    return scans
+
+
+def scan_key(scan):
+    """Return the baseline line for a scan."""
+
+    return "%s %s %s" % scan[:3]
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Audit the query plans of a compiled engine's triggers")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-b', '--baseline', dest='baseline_file', default=None, type=argparse.FileType('r'),
+                            help="only report scans not listed in this file", metavar="BASELINE")
+    arg_parser.add_argument('-o', '--output', dest='report_file', default=sys.stdout, type=argparse.FileType('w'),
+                            help="write the report to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-w', '--write-baseline', dest='new_baseline_file', default=None, type=argparse.FileType('w'),
+                            help="write the scans found to this file, for use with -b", metavar="BASELINE")
+    arg_parser.add_argument('schema_file', type=argparse.FileType('r'), help="the compiled schema", metavar="SCHEMA")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    db = sqlite3.connect(":memory:")
+    db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) is not None else 0)
+    db.executescript(arguments.schema_file.read())
+
+    prefix = "_" + arguments.prefix
+    try:
+        rules = [x[0] for x in db.execute("SELECT name FROM %s_rules" % prefix)]
+    except sqlite3.Error:
+        rules = []
+
+    scans = audit(db)
+    known = set()
+    if arguments.baseline_file is not None:
+        known = set(x.strip() for x in arguments.baseline_file if x.strip() != "" and not x.startswith("#"))
+
+    new = [x for x in scans if scan_key(x) not in known]
+    output = arguments.report_file
+    by_rule = {}
+    for scan in new:
+        rule = split_trigger_name(scan[0], prefix, rules)[0]
+        by_rule.setdefault(rule if rule is not None else "(engine)", []).append(scan)
+
+    for rule in sorted(by_rule):
+        output.write("%s\n" % rule)
+        for trigger, position, table, detail in by_rule[rule]:
+            output.write("    %s (%s): %s\n" % (trigger, "WHEN clause" if position == "when" else "statement %s" % position, detail))
+
+    gone = known - set(scan_key(x) for x in scans)
+    output.write("%d scans of fact or frames tables, %d new" % (len(scans), len(new)))
+    output.write(", %d no longer present\n" % len(gone) if arguments.baseline_file is not None else "\n")
+
+    if arguments.new_baseline_file is not None:
+        for key in sorted(set(scan_key(x) for x in scans)):
+            arguments.new_baseline_file.write("%s\n" % key)
+        arguments.new_baseline_file.close()
+
+    db.close()
+    sys.exit(1 if len(new) > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -156,6 +156,7 @@ names = set([
     "completion",
     "compress",
     "compute",
+    "concurrently",
     "condition",
     "condition_number",
     "connect",
@@ -339,6 +340,7 @@ names = set([
     "groupin",
     "handler",
     "havin",
+    "having",
     "header",
     "heap",
     "hierarchy",
@@ -416,6 +418,7 @@ names = set([
     "last_insert_id",
     "lateral",
     "leadin",
+    "leading",
     "least",
     "leave",
     "left",
@@ -576,6 +579,7 @@ names = set([
     "percentile_cont",
     "percentile_disc",
     "placin",
+    "placing",
     "plan",
     "pli",
     "position",
@@ -649,6 +653,7 @@ names = set([
     "returned_length",
     "returned_octet_length",
     "returned_sqlstate",
+    "returning",
     "returns",
     "revoke",
     "right",
@@ -792,6 +797,7 @@ names = set([
     "top",
     "top_level_count",
     "trailin",
+    "trailing",
     "tran",
     "transaction",
     "transaction_active",
@@ -840,6 +846,7 @@ names = set([
     "user_defined_type_name",
     "user_defined_type_schema",
     "usin",
+    "using",
     "utc_date",
     "utc_time",
     "utc_timestamp",
@@ -857,6 +864,7 @@ names = set([
     "varcharacter",
     "variable",
     "variables",
+    "variadic",
     "varyin",
     "verbose",
     "view",
@@ -72,9 +72,13 @@ def error(*strings):
 #
 ######################################################################
 
+from giles import postgresql_backend
+from giles import python_backend
 from giles import sqlite_backend
 
 backends = {
+    "postgresql": postgresql_backend,
+    "python": python_backend,
     "sqlite": sqlite_backend
 }
 
@@ -153,7 +157,15 @@ ValidMatch = Dictionary(
 
     optional={
         "When": InstanceOf(DelayedExpression),
-        "Assign": Dictionary(min_extra=1, case_sensitive=False, extra_keys=ValidName, extra=AnyExpression)
+        "Assign": Dictionary(min_extra=1, case_sensitive=False, extra_keys=ValidName, extra=AnyExpression),
+        "Within": Integer(minimum=0),
+        "After": Integer(minimum=0),
+        "GroupBy": List(ValidName, min_length=1),
+        "Filter": InstanceOf(DelayedExpression),
+        "Count": ValidName,
+        "Sum": Dictionary(min_extra=1, max_extra=1, case_sensitive=False, extra_keys=ValidName, extra=ValidName),
+        "Min": Dictionary(min_extra=1, max_extra=1, case_sensitive=False, extra_keys=ValidName, extra=ValidName),
+        "Max": Dictionary(min_extra=1, max_extra=1, case_sensitive=False, extra_keys=ValidName, extra=ValidName)
     })
 
 ValidParameter = Dictionary(
@@ -169,6 +181,14 @@ ValidParameter = Dictionary(
         "Upper": AnyExpression
     })
 
+ValidRetention = Dictionary(
+    case_sensitive=False,
+
+    optional={
+        "MaxAge": Integer(minimum=1),
+        "MaxCount": Integer(minimum=0)
+    })
+
 ValidProduce = DistinctProductionDeclaration(min_extra=1,
                                              max_extra=1,
                                              case_sensitive=False,
@@ -254,7 +274,12 @@ partial_validator = Dictionary(
         "Rules": Dictionary(min_extra=1,
                             case_sensitive=False,
                             extra_keys=ValidName,
-                            extra=ValidRule)
+                            extra=ValidRule),
+
+        "Retain": Dictionary(min_extra=1,
+                             case_sensitive=False,
+                             extra_keys=ValidName,
+                             extra=ValidRetention)
     })
 
 validator = Dictionary(
@@ -274,7 +299,12 @@ validator = Dictionary(
         "Functions": Dictionary(min_extra=1,
                                 case_sensitive=False,
                                 extra_keys=ValidName,
-                                extra=ValidFunction)
+                                extra=ValidFunction),
+
+        "Retain": Dictionary(min_extra=1,
+                             case_sensitive=False,
+                             extra_keys=ValidName,
+                             extra=ValidRetention)
     },
 
     required={
@@ -320,6 +350,8 @@ def main(*args):
     distincts = set([])  # Facts that are produced in distinct productions
     functions = {}       # Defined external functions, indexed by name
     parameters = {}      # Defined parameters, indexed by name
+    retention = {}       # Fact retention policies, indexed by fact name
+    aggregates = {}      # Aggregates computed for aggregate matches, indexed by name
     rules = {}           # Defined rules, indexed by name
     facts = {            # Defined facts, indexed by name
         CS("InitialFact"): {
@@ -340,6 +372,16 @@ def main(*args):
                             help="generate a schema using this backend", metavar="BACKEND", choices=backends.keys())
     arg_parser.add_argument('-c', '--allow-cycles', dest='check_cycles', default=True,
                             action='store_const', const=False, help="allow cycles in the rule set")
+    arg_parser.add_argument('-d', '--dispatch', dest='dispatch', default=False,
+                            action='store_const', const=True, help="share triggers between the matches on each fact class")
+    arg_parser.add_argument('-f', '--compact-frames', dest='compact_frames', default=False,
+                            action='store_const', const=True, help="store only newly-bound and still-needed values in each frame")
+    arg_parser.add_argument('-g', '--gauges', dest='gauges', default=False,
+                            action='store_const', const=True, help="maintain row counts for every fact and frames table")
+    arg_parser.add_argument('-i', '--instrument', dest='instrument', default=False,
+                            action='store_const', const=True, help="count each rule's activity in a statistics table")
+    arg_parser.add_argument('-j', '--provenance', dest='provenance', default=False,
+                            action='store_const', const=True, help="record the facts each produced fact was derived from")
     arg_parser.add_argument('-r', '--allow-regexp', dest='allow_regexp', default=False,
                             action='store_const', const=True, help="allow regexp operator in expressions")
     arg_parser.add_argument('-p', '--prefix',
@@ -410,7 +452,8 @@ def main(*args):
             CS("Parameters"): {},
             CS("Functions"): {},
             CS("Facts"): {},
-            CS("Rules"): {}
+            CS("Rules"): {},
+            CS("Retain"): {}
         }
 
         for input_file in arguments.files:
@@ -545,6 +588,32 @@ def main(*args):
 
                 error("Error processing parameters:", e)
 
+    ######################################################################
+    #
+    # Load Retention Policies
+    #
+    ######################################################################
+
+    if CS("Retain") in document:
+        for name, clause in document[CS("Retain")].items():
+            try:
+                if name not in facts:
+                    raise Exception("Unknown fact '%s'" % name)
+
+                if name in parameters:
+                    raise Exception("Parameter facts cannot have retention policies")
+
+                if CS("MaxAge") not in clause and CS("MaxCount") not in clause:
+                    raise Exception("Retention policy for '%s' specifies neither MaxAge nor MaxCount" % name)
+
+                retention[name] = {
+                    "max_age": clause[CS("MaxAge")] if CS("MaxAge") in clause else None,
+                    "max_count": clause[CS("MaxCount")] if CS("MaxCount") in clause else None
+                }
+
+            except Exception as e:
+                error("Error processing retention policies:", e)
+
     ######################################################################
     #
     # Load Rules
@@ -594,6 +663,73 @@ def main(*args):
                 fact = match_clause[CS("Fact")]
                 if fact not in facts:
                     raise Exception("Unknown fact '%s'" % fact)
+
+                ##############################################################
+                #
+                # Aggregate matches match the groups of a fact class
+                # instead of its facts. Each group is represented by a
+                # synthetic fact with the grouped fields and the value
+                # of the aggregate.
+                #
+                ##############################################################
+
+                aggregate_functions = [x for x in ("Count", "Sum", "Min", "Max") if CS(x) in match_clause]
+                if CS("GroupBy") in match_clause:
+                    if len(aggregate_functions) != 1:
+                        raise Exception("Aggregate matches must specify exactly one of Count, Sum, Min, or Max")
+
+                    if fact in parameters:
+                        raise Exception("Parameters cannot be aggregated")
+
+                    group_by = [CS(x) for x in match_clause[CS("GroupBy")]]
+                    for field in group_by:
+                        if field not in facts[fact]:
+                            raise Exception("Unknown field '%s' in GroupBy" % field)
+
+                    if len(set(group_by)) != len(group_by):
+                        raise Exception("Duplicate field in GroupBy")
+
+                    function = aggregate_functions[0].lower()
+                    if function == "count":
+                        name, field, kind = CS(match_clause[CS("Count")]), None, int
+
+                    else:
+                        name, field = list(match_clause[CS(aggregate_functions[0])].items())[0]
+                        name, field = CS(name), CS(field)
+                        if field not in facts[fact]:
+                            raise Exception("Unknown field '%s' in %s" % (field, aggregate_functions[0]))
+
+                        kind = facts[fact][field]
+                        if kind is bool or (function == "sum" and kind is str):
+                            raise Exception("Cannot compute %s of a field of type %s" % (function, kind.__name__))
+
+                    if name in group_by:
+                        raise Exception("Aggregate '%s' has the same name as a grouped field" % name)
+
+                    source_filter = evaluate(match_clause[CS("Filter")], None, facts[fact]) if CS("Filter") in match_clause else None
+                    if source_filter is not None:
+                        if not isinstance(source_filter, JoinNode):
+                            if not isinstance(source_filter, BinaryOpNode) or not isinstance(source_filter.arg1, ThisReferenceNode):
+                                raise Exception("Filter of aggregate match is not a joinable predicate (%s)" % source_filter)
+
+                    aggregate = CS("%s_%s_%d" % (rule_name, fact, len(matches)))
+                    aggregates[aggregate] = {
+                        "source": fact,
+                        "filter": source_filter,
+                        "group_by": group_by,
+                        "function": function,
+                        "field": field,
+                        "name": name,
+                        "match": match
+                    }
+
+                    facts[aggregate] = {x: facts[fact][x] for x in group_by}
+                    facts[aggregate][name] = kind
+                    fact = aggregate
+
+                elif len(aggregate_functions) > 0 or CS("Filter") in match_clause:
+                    raise Exception("Count, Sum, Min, Max, and Filter are only allowed in aggregate matches")
+
                 match["fact"] = fact
 
                 match["meaning"] = match_clause[CS("meaning")] if CS("meaning") in match_clause else None
@@ -614,6 +750,18 @@ def main(*args):
                         match["assignments"][assignment] = value
                         local_vars[assignment] = type(value) if not isinstance(value, Node) else value.type
 
+                match["within"] = match_clause[CS("Within")] if CS("Within") in match_clause else None
+                match["after"] = match_clause[CS("After")] if CS("After") in match_clause else None
+                if match["within"] is not None or match["after"] is not None:
+                    if len(matches) == 0:
+                        raise Exception("Temporal constraints require a preceding match")
+
+                    if fact in parameters or matches[-1]["fact"] in parameters:
+                        raise Exception("Temporal constraints cannot be applied to parameters")
+
+                    if match["within"] is not None and match["after"] is not None and match["after"] > match["within"]:
+                        raise Exception("Temporal constraint can never be satisfied (After > Within)")
+
                 matches.append(match)
 
             ##################################################################
@@ -772,6 +920,8 @@ def main(*args):
     for rule_name, rule_clause in rules.items():
         for match_clause in rule_clause["matches"]:
             only_produced.discard(match_clause["fact"])
+            if match_clause["fact"] in aggregates:
+                only_produced.discard(aggregates[match_clause["fact"]]["source"])
 
         for match_clause in rule_clause["inverted_matches"]:
             only_produced.discard(match_clause["fact"])
@@ -823,7 +973,9 @@ def main(*args):
             reachable = set([])
 
             for other_rule, rule_clause in rules.items():
-                if produced in [x["fact"] for x in rule_clause["matches"] + rule_clause["inverted_matches"]]:
+                matched = [x["fact"] for x in rule_clause["matches"] + rule_clause["inverted_matches"]]
+                matched += [aggregates[x]["source"] for x in matched if x in aggregates]
+                if produced in matched:
                     reachable.add(other_rule)
 
             return reachable
@@ -844,7 +996,14 @@ def main(*args):
     try:
         description = document[CS("Description")] if CS("Description") in document else ""
         arguments.schema_file.write(backends[arguments.backend].generate(arguments.prefix, ",".join(x.name for x in arguments.files),
-                                                                         description, facts, parameters, rules))
+                                                                         description, facts, parameters, rules,
+                                                                         compact_frames=arguments.compact_frames,
+                                                                         retention=retention,
+                                                                         aggregates=aggregates,
+                                                                         instrument=arguments.instrument,
+                                                                         gauges=arguments.gauges,
+                                                                         provenance=arguments.provenance,
+                                                                         dispatch=arguments.dispatch))
         arguments.schema_file.close()
         sys.exit(0)
 
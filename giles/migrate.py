@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Copy the facts of one compiled engine into another.
+#
+######################################################################
+
+"""
+migrate.py - copy the facts of one compiled engine into another
+
+The engine's own upgrade path serializes every fact into key-value rows
+and rebuilds each fact with one subquery per field, which is slow for
+large engines. This tool instead attaches the old engine's database to
+the new one and copies each fact class with a single INSERT ... SELECT
+per batch, mapping fact classes and fields by name (or as directed) and
+filling fields that the old fact class lacks with default values.
+
+As with the built-in upgrade, only the facts that were inserted from
+outside the engine are copied; the new engine's rules produce the rest
+as the facts arrive. Aggregates are maintained by the engine and are
+never copied, and neither is the InitialFact, which every engine
+creates for itself.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from giles import get_release_string
+from giles.profile import write_table
+
+######################################################################
+#
+# Reading Compiled Schemas
+#
+######################################################################
+
+# The columns of an actual table that are maintained by the engine rather than being fields of the fact.
+ADMINISTRATIVE_COLUMNS = frozenset(["rule", "frame", "inserted_at", "id"])
+
+# The value given to a field that the old fact class lacks, by declared type; the upgrade triggers use the same defaults.
+TYPE_DEFAULTS = {"INTEGER": 0, "REAL": 0.0, "TEXT": ""}
+
+
+def fact_classes(db, schema, prefix):
+    """Return a dictionary mapping the lower-cased name of each fact class that can be copied to its name and fields.
+
+    Each field is a (name, declared type) pair. A fact class can be copied if it has a public facts view; aggregates
+    do not. The InitialFact is never copied.
+
+    >>> db = sqlite3.connect(":memory:")
+    >>> _ = db.execute("CREATE TABLE _Giles_Word_actual(Name TEXT NOT NULL, Size INTEGER NOT NULL, rule INTEGER, frame INTEGER, "
+    ...                "id INTEGER PRIMARY KEY)")
+    >>> _ = db.execute("CREATE VIEW Giles_Word_facts AS SELECT Name, Size, id FROM _Giles_Word_actual")
+    >>> _ = db.execute("CREATE TABLE _Giles_Count_actual(Value INTEGER NOT NULL, rule INTEGER, frame INTEGER, id INTEGER PRIMARY KEY)")
+    >>> fact_classes(db, "main", "Giles")
+    {'word': ('Word', [('Name', 'TEXT'), ('Size', 'INTEGER')])}
+    """
+
+    tables = {}
+    views = set()
+    for kind, name in db.execute("SELECT type, name FROM \"%s\".sqlite_master WHERE type IN ('table', 'view')" % schema):
+        if kind == "table":
+            match = re.match(r"(?i)^_%s_([A-Za-z0-9]+)_actual$" % re.escape(prefix), name)
+            if match:
+                tables[match.group(1).lower()] = (match.group(1), name)
+        else:
+            match = re.match(r"(?i)^%s_([A-Za-z0-9]+)_facts$" % re.escape(prefix), name)
+            if match:
+                views.add(match.group(1).lower())
+
+    result = {}
+    for key, (name, table) in sorted(tables.items()):
+        if key in views and key != "initialfact":
+            fields = [(x[1], x[2].upper()) for x in db.execute("PRAGMA \"%s\".table_info(\"%s\")" % (schema, table))
+                      if x[1].lower() not in ADMINISTRATIVE_COLUMNS]
+            result[key] = (name, fields)
+
+    return result
+
+
+def parameter_names(db, schema, prefix):
+    """Return the lower-cased names of the fact classes that are parameters, which are set through the parameters view.
+
+    >>> db = sqlite3.connect(":memory:")
+    >>> _ = db.execute("CREATE TABLE t(x)")
+    >>> _ = db.execute("CREATE TRIGGER _Giles_insert_Limit_parameters AFTER INSERT ON t BEGIN SELECT 1; END")
+    >>> _ = db.execute("CREATE TRIGGER _Giles_insert_with_key_Limit_parameters AFTER INSERT ON t BEGIN SELECT 1; END")
+    >>> sorted(parameter_names(db, "main", "Giles"))
+    ['limit']
+    """
+
+    result = set()
+    for (name,) in db.execute("SELECT name FROM \"%s\".sqlite_master WHERE type = 'trigger'" % schema):
+        match = re.match(r"(?i)^_%s_insert_([A-Za-z0-9]+)_parameters$" % re.escape(prefix), name)
+        if match:
+            result.add(match.group(1).lower())
+
+    return result
+
+######################################################################
+#
+# Mapping Fact Classes
+#
+######################################################################
+
+
+def parse_mappings(mappings):
+    """Parse OLD=NEW mappings of fact classes and fields into two dictionaries keyed by lower-cased old names.
+
+    A fact class mapped to nothing is not copied.
+
+    >>> facts, fields = parse_mappings(["Host=Machine", "Host.Addr=Address", "Scratch="])
+    >>> sorted(facts.items())
+    [('host', 'Machine'), ('scratch', None)]
+    >>> fields
+    {('host', 'addr'): 'Address'}
+    >>> parse_mappings(["Host.Addr=Machine.Address"])
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid mapping 'Host.Addr=Machine.Address'
+    """
+
+    facts = {}
+    fields = {}
+    for mapping in mappings:
+        match = re.match(r"^([A-Za-z0-9]+)(?:\.([A-Za-z0-9]+))?=([A-Za-z0-9]*)$", mapping.strip())
+        if match is None or (match.group(2) is not None and match.group(3) == ""):
+            raise ValueError("invalid mapping '%s'" % mapping)
+
+        if match.group(2) is None:
+            facts[match.group(1).lower()] = match.group(3) or None
+        else:
+            fields[(match.group(1).lower(), match.group(2).lower())] = match.group(3)
+
+    return facts, fields
+
+
+def parse_defaults(defaults):
+    """Parse FACT.FIELD=VALUE defaults into a dictionary keyed by lower-cased new names.
+
+    >>> parse_defaults(["Machine.Owner=nobody", "Machine.Port=22"])
+    {('machine', 'owner'): 'nobody', ('machine', 'port'): '22'}
+    """
+
+    result = {}
+    for default in defaults:
+        match = re.match(r"^([A-Za-z0-9]+)\.([A-Za-z0-9]+)=(.*)$", default)
+        if match is None:
+            raise ValueError("invalid default '%s'" % default)
+        result[(match.group(1).lower(), match.group(2).lower())] = match.group(3)
+
+    return result
+
+
+class Copy:
+    """The copying of one old fact class into a new one."""
+
+    def __init__(self, old, new, columns, parameters, dropped):
+        self.old = old                  # The name of the old fact class.
+        self.new = new                  # The name of the new fact class.
+        self.columns = columns          # (new field, old field or None, declared type, default) for each new field.
+        self.parameters = parameters    # True if the new fact class is a parameter.
+        self.dropped = dropped          # The old fields that are not copied.
+
+
+def plan(source, destination, parameters, mappings, defaults):
+    """Return the copies needed to migrate facts between two sets of fact classes, and warnings about what is lost.
+
+    >>> source = {"host": ("Host", [("Addr", "TEXT"), ("Seen", "INTEGER")])}
+    >>> destination = {"machine": ("Machine", [("Address", "TEXT"), ("Port", "INTEGER")])}
+    >>> copies, warnings = plan(source, destination, set(), parse_mappings(["Host=Machine", "Host.Addr=Address"]),
+    ...                         parse_defaults(["Machine.Port=22"]))
+    >>> [(x.old, x.new, x.columns, x.dropped) for x in copies]
+    [('Host', 'Machine', [('Address', 'Addr', 'TEXT', None), ('Port', None, 'INTEGER', '22')], ['Seen'])]
+    >>> warnings
+    ['Host.Seen is not copied']
+    """
+
+    fact_mappings, field_mappings = mappings
+    copies = []
+    warnings = []
+
+    for key, (old, old_fields) in sorted(source.items()):
+        new_key = fact_mappings.get(key, old)
+        if new_key is None:
+            continue
+
+        new_key = new_key.lower()
+        if new_key not in destination:
+            warnings.append("%s has no counterpart and is not copied" % old)
+            continue
+
+        new, new_fields = destination[new_key]
+        old_types = dict((x[0].lower(), x) for x in old_fields)
+        wanted = dict((field_mappings.get((key, x[0].lower()), x[0]).lower(), x[0]) for x in old_fields)
+
+        columns = []
+        for field, declared in new_fields:
+            old_field = wanted.get(field.lower())
+            default = defaults.get((new_key, field.lower()))
+            columns.append((field, old_types[old_field.lower()][0] if old_field is not None else None, declared, default))
+
+        used = set(x[1].lower() for x in columns if x[1] is not None)
+        dropped = [x[0] for x in old_fields if x[0].lower() not in used]
+        warnings.extend("%s.%s is not copied" % (old, x) for x in dropped)
+
+        copies.append(Copy(old, new, columns, new_key in parameters, dropped))
+
+    return copies, warnings
+
+######################################################################
+#
+# Copying Facts
+#
+######################################################################
+
+
+def select_list(copy):
+    """Return the expressions that compute the new fields of a copy from the old fact class, with their parameters."""
+
+    expressions = []
+    arguments = []
+    for field, old_field, declared, default in copy.columns:
+        if old_field is not None:
+            expressions.append("CAST(\"%s\" AS %s)" % (old_field, declared))
+        else:
+            expressions.append("CAST(? AS %s)" % declared)
+            arguments.append(default if default is not None else TYPE_DEFAULTS.get(declared, ""))
+
+    return expressions, arguments
+
+
+def copy_facts(db, copy, source_prefix, prefix, batch, progress):
+    """Copy the externally-inserted facts of an old fact class into the new one, a batch per transaction.
+
+    Returns the number of facts copied. The progress function is called after each batch with the number of facts
+    copied so far and the number to copy.
+    """
+
+    table = "source.\"_%s_%s_actual\"" % (source_prefix, copy.old)
+    total = db.execute("SELECT COUNT(*) FROM %s WHERE frame IS NULL" % table).fetchone()[0]
+    expressions, arguments = select_list(copy)
+
+    if copy.parameters:
+        # Parameters are set through the parameters view, so that a single-valued parameter replaces its default.
+        key = [x for x in copy.columns if x[0].lower() == "key"]
+        value = [x for x in copy.columns if x[0].lower() == "value"]
+        insert = "INSERT INTO main.\"%s_parameters\"(name, key, value) SELECT '%s', %s, %s" % \
+                 (prefix, copy.new, expressions[copy.columns.index(key[0])] if key else "NULL",
+                  expressions[copy.columns.index(value[0])])
+    else:
+        insert = "INSERT INTO main.\"_%s_%s_actual\"(%s) SELECT %s" % \
+                 (prefix, copy.new, ", ".join("\"%s\"" % x[0] for x in copy.columns), ", ".join(expressions))
+
+    bound = "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM %s WHERE frame IS NULL AND id > ? ORDER BY id LIMIT ?)" % table
+    statement = "%s FROM %s WHERE frame IS NULL AND id > ? AND id <= ? ORDER BY id" % (insert, table)
+
+    copied = 0
+    last = -1
+    while copied < total:
+        upper, count = db.execute(bound, (last, batch)).fetchone()
+        if upper is None:
+            break
+
+        db.execute("BEGIN")
+        db.execute(statement, arguments + [last, upper])
+        db.execute("COMMIT")
+
+        copied += count
+        last = upper
+        progress(copied, total)
+
+    return copied
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Copy the facts of one compiled engine into another")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-b', '--batch', dest='batch', default=10000, type=int,
+                            help="copy this many facts in each transaction", metavar="COUNT")
+    arg_parser.add_argument('-c', '--schema', dest='schema_file', default=None, type=argparse.FileType('r'),
+                            help="load this compiled schema into the new database first", metavar="SCHEMA")
+    arg_parser.add_argument('-d', '--default', dest='defaults', default=[], action='append',
+                            help="give FIELD of the new fact class FACT this value when the old fact class lacks it",
+                            metavar="FACT.FIELD=VALUE")
+    arg_parser.add_argument('-m', '--map', dest='mappings', default=[], action='append',
+                            help="copy the old fact class or field OLD to NEW", metavar="OLD=NEW")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the new engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-q', '--quiet', dest='quiet', default=False, action='store_const', const=True,
+                            help="do not report progress or warnings")
+    arg_parser.add_argument('-s', '--source-prefix', dest='source_prefix', default=None,
+                            help="the prefix the old engine was compiled with (by default, the same as the new one)",
+                            metavar="PREFIX")
+    arg_parser.add_argument('source', type=str, help="the database holding the old engine", metavar="SOURCE")
+    arg_parser.add_argument('destination', type=str, help="the database holding the new engine", metavar="DESTINATION")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if arguments.batch < 1:
+        arg_parser.error("the batch size must be at least 1")
+
+    try:
+        mappings = parse_mappings(arguments.mappings)
+        defaults = parse_defaults(arguments.defaults)
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    if not os.path.exists(arguments.source):
+        sys.stderr.write("%s does not exist\n" % arguments.source)
+        sys.exit(1)
+
+    source_prefix = arguments.source_prefix or arguments.prefix
+    db = sqlite3.connect(arguments.destination, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: re.search(x, y) is not None)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA recursive_triggers = ON")
+
+    if arguments.schema_file is not None:
+        db.executescript(arguments.schema_file.read())
+
+    db.execute("ATTACH DATABASE ? AS source", (arguments.source,))
+
+    source = fact_classes(db, "source", source_prefix)
+    destination = fact_classes(db, "main", arguments.prefix)
+    for classes, path, prefix in ((source, arguments.source, source_prefix), (destination, arguments.destination, arguments.prefix)):
+        if len(classes) == 0:
+            sys.stderr.write("No fact classes with the prefix %s were found in %s; is the prefix correct?\n" % (prefix, path))
+            sys.exit(1)
+
+    copies, warnings = plan(source, destination, parameter_names(db, "main", arguments.prefix), mappings, defaults)
+    if not arguments.quiet:
+        for warning in warnings:
+            sys.stderr.write("warning: %s\n" % warning)
+
+    # Parameters go first, so that the rules see their values before the facts arrive.
+    copies.sort(key=lambda x: (not x.parameters, x.old.lower()))
+    results = []
+    started = time.perf_counter()
+
+    for copy in copies:
+        copy_started = time.perf_counter()
+
+        def progress(copied, total):
+            if not arguments.quiet:
+                elapsed = time.perf_counter() - copy_started
+                sys.stderr.write("%s: %d of %d facts (%.0f%%), %.0f facts/s\n" %
+                                 (copy.new, copied, total, 100.0 * copied / max(1, total), copied / max(elapsed, 1e-6)))
+
+        try:
+            copied = copy_facts(db, copy, source_prefix, arguments.prefix, arguments.batch, progress)
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            sys.stderr.write("Cannot copy %s to %s: %s\n" % (copy.old, copy.new, e))
+            sys.exit(1)
+
+        results.append((copy, copied, time.perf_counter() - copy_started))
+
+    db.execute("DETACH DATABASE source")
+    db.close()
+
+    if not arguments.quiet:
+        elapsed = time.perf_counter() - started
+        sys.stdout.write("%d facts copied in %.1f s\n\n" % (sum(x[1] for x in results), elapsed))
+        write_table(sys.stdout, "Fact classes", ["facts", "seconds", "facts/s", "fact"],
+                    [[copied, "%.1f" % seconds, "%.0f" % (copied / max(seconds, 1e-6)),
+                      copy.new if copy.old == copy.new else "%s (from %s)" % (copy.new, copy.old)]
+                     for copy, copied, seconds in results], 0)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
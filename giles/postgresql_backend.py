@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Generate a PostgreSQL database schema from a Giles engine
+#          description.
+#
+######################################################################
+
+"""Giles backend for PostgreSQL."""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE."
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import datetime
+import jinja2
+
+from pkg_resources import resource_string
+from giles import expression
+from giles.caseless_string import CaselessString as CS
+from giles.sqlite_backend import find_fields, flatten_local_predicates, flatten_predicate, generate_alpha_network, test_cost
+
+######################################################################
+#
+# PostgreSQL limits identifiers to 63 bytes, and silently truncates
+# longer ones, which could make two of the generated names the same.
+#
+######################################################################
+
+max_identifier_length = 63
+
+######################################################################
+#
+# Transform a Giles expression into a PostgreSQL expression. The
+# fields of the fact being matched are columns of the table aliased
+# as fact, and the locals are columns of the frames table aliased as
+# frame. Giles's operators follow SQLite, and so the operators whose
+# semantics differ in PostgreSQL are spelled out: division by zero is
+# NULL rather than an error, LIKE is case-insensitive, and a cast to
+# text formats numbers and booleans as SQLite would.
+#
+######################################################################
+
+SQL_TYPES = {bool: "BOOLEAN", int: "BIGINT", float: "DOUBLE PRECISION", str: "TEXT"}
+
+# Columns compare text byte by byte, as SQLite does.
+COLUMN_TYPES = {bool: "BOOLEAN", int: "BIGINT", float: "DOUBLE PRECISION", str: 'TEXT COLLATE "C"'}
+
+
+def type_of(value):
+    return getattr(value, "type", type(value))
+
+
+def generate_expression(value, frame="x", fact="f"):
+    """
+    value - the expression or value to translate
+    frame - the alias of the frames table holding the locals
+    fact  - the alias of the table holding the fact being matched
+    """
+
+    if type(value) == bool:
+        return "TRUE" if value else "FALSE"
+
+    elif type(value) == int:
+        return str(value)
+
+    elif type(value) == float:
+        return "CAST(%r AS DOUBLE PRECISION)" % value
+
+    elif isinstance(value, str):
+        return "'%s'" % str(value).replace("'", "''")
+
+    elif isinstance(value, expression.ThisReferenceNode):
+        return "%s.%s" % (fact, value.variable)
+
+    elif isinstance(value, expression.LocalReferenceNode):
+        return "%s.%s" % (frame, value.variable)
+
+    elif isinstance(value, expression.BinaryOpNode):
+        arg1 = generate_expression(value.arg1, frame, fact)
+        arg2 = generate_expression(value.arg2, frame, fact)
+
+        if value.operation == "/":
+            return "((%s) / NULLIF(%s, 0))" % (arg1, arg2)
+
+        elif value.operation == "%" and float in (type_of(value.arg1), type_of(value.arg2)):
+            return "CAST(MOD(CAST(TRUNC(%s) AS BIGINT), NULLIF(CAST(TRUNC(%s) AS BIGINT), 0)) AS DOUBLE PRECISION)" % (arg1, arg2)
+
+        elif value.operation == "%":
+            return "MOD(%s, NULLIF(%s, 0))" % (arg1, arg2)
+
+        elif value.operation in ("LIKE", "NOT LIKE"):
+            return "((%s) %s (%s) ESCAPE '')" % (arg1, value.operation.replace("LIKE", "ILIKE"), arg2)
+
+        elif value.operation in ("REGEXP", "NOT REGEXP"):
+            return "((%s) %s (%s))" % (arg1, "~" if value.operation == "REGEXP" else "!~", arg2)
+
+        return "((%s) %s (%s))" % (arg1, value.operation, arg2)
+
+    elif isinstance(value, expression.UnaryOpNode):
+        return "(%s(%s))" % ("NOT " if value.operation == "NOT" else "-", generate_expression(value.arg1, frame, fact))
+
+    elif isinstance(value, expression.IfNode):
+        return "(CASE WHEN (%s) THEN (%s) ELSE (%s) END)" % (generate_expression(value.predicate, frame, fact),
+                                                             generate_expression(value.if_true, frame, fact),
+                                                             generate_expression(value.if_false, frame, fact))
+
+    elif isinstance(value, expression.FunctionNode):
+        # PostgreSQL won't narrow a BIGINT argument to a function taking an INTEGER, but will widen an INTEGER.
+        args = [("CAST(%s AS INTEGER)" if type_of(x) == int else "%s") % generate_expression(x, frame, fact) for x in value.args]
+        return "%s(%s)" % (value.external, ", ".join(args))
+
+    elif isinstance(value, expression.CastNode):
+        arg = generate_expression(value.expression, frame, fact)
+        source = type_of(value.expression)
+
+        if value.type == str and source == bool:
+            return "CAST(CAST(%s AS INTEGER) AS TEXT)" % arg
+
+        elif value.type == str and source == float:
+            return "(CASE WHEN %s = TRUNC(%s) AND ABS(%s) < 1e15 THEN CAST(CAST(%s AS NUMERIC) AS TEXT) || '.0' " \
+                   "ELSE CAST(%s AS TEXT) END)" % ((arg,) * 5)
+
+        elif value.type == int and source == str:
+            return "CAST(COALESCE(SUBSTRING(%s FROM '^\\s*([+-]?[0-9]+)'), '0') AS BIGINT)" % arg
+
+        elif value.type == int and source == float:
+            return "CAST(TRUNC(%s) AS BIGINT)" % arg
+
+        return "CAST(%s AS %s)" % (arg, SQL_TYPES[value.type])
+
+    assert False
+
+######################################################################
+#
+# Generate the tests of a match. The constant tests are made on each
+# fact as it arrives, and the tests over the locals join the fact to
+# the frames. Returns None if there are no such tests.
+#
+######################################################################
+
+
+def generate_tests(tests, frame="x", fact="f"):
+    tests = sorted(tests, key=lambda x: (test_cost(x), str(x.arg1.variable).lower()))
+    return " AND ".join(generate_expression(x, frame, fact) for x in tests) if len(tests) > 0 else None
+
+
+def generate_alpha(when, fact="f"):
+    return generate_tests(flatten_predicate(when), None, fact)
+
+
+def generate_join(when, frame="x", fact="f"):
+    return generate_tests(flatten_local_predicates(when), frame, fact)
+
+######################################################################
+#
+# Find the columns worth indexing for a join: the fields of the fact
+# tested for equality with an expression over the locals, and the
+# locals that some field is tested for equality with directly.
+#
+######################################################################
+
+
+def join_keys(when):
+    equalities = [x for x in flatten_local_predicates(when) if x.operation == "=" and len(find_fields(x.arg2)) == 0]
+    equalities.sort(key=lambda x: str(x.arg1.variable).lower())
+
+    fields = [str(x.arg1.variable).lower() for x in equalities]
+    variables = [str(x.arg2.variable).lower() for x in equalities if isinstance(x.arg2, expression.LocalReferenceNode)]
+    return fields, variables
+
+######################################################################
+#
+# Lay out a rule's frames tables. A rule has a stage for each of its
+# match clauses, a single blocking stage for all of its inverted
+# matches, and a stage for its distinct production, if any, as in the
+# SQLite backend. Every frame stores every local.
+#
+######################################################################
+
+
+def generate_stages(prefix, rule_name, rule, facts, add_index):
+    def sort(names):
+        return sorted(names, key=lambda x: str(x).lower())
+
+    stages = []
+    local_names = sort(rule["locals"].keys())
+
+    for i, match in enumerate(rule["matches"]):
+        assignments = match.get("assignments") or {}
+        columns = []
+        for name in local_names:
+            if name in assignments:
+                columns.append((str(name), generate_expression(assignments[name])))
+
+            elif i > 0:
+                columns.append((str(name), "x.%s" % name))
+
+        stages.append({
+            "kind": "match",
+            "fact": str(match["fact"]),
+            "alpha": generate_alpha(match["when"]),
+            "join": generate_join(match["when"]),
+            "columns": columns
+        })
+
+        if i > 0:
+            fields, variables = join_keys(match["when"])
+            add_index("%s_%s_actual" % (prefix, match["fact"]), fields)
+            add_index("%s_%s_%d_frames" % (prefix, rule_name, i - 1), variables)
+
+    if len(rule["inverted_matches"]) > 0:
+        inverted = []
+        for n, match in enumerate(rule["inverted_matches"]):
+            inverted.append({
+                "number": n,
+                "fact": str(match["fact"]),
+                "alpha": generate_alpha(match["when"]),
+                "join": generate_join(match["when"])
+            })
+
+            fields, variables = join_keys(match["when"])
+            add_index("%s_%s_actual" % (prefix, match["fact"]), fields)
+            add_index("%s_%s_%d_frames" % (prefix, rule_name, len(stages)), variables)
+
+        stages.append({"kind": "blocking", "inverted": inverted})
+
+    if rule.get("distinct"):
+        fields = sort(facts[CS(rule["produced_fact"])].keys())
+        stages.append({
+            "kind": "distinct",
+            "lookup": " AND ".join("f.%s = %s" % (x, generate_expression(rule["produced_fields"][x])) for x in fields)
+        })
+
+        add_index("%s_%s_actual" % (prefix, rule["produced_fact"]), [str(x).lower() for x in fields])
+
+    for number, stage in enumerate(stages):
+        stage["number"] = number
+        stage["table"] = "%s_%s_%d_frames" % (prefix, rule_name, number)
+        stage["matched"] = "matched_fact_%d" % number
+        stage["last"] = number == len(stages) - 1
+
+        if stage["kind"] == "blocking":
+            stage["blocked"] = " OR ".join("blockers_%d > 0" % x["number"] for x in stage["inverted"])
+            stage["unblocked"] = " AND ".join("blockers_%d = 0" % x["number"] for x in stage["inverted"])
+
+    return stages
+
+######################################################################
+#
+# The entry point of the backend.
+#
+######################################################################
+
+
+def generate(new_prefix, filename, description, facts, parameters, rules, compact_frames=False, retention=None, aggregates=None,
+             instrument=False, gauges=False, provenance=False, dispatch=False):
+
+    ####################################################################
+    #
+    # Features that the SQLite schema implements with SQLite-specific
+    # machinery aren't supported. Every frame stores every local and
+    # each table has a single trigger for each event, so compact
+    # frames and dispatchers are simply ignored.
+    #
+    ####################################################################
+
+    if aggregates:
+        raise Exception("Aggregate matches are not supported by the postgresql backend")
+
+    if retention:
+        raise Exception("Retention policies are not supported by the postgresql backend")
+
+    for rule in rules.values():
+        for match in rule["matches"]:
+            if match.get("within") is not None or match.get("after") is not None:
+                raise Exception("Temporal constraints are not supported by the postgresql backend")
+
+    if instrument or gauges or provenance:
+        raise Exception("Instrumentation, gauges, and provenance are not supported by the postgresql backend")
+
+    ####################################################################
+    #
+    # Lay out the tables and work out what each trigger has to do.
+    #
+    ####################################################################
+
+    prefix = "_" + new_prefix
+    indexes = []
+
+    def add_index(table, columns):
+        if len(columns) > 0 and (table, tuple(columns)) not in indexes:
+            indexes.append((table, tuple(columns)))
+
+    def sort(names):
+        return sorted(names, key=lambda x: str(x).lower())
+
+    rule_list = []
+    for rule_id, rule_name in enumerate(sort(rules.keys()), 1):
+        rule = rules[rule_name]
+        stages = generate_stages(prefix, rule_name, rule, facts, add_index)
+        last = stages[-1]
+
+        item = {
+            "name": str(rule_name),
+            "id": rule_id,
+            "description": str(rule["description"]),
+            "locals": [(str(x), COLUMN_TYPES[rule["locals"][x]]) for x in sort(rule["locals"].keys())],
+            "stages": stages,
+            "last": last,
+            "open": "x.%s IS NULL" % last["matched"] if last["kind"] != "match" else None,
+            "predicate": generate_expression(rule["final_predicate"]) if rule["final_predicate"] is not True else None,
+            "produced": None,
+            "suppressed": None
+        }
+
+        if "produced_fact" in rule:
+            fields = sort(facts[CS(rule["produced_fact"])].keys())
+            item["produced"] = {
+                "fact": str(rule["produced_fact"]),
+                "fields": [str(x) for x in fields],
+                "expressions": [generate_expression(rule["produced_fields"][x]) for x in fields],
+                "distinct": bool(rule.get("distinct"))
+            }
+
+        else:
+            item["suppressed"] = {
+                "fact": str(rule["suppressed_fact"]),
+                "fields": [str(x) for x in sort(facts[CS(rule["suppressed_fact"])].keys())],
+                "alpha": generate_alpha(rule["suppressed_when"]),
+                "join": generate_join(rule["suppressed_when"]),
+                "new_alpha": generate_alpha(rule["suppressed_when"], "NEW"),
+                "new_join": generate_join(rule["suppressed_when"], "x", "NEW")
+            }
+
+            fields, variables = join_keys(rule["suppressed_when"])
+            add_index("%s_%s_actual" % (prefix, rule["suppressed_fact"]), fields)
+            add_index(last["table"], variables)
+
+        rule_list.append(item)
+
+    fact_list = []
+    for fact_name in sort(facts.keys()):
+        fields = facts[fact_name]
+        item = {
+            "name": str(fact_name),
+            "fields": [(str(x), COLUMN_TYPES[fields[x]]) for x in sort(fields.keys())],
+            "parameter": parameters.get(fact_name),
+            "value_type": SQL_TYPES[fields[CS("Value")]] if fact_name in parameters else None,
+            "network": None,
+            "positive": [],
+            "inverted": [],
+            "blocking": [],
+            "distinct": [],
+            "suppressors": [],
+            "produced": False
+        }
+
+        predicates = []
+        for rule in rule_list:
+            for stage in rule["stages"]:
+                if stage["kind"] == "match" and CS(stage["fact"]) == fact_name:
+                    item["positive"].append((rule, stage))
+                    predicates.append(stage["alpha"])
+
+                elif stage["kind"] == "blocking":
+                    for inverted in stage["inverted"]:
+                        if CS(inverted["fact"]) == fact_name:
+                            item["inverted"].append((rule, stage, inverted))
+                            predicates.append(inverted["alpha"])
+
+                    if any(CS(x["fact"]) == fact_name for x in stage["inverted"]):
+                        item["blocking"].append((rule, stage))
+
+                elif stage["kind"] == "distinct" and CS(rule["produced"]["fact"]) == fact_name:
+                    item["distinct"].append((rule, stage))
+
+            if rule["produced"] is not None and CS(rule["produced"]["fact"]) == fact_name:
+                item["produced"] = True
+
+            if rule["suppressed"] is not None and CS(rule["suppressed"]["fact"]) == fact_name:
+                item["suppressors"].append(rule)
+
+        # Prune facts that can't match any rule, as the SQLite backend does, using the same discrimination network.
+        if fact_name not in parameters and not getattr(fields, "is_output", False):
+            alpha = []
+            for rule in rules.values():
+                for match in rule["matches"] + rule["inverted_matches"]:
+                    if CS(match["fact"]) == fact_name:
+                        alpha.append([(test_cost(x), generate_expression(x, None, "NEW")) for x in flatten_predicate(match["when"])])
+
+            network = generate_alpha_network(alpha)
+            item["network"] = "FALSE" if network == "0" else network
+
+        fact_list.append(item)
+
+    ####################################################################
+    #
+    # Make sure that PostgreSQL won't truncate any of the names.
+    #
+    ####################################################################
+
+    names = [new_prefix + "_parameters"]
+    names += ["%s_%s_actual" % (prefix, x["name"]) for x in fact_list]
+    names += ["%s_%s_shadow" % (prefix, x["name"]) for x in fact_list]
+    names += [x["table"] for rule in rule_list for x in rule["stages"]]
+
+    for name in names:
+        if len(name) > max_identifier_length:
+            raise Exception("The name '%s' is longer than PostgreSQL allows (%d characters)" % (name, max_identifier_length))
+
+    ####################################################################
+    #
+    # Open the template and run it.
+    #
+    ####################################################################
+
+    template_file = resource_string(__name__, 'postgresql.jinja').decode('utf-8')
+    env = jinja2.Environment(loader=jinja2.FunctionLoader(lambda x: (template_file, 'postgresql.jinja', lambda: template_file)),
+                             trim_blocks=True, lstrip_blocks=True)
+    template = env.get_template('postgresql.jinja')
+
+    names = {
+        "generate_expression": generate_expression,
+        "description": description,
+        "facts": fact_list,
+        "file": filename,
+        "indexes": indexes,
+        "parameters": parameters,
+        "parameter_types": {"BOOLEAN": "BOOLEAN", "BIGINT": "INTEGER", "DOUBLE PRECISION": "REAL", "TEXT": "TEXT"},
+        "prefix": prefix,
+        "public_prefix": new_prefix,
+        "rules": rule_list,
+        "time": str(datetime.datetime.now())
+    }
+
+    return template.render(**names)
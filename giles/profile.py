@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Profile the triggers of a compiled engine.
+#
+######################################################################
+
+"""
+profile.py - profile the triggers of a compiled engine
+
+The profiler replays a workload against a compiled engine whose triggers
+have been rewritten to report each trigger as it begins and each
+statement within a trigger as it begins (see Hooks), so the time between
+two consecutive events belongs to whatever began first. The nesting of
+triggers is not reported, so it is reconstructed from the schema: a
+trigger was fired by the innermost active statement that writes the
+trigger's table (or, for deletes, a table that cascades into it).
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import logging
+import re
+import sqlite3
+import sys
+import time
+
+from giles import get_release_string
+
+######################################################################
+#
+# Schema Inspection
+#
+######################################################################
+
+target_pattern = re.compile(r"^(?:\s|/\*.*?\*/|--[^\n]*\n)*"
+                            r"(INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+([\w\"]+)",
+                            re.IGNORECASE | re.DOTALL)
+
+
+def statement_target(statement):
+    """Return the verb and the (lowercased) table written by a statement, or (None, None).
+
+    >>> statement_target("INSERT INTO _Giles_Foo_actual(a) VALUES (1)")
+    ('INSERT', '_giles_foo_actual')
+    >>> statement_target("  DELETE FROM _Giles_Rule_1_frames WHERE id = old.id")
+    ('DELETE', '_giles_rule_1_frames')
+    >>> statement_target("UPDATE OR IGNORE Giles_Foo_facts SET a = 1")
+    ('UPDATE', 'giles_foo_facts')
+    >>> statement_target("SELECT 1")
+    (None, None)
+    """
+
+    match = target_pattern.match(statement)
+    if match is None:
+        return None, None
+
+    return match.group(1).split()[0].upper(), match.group(2).strip('"').lower()
+
+
+def split_trigger_name(name, prefix, rule_names):
+    """Split a generated trigger name into its rule, stage, and kind.
+
+    Triggers that do not belong to a rule (those maintaining fact tables,
+    for example) have a rule of None.
+
+    >>> rules = ["Rule", "RuleTwo"]
+    >>> split_trigger_name("_Giles_RuleTwo_1_alpha_activation", "_Giles", rules)
+    ('RuleTwo', 1, 'alpha_activation')
+    >>> split_trigger_name("_Giles_Rule_retract_productions", "_Giles", rules)
+    ('Rule', None, 'retract_productions')
+    >>> split_trigger_name("_Giles_Person_facts_do_insert", "_Giles", rules)
+    (None, None, 'Person_facts_do_insert')
+    """
+
+    rest = name
+    if rest.lower().startswith(prefix.lower() + "_"):
+        rest = rest[len(prefix) + 1:]
+
+    for rule in sorted(rule_names, key=len, reverse=True):
+        if rest.lower().startswith(rule.lower() + "_"):
+            kind = rest[len(rule) + 1:]
+            match = re.match(r"^(\d+)_(.+)$", kind)
+            if match is not None:
+                return rule, int(match.group(1)), match.group(2)
+            return rule, None, kind
+
+    return None, None, rest
+
+
+class Schema:
+    """The triggers and table relationships of a compiled engine."""
+
+    def __init__(self, db, prefix):
+        self.prefix = prefix
+        self.triggers = {}    # Trigger name -> (table, body)
+        self.before = set()   # Names of BEFORE triggers
+        self.ranks = {}       # Trigger name -> order in which it fires relative to others on its table
+        self.cascades = {}    # Table -> tables whose rows are deleted when its rows are deleted
+
+        # SQLite fires a row's BEFORE triggers, then its other triggers, each in the reverse of the order they were created.
+        triggers = db.execute("SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall()
+        for i, (name, table, sql) in enumerate(triggers):
+            self.triggers[name] = (table.lower(), re.sub(r"\s", " ", sql))
+            if re.search(r"\bBEFORE\s+(INSERT|UPDATE|DELETE)\b", sql.split(" ON ")[0], re.IGNORECASE):
+                self.before.add(name)
+            self.ranks[name] = (name not in self.before, -i)
+
+        self.views = set(x[0].lower() for x in db.execute("SELECT name FROM sqlite_master WHERE type = 'view'"))
+
+        tables = [x[0] for x in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            for row in db.execute("PRAGMA foreign_key_list(\"%s\")" % table):
+                if row[6].upper() == "CASCADE":
+                    self.cascades.setdefault(row[2].lower(), set()).add(table.lower())
+
+        try:
+            self.rules = [x[0] for x in db.execute("SELECT name FROM %s_rules" % prefix)]
+        except sqlite3.Error:
+            logging.warning("no rules registry named %s_rules; is the prefix correct?", prefix)
+            self.rules = []
+
+    def writes(self, statement):
+        """Return the set of tables whose triggers a statement may fire."""
+
+        verb, table = statement_target(statement)
+        if table is None:
+            return set()
+
+        result = set([table])
+        if verb == "DELETE":
+            pending = [table]
+            while len(pending) > 0:
+                for child in self.cascades.get(pending.pop(), ()):
+                    if child not in result:
+                        result.add(child)
+                        pending.append(child)
+
+        return result
+
+######################################################################
+#
+# Trigger Hooks
+#
+######################################################################
+
+trigger_pattern = re.compile(r"^(.*?\bON\s+[\w\"]+(?:\s+FOR\s+EACH\s+ROW)?)(?:\s+WHEN\s+(.*?))?\s+BEGIN\b(.*)\bEND\s*;?\s*$",
+                             re.IGNORECASE | re.DOTALL)
+
+
+def split_trigger(sql):
+    """Split a trigger's SQL into its header, its WHEN expression (or None), and its statements.
+
+    >>> split_trigger("CREATE TRIGGER t AFTER INSERT ON x WHEN new.a = 1 BEGIN DELETE FROM y; INSERT INTO y VALUES(';'); END")
+    ('CREATE TRIGGER t AFTER INSERT ON x', 'new.a = 1', ['DELETE FROM y', "INSERT INTO y VALUES(';')"])
+    >>> split_trigger("CREATE TRIGGER t BEFORE DELETE ON x FOR EACH ROW BEGIN SELECT RAISE(IGNORE); END")
+    ('CREATE TRIGGER t BEFORE DELETE ON x FOR EACH ROW', None, ['SELECT RAISE(IGNORE)'])
+    """
+
+    header, when, body = trigger_pattern.match(sql).groups()
+
+    statements = []
+    buffer = ""
+    for piece in body.split(";")[:-1]:
+        buffer += piece + ";"
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip()[:-1].strip())
+            buffer = ""
+
+    return header, when, statements
+
+
+class Hooks:
+    """Report the triggers of an engine, and the statements they run, as they begin.
+
+    SQLite no longer passes trigger execution to the trace callbacks of
+    newer versions of Python's sqlite3 module, so each trigger is
+    rewritten to call a function at the start of its WHEN clause (which
+    is evaluated whether or not the trigger's tests pass) and before each
+    of its statements. The function reports these events to the callback
+    as SQLite's trace once did: "-- TRIGGER " and the trigger's name, or
+    "-- " and the statement.
+
+    The triggers are recreated in their original order, so they fire in
+    the same order, and remove() restores them. Both must be done inside
+    the transaction the workload runs in.
+    """
+
+    function = "giles_hook"
+
+    def __init__(self, db):
+        self.db = db
+        self.callback = None
+        self.triggers = db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall()
+        self.statements = {}
+        db.create_function(self.function, -1, self.hook)
+
+    def hook(self, name, statement=None):
+        if self.callback is not None:
+            self.callback("-- TRIGGER %s" % name if statement is None else "-- %s" % self.statements[name][statement])
+        return 1
+
+    def install(self):
+        """Replace each trigger with one that reports its execution."""
+
+        for name, sql in self.triggers:
+            header, when, statements = split_trigger(sql)
+            self.statements[name] = statements
+
+            call = "%s('%s'" % (self.function, name.replace("'", "''"))
+            self.db.execute("DROP TRIGGER \"%s\"" % name)
+            self.db.execute("%s WHEN %s) %s BEGIN %s END" % (header, call, "AND (%s)" % when if when is not None else "",
+                                                             " ".join("SELECT %s, %d); %s;" % (call, i, x)
+                                                                      for i, x in enumerate(statements))))
+
+    def remove(self):
+        """Restore the original triggers."""
+
+        for name, sql in self.triggers:
+            self.db.execute("DROP TRIGGER \"%s\"" % name)
+            self.db.execute(sql)
+
+######################################################################
+#
+# Profile Accumulation
+#
+######################################################################
+
+
+class Frame:
+    """An active trigger (or the top-level statement) during replay."""
+
+    def __init__(self, name, body, writes):
+        self.name = name
+        self.body = body
+        self.position = 0
+        self.statement = None
+        self.writes = writes
+        self.fired = {}       # Table -> (first trigger fired on it, rank of the last) by the current statement
+
+    def begin(self, statement, writes):
+        """Note that the trigger has begun running another statement."""
+
+        self.statement = statement
+        self.writes = writes
+        self.fired = {}
+
+
+def find_parent(schema, stack, name):
+    """Return the depth of the frame that fired a trigger, and note that it did so.
+
+    The candidates are the frames running statements that write the
+    trigger's table. Each row written fires every trigger on the table
+    in a fixed order, so the innermost candidate is chosen unless the
+    trigger cannot be the next one it fires (meaning that candidate had
+    in fact finished). The top-level statement, at depth zero, is
+    assumed if there are no candidates.
+    """
+
+    table = schema.triggers.get(name, (None, ""))[0]
+    rank = schema.ranks.get(name)
+
+    chosen = None
+    for depth in range(len(stack) - 1, -1, -1):
+        if table in stack[depth].writes:
+            if chosen is None:
+                chosen = depth
+            if table not in stack[depth].fired or stack[depth].fired[table][0] == name or stack[depth].fired[table][1] < rank:
+                chosen = depth
+                break
+
+    if chosen is None:
+        return 0
+
+    first = stack[chosen].fired.get(table, (name, rank))[0]
+    stack[chosen].fired[table] = (first, rank)
+
+    return chosen
+
+
+def find_statement(stack, text):
+    """Return the depth of the innermost trigger that runs a statement next, or None.
+
+    A trigger's statements run in order, so the statement must appear
+    in the trigger's body after the statement it is currently running.
+    The frame's position is advanced past the statement.
+    """
+
+    for depth in range(len(stack) - 1, 0, -1):
+        position = stack[depth].body.find(text, stack[depth].position)
+        if position >= 0:
+            stack[depth].position = position + len(text)
+            return depth
+
+    return None
+
+
+def root_frame(schema, statement):
+    """Return the frame for a top-level statement."""
+
+    match = target_pattern.match(statement)
+    return Frame("%s %s" % (match.group(1).split()[0].upper(), match.group(2)) if match is not None else "(statement)",
+                 statement, schema.writes(statement))
+
+
+class Profile:
+    """Accumulated time and counts, keyed by trigger, statement, and stack."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.calls = {}        # Trigger -> times fired
+        self.self_time = {}    # Trigger -> time spent in its own statements
+        self.total_time = {}   # Trigger -> time spent in it and the triggers it fired
+        self.statements = {}   # (Trigger, statement) -> [executions, time]
+        self.stacks = {}       # Stack of frame names -> time
+        self.top_level = 0     # Number of workload statements
+        self.elapsed = 0.0     # Total time spent executing the workload
+        self.trigger_events = 0
+
+    def replay(self, db, hooks, statement):
+        """Execute a workload statement and account for the events its triggers report."""
+
+        events = []
+        hooks.callback = lambda sql: events.append((time.perf_counter(), sql))
+        start = time.perf_counter()
+        try:
+            db.execute(statement)
+        finally:
+            end = time.perf_counter()
+            hooks.callback = None
+
+        self.top_level += 1
+        self.elapsed += end - start
+        self.account(statement, events, start, end)
+
+    def account(self, statement, events, start, end):
+        """Attribute the intervals between events.
+
+        The time before the first event, mostly spent preparing the
+        statement and the triggers it may fire, belongs to the statement
+        itself.
+        """
+
+        stack = [root_frame(self.schema, statement)]
+        self.charge(stack, (events[0][0] if len(events) > 0 else end) - start)
+
+        for i, (when, sql) in enumerate(events):
+            if sql.startswith("-- TRIGGER "):
+                name = sql[len("-- TRIGGER "):].strip()
+                table, body = self.schema.triggers.get(name, (None, ""))
+
+                del stack[find_parent(self.schema, stack, name) + 1:]
+                stack.append(Frame(name, body, set()))
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.trigger_events += 1
+
+            elif sql.startswith("-- "):
+                text = re.sub(r"\s", " ", sql[3:])
+                depth = find_statement(stack, text)
+                if depth is not None:
+                    del stack[depth + 1:]
+                    stack[-1].begin(" ".join(text.split()), self.schema.writes(text))
+                    entry = self.statements.setdefault((stack[-1].name, stack[-1].statement), [0, 0.0])
+                    entry[0] += 1
+
+            following = events[i + 1][0] if i + 1 < len(events) else end
+            self.charge(stack, following - when)
+
+    def charge(self, stack, interval):
+        """Charge an interval to the innermost frame of a stack."""
+
+        key = tuple(x.name for x in stack)
+        self.stacks[key] = self.stacks.get(key, 0.0) + interval
+
+        if len(stack) > 1:
+            top = stack[-1]
+            self.self_time[top.name] = self.self_time.get(top.name, 0.0) + interval
+            if top.statement is not None:
+                self.statements[(top.name, top.statement)][1] += interval
+
+        for name in set(x.name for x in stack[1:]):
+            self.total_time[name] = self.total_time.get(name, 0.0) + interval
+
+    def rollup(self, key):
+        """Sum trigger calls and self time by key(rule, stage, kind)."""
+
+        result = {}
+        for name in self.calls:
+            group = key(*split_trigger_name(name, self.schema.prefix, self.schema.rules))
+            entry = result.setdefault(group, [0, 0.0])
+            entry[0] += self.calls[name]
+            entry[1] += self.self_time.get(name, 0.0)
+
+        return result
+
+######################################################################
+#
+# Reporting
+#
+######################################################################
+
+
+def write_table(output, title, headings, rows, limit):
+    """Write a ranked table of rows, each of which ends with a name."""
+
+    output.write("%s\n\n" % title)
+    output.write("  ".join("%12s" % x for x in headings[:-1]) + "  " + headings[-1] + "\n")
+    for row in rows[:limit] if limit > 0 else rows:
+        output.write("  ".join("%12s" % x for x in row[:-1]) + "  " + row[-1] + "\n")
+    output.write("\n")
+
+
+def write_report(output, profile, limit):
+    """Write the ranked report."""
+
+    def ms(seconds):
+        return "%.3f" % (seconds * 1000.0)
+
+    def percent(seconds):
+        return "%.1f%%" % (100.0 * seconds / profile.elapsed if profile.elapsed > 0 else 0.0)
+
+    output.write("%d statements executed in %s ms; %d triggers fired\n\n" % (profile.top_level, ms(profile.elapsed),
+                                                                             profile.trigger_events))
+
+    names = sorted(profile.calls, key=lambda x: (-profile.self_time.get(x, 0.0), x))
+    write_table(output, "Triggers by self time", ["self ms", "self", "total ms", "rows", "trigger"],
+                [[ms(profile.self_time.get(x, 0.0)), percent(profile.self_time.get(x, 0.0)), ms(profile.total_time.get(x, 0.0)),
+                  profile.calls[x], x] for x in names], limit)
+
+    rules = profile.rollup(lambda rule, stage, kind: rule if rule is not None else "(facts)")
+    write_table(output, "Rules by self time", ["self ms", "self", "rows", "rule"],
+                [[ms(v[1]), percent(v[1]), v[0], k] for k, v in sorted(rules.items(), key=lambda x: (-x[1][1], x[0]))], limit)
+
+    stages = profile.rollup(lambda rule, stage, kind: (rule if rule is not None else "(facts)") +
+                                                      (" %d" % stage if stage is not None else ""))
+    write_table(output, "Rule stages by self time", ["self ms", "self", "rows", "stage"],
+                [[ms(v[1]), percent(v[1]), v[0], k] for k, v in sorted(stages.items(), key=lambda x: (-x[1][1], x[0]))], limit)
+
+    statements = sorted(profile.statements.items(), key=lambda x: (-x[1][1], x[0]))
+    write_table(output, "Trigger statements by self time", ["self ms", "self", "executions", "trigger: statement"],
+                [[ms(v[1]), percent(v[1]), v[0], "%s: %s" % (k[0], k[1][:100])] for k, v in statements], limit)
+
+
+def write_collapsed(output, profile):
+    """Write the collapsed stacks, in microseconds, for flame graph tools."""
+
+    for stack, seconds in sorted(profile.stacks.items()):
+        microseconds = int(round(seconds * 1000000.0))
+        if microseconds > 0:
+            output.write("%s %d\n" % (";".join(x.replace(";", ",") for x in stack), microseconds))
+
+######################################################################
+#
+# Workloads
+#
+######################################################################
+
+
+def read_statements(workload):
+    """Yield the complete SQL statements in a file."""
+
+    buffer = ""
+    for line in workload:
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip() != "":
+                yield buffer.strip()
+            buffer = ""
+
+    if buffer.strip() != "":
+        yield buffer.strip()
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Profile the triggers of a compiled engine by replaying a workload")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-c', '--commit', dest='commit', default=False, action='store_const', const=True,
+                            help="commit the workload's changes rather than rolling them back")
+    arg_parser.add_argument('-f', '--flame', dest='collapsed_file', default=None, type=argparse.FileType('w'),
+                            help="write collapsed stacks to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-n', '--limit', dest='limit', default=20, type=int,
+                            help="show at most this many rows per table (0 shows all)", metavar="LIMIT")
+    arg_parser.add_argument('-o', '--output', dest='report_file', default=sys.stdout, type=argparse.FileType('w'),
+                            help="write the report to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-s', '--schema', dest='schema_file', default=None, type=argparse.FileType('r'),
+                            help="load this compiled schema into the database first", metavar="SCHEMA")
+    arg_parser.add_argument('database', type=str, help="the database to profile", metavar="DATABASE")
+    arg_parser.add_argument('workloads', type=argparse.FileType('r'), nargs='+', help="SQL to replay", metavar="WORKLOAD")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    db = sqlite3.connect(arguments.database, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) is not None else 0)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA recursive_triggers = ON")
+
+    if arguments.schema_file is not None:
+        db.executescript(arguments.schema_file.read())
+
+    profile = Profile(Schema(db, "_" + arguments.prefix))
+    hooks = Hooks(db)
+
+    db.execute("BEGIN")
+    try:
+        hooks.install()
+        for workload in arguments.workloads:
+            for statement in read_statements(workload):
+                profile.replay(db, hooks, statement)
+        hooks.remove()
+    except sqlite3.Error as e:
+        db.execute("ROLLBACK")
+        sys.stderr.write("Replay failed: %s\n" % e)
+        sys.exit(1)
+
+    db.execute("COMMIT" if arguments.commit else "ROLLBACK")
+    db.close()
+
+    write_report(arguments.report_file, profile, arguments.limit)
+    if arguments.collapsed_file is not None:
+        write_collapsed(arguments.collapsed_file, profile)
+        arguments.collapsed_file.close()
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
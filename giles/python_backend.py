@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Generate a Python module that runs a Giles engine
+#          in-process, from a Giles engine description.
+#
+######################################################################
+
+"""Giles backend for Python."""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE."
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import datetime
+import jinja2
+
+from pkg_resources import resource_string
+from giles import expression
+from giles.sqlite_backend import find_fields, find_locals, test_cost
+
+######################################################################
+#
+# Transform a Giles expression into a Python expression. The fields
+# of the fact being matched are elements of the tuple t, in the order
+# of the fields' names, and the locals of the frame are entries in the
+# dictionary l, keyed by their names in lower case. Operators whose
+# semantics differ between Python and SQLite are implemented by the
+# rete module.
+#
+######################################################################
+
+OPERATORS = {"=": "==", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "+": "+", "-": "-", "*": "*", "||": "+", "AND": "and",
+             "OR": "or"}
+
+
+def generate_expression(value, fields):
+    """
+    value  - the expression or value to translate
+    fields - the position of each field of the fact being matched, keyed by its name in lower case
+    """
+
+    if isinstance(value, str):
+        return repr(str(value))
+
+    elif type(value) in (bool, float, int):
+        return repr(value)
+
+    elif isinstance(value, expression.ThisReferenceNode):
+        return "t[%d]" % fields[str(value.variable).lower()]
+
+    elif isinstance(value, expression.LocalReferenceNode):
+        return "l[%r]" % str(value.variable).lower()
+
+    elif isinstance(value, expression.BinaryOpNode):
+        arg1 = generate_expression(value.arg1, fields)
+        arg2 = generate_expression(value.arg2, fields)
+
+        if value.operation in OPERATORS:
+            return "(%s %s %s)" % (arg1, OPERATORS[value.operation], arg2)
+
+        elif value.operation == "/":
+            return "rete.divide(%s, %s)" % (arg1, arg2)
+
+        elif value.operation == "%":
+            return "rete.remainder(%s, %s)" % (arg1, arg2)
+
+        elif value.operation in ("LIKE", "NOT LIKE"):
+            return "(%srete.like(%s, %s))" % ("not " if value.operation == "NOT LIKE" else "", arg1, arg2)
+
+        elif value.operation in ("REGEXP", "NOT REGEXP"):
+            return "(%sfunctions['REGEXP'](%s, %s))" % ("not " if value.operation == "NOT REGEXP" else "", arg2, arg1)
+
+    elif isinstance(value, expression.UnaryOpNode):
+        return "(%s%s)" % ("not " if value.operation == "NOT" else "-", generate_expression(value.arg1, fields))
+
+    elif isinstance(value, expression.IfNode):
+        return "(%s if %s else %s)" % (generate_expression(value.if_true, fields),
+                                       generate_expression(value.predicate, fields),
+                                       generate_expression(value.if_false, fields))
+
+    elif isinstance(value, expression.FunctionNode):
+        return "functions[%r](%s)" % (str(value.external).upper(), ", ".join(generate_expression(x, fields) for x in value.args))
+
+    elif isinstance(value, expression.CastNode):
+        return "rete.cast(%s, %s)" % (generate_expression(value.expression, fields), value.type.__name__)
+
+    assert False
+
+######################################################################
+#
+# Sort the tests of a match by what they depend on, as the SQLite
+# backend's flatten does: tests of a field for equality with a
+# constant are hashed, other tests that don't depend on the frame
+# are performed when the fact arrives, tests of a field for equality
+# with an expression over the frame's locals are looked up by key,
+# and the rest are performed for each pair of fact and frame.
+#
+######################################################################
+
+
+def generate_match(match, fields, assignments=None):
+    constants = []
+    alpha = []
+    keys = []
+    joins = []
+
+    def flatten(n):
+        if isinstance(n, expression.JoinNode):
+            flatten(n.left)
+            flatten(n.right)
+
+        elif isinstance(n, expression.BinaryOpNode) and n.type == bool and isinstance(n.arg1, expression.ThisReferenceNode):
+            if len(find_locals(n.arg2)) == 0:
+                if n.operation == "=" and isinstance(n.arg2, (bool, float, int, str)):
+                    constants.append((fields[str(n.arg1.variable).lower()], str(n.arg2) if isinstance(n.arg2, str) else n.arg2))
+
+                else:
+                    alpha.append(n)
+
+            elif n.operation == "=" and len(find_fields(n.arg2)) == 0:
+                keys.append(n)
+
+            else:
+                joins.append(n)
+
+    flatten(match)
+
+    alpha.sort(key=lambda x: (test_cost(x), str(x.arg1.variable).lower()))
+    keys.sort(key=lambda x: str(x.arg1.variable).lower())
+
+    result = {
+        "constants": repr(tuple(sorted(constants, key=lambda x: x[0]))),
+        "alpha": "lambda t: %s" % " and ".join(generate_expression(x, fields) for x in alpha) if len(alpha) > 0 else None,
+        "fact_key": None,
+        "frame_key": None,
+        "join": "lambda t, l: %s" % " and ".join(generate_expression(x, fields) for x in joins) if len(joins) > 0 else None,
+        "assigned": "()",
+        "assign": None
+    }
+
+    if len(keys) > 0:
+        result["fact_key"] = "lambda t: (%s,)" % ", ".join(generate_expression(x.arg1, fields) for x in keys)
+        result["frame_key"] = "lambda l: (%s,)" % ", ".join(generate_expression(x.arg2, fields) for x in keys)
+
+    if assignments:
+        names = sorted(assignments.keys(), key=lambda x: str(x).lower())
+        result["assigned"] = repr(tuple(str(x).lower() for x in names))
+        result["assign"] = "lambda t, l: (%s,)" % ", ".join(generate_expression(assignments[x], fields) for x in names)
+
+    return result
+
+######################################################################
+#
+# The entry point of the backend.
+#
+######################################################################
+
+
+def generate(new_prefix, filename, description, facts, parameters, rules, compact_frames=False, retention=None, aggregates=None,
+             instrument=False, gauges=False, provenance=False, dispatch=False):
+
+    ####################################################################
+    #
+    # The Rete runtime keeps everything in memory and has no clock, so
+    # the features that are implemented by the SQLite schema itself
+    # aren't supported. The layout of frames tables and triggers is
+    # meaningless here, and so compact frames and dispatchers are
+    # simply ignored.
+    #
+    ####################################################################
+
+    if aggregates:
+        raise Exception("Aggregate matches are not supported by the python backend")
+
+    if retention:
+        raise Exception("Retention policies are not supported by the python backend")
+
+    for rule in rules.values():
+        for match in rule["matches"]:
+            if match.get("within") is not None or match.get("after") is not None:
+                raise Exception("Temporal constraints are not supported by the python backend")
+
+    if instrument or gauges or provenance:
+        raise Exception("Instrumentation, gauges, and provenance are not supported by the python backend")
+
+    ####################################################################
+    #
+    # Translate each fact class, parameter, and rule.
+    #
+    ####################################################################
+
+    def sort(names):
+        return sorted(names, key=lambda x: str(x).lower())
+
+    fact_list = []
+    positions = {}
+    for fact_name in sort(facts.keys()):
+        fields = sort(facts[fact_name].keys())
+        positions[str(fact_name).lower()] = dict((str(x).lower(), i) for i, x in enumerate(fields))
+        fact_list.append({
+            "name": str(fact_name),
+            "fields": tuple(str(x) for x in fields),
+            "types": "(%s)" % "".join("%s, " % facts[fact_name][x].__name__ for x in fields),
+            "output": getattr(facts[fact_name], "is_output", False)
+        })
+
+    parameter_list = []
+    for parameter_name in sort(parameters.keys()):
+        parameter = parameters[parameter_name]
+        parameter_list.append({
+            "name": str(parameter_name),
+            "default": str(parameter["default"]) if isinstance(parameter["default"], str) else parameter["default"],
+            "lower": parameter["lower"],
+            "upper": parameter["upper"],
+            "dictionary": parameter["dictionary"]
+        })
+
+    rule_list = []
+    for rule_name in sort(rules.keys()):
+        rule = rules[rule_name]
+
+        def match_of(fact, when, assignments=None):
+            result = generate_match(when, positions[str(fact).lower()], assignments)
+            result["fact"] = str(fact)
+            return result
+
+        item = {
+            "name": str(rule_name),
+            "description": str(rule["description"]),
+            "locals": tuple(str(x).lower() for x in sort(rule["locals"].keys())),
+            "matches": [match_of(x["fact"], x["when"], x["assignments"]) for x in rule["matches"]],
+            "inverted": [match_of(x["fact"], x["when"]) for x in rule["inverted_matches"]],
+            "predicate": None,
+            "produced": None,
+            "produce": None,
+            "distinct": bool(rule.get("distinct")),
+            "suppressed": None
+        }
+
+        if rule["final_predicate"] is not True:
+            item["predicate"] = "lambda l: %s" % generate_expression(rule["final_predicate"], {})
+
+        if "produced_fact" in rule:
+            fields = sort(rule["produced_fields"].keys())
+            item["produced"] = str(rule["produced_fact"])
+            item["produce"] = "lambda l: (%s)" % "".join("%s, " % generate_expression(rule["produced_fields"][x], {}) for x in fields)
+
+        else:
+            item["suppressed"] = match_of(rule["suppressed_fact"], rule["suppressed_when"])
+
+        rule_list.append(item)
+
+    ####################################################################
+    #
+    # Open the template and run it.
+    #
+    ####################################################################
+
+    template_file = resource_string(__name__, 'python.jinja').decode('utf-8')
+    env = jinja2.Environment(loader=jinja2.FunctionLoader(lambda x: (template_file, 'python.jinja', lambda: template_file)),
+                             trim_blocks=True, lstrip_blocks=True)
+    env.filters["repr"] = repr
+    template = env.get_template('python.jinja')
+
+    names = {
+        "description": str(description),
+        "file": filename,
+        "prefix": new_prefix,
+        "facts": fact_list,
+        "parameters": parameter_list,
+        "rules": rule_list,
+        "time": str(datetime.datetime.now())
+    }
+
+    return template.render(**names)
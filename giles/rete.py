@@ -0,0 +1,903 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Run an engine compiled by the Python backend in-process.
+#
+######################################################################
+
+"""
+rete.py - run an engine compiled by the Python backend in-process
+
+The Python backend compiles a rule set to a module defining a subclass of
+Engine, which describes the engine's fact classes, parameters, and rules;
+this module builds a Rete network from that description and maintains it
+in memory as facts are inserted and retracted. It behaves as the schema
+generated by the SQLite backend does, but without a database.
+
+Each fact class hashes its facts on a field that its matches test for
+equality with a constant, so that a fact is only tested against the
+matches that could accept it. The facts accepted by each match, and the
+frames of each stage of a rule, are indexed by the values of the join
+tests that are equalities, so that joins are dictionary lookups. A rule's
+inverted matches count the facts blocking each frame, and every fact
+produced by a rule is retracted when the frame that produced it is.
+
+Expressions follow SQLite's semantics where Python's differ:
+
+    >>> divide(-7, 2), remainder(-7, 2), divide(7.0, 2)
+    (-3, -1, 3.5)
+    >>> divide(1, 0) is None
+    True
+    >>> like("Hello, World", "hello%"), like("Hello", "H_llo"), like("Hello", "H%x")
+    (True, True, False)
+    >>> cast(True, str), cast(2.0, str), cast(" 12abc", int), cast("abc", int)
+    ('1', '2.0', 12, 0)
+    >>> substr("Hello", 2, 3), substr("Hello", -3), substr("Hello", 0, 2)
+    ('ell', 'llo', 'H')
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import re
+import time
+
+######################################################################
+#
+# Operators and functions with SQLite's semantics.
+#
+######################################################################
+
+
+def divide(a, b):
+    """Divide as SQLite does: integers truncate towards zero, and division by zero is NULL."""
+
+    if b == 0:
+        return None
+
+    if isinstance(a, float) or isinstance(b, float):
+        return a / b
+
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def remainder(a, b):
+    """Take the remainder as SQLite does: of the operands as integers, with the sign of the dividend."""
+
+    x, y = int(a), int(b)
+    if y == 0:
+        return None
+
+    result = abs(x) % abs(y)
+    result = -result if x < 0 else result
+    return float(result) if isinstance(a, float) or isinstance(b, float) else result
+
+
+like_patterns = {}  # Compiled LIKE patterns, keyed by pattern
+
+
+def like(value, pattern):
+    """Match a LIKE pattern as SQLite does, ignoring the case of ASCII letters."""
+
+    if pattern not in like_patterns:
+        regex = "".join(".*" if x == "%" else "." if x == "_" else re.escape(x) for x in pattern)
+        like_patterns[pattern] = re.compile(regex + r"\Z", re.ASCII | re.DOTALL | re.IGNORECASE)
+
+    return like_patterns[pattern].match(value) is not None
+
+
+def format_real(value):
+    """Format a real number as SQLite does when converting it to text."""
+
+    text = "%.15g" % value
+    mantissa, exponent = text.split("e") if "e" in text else (text, None)
+    if mantissa.lstrip("-").isdigit():
+        mantissa += ".0"
+
+    return mantissa if exponent is None else "%se%s" % (mantissa, exponent)
+
+
+def cast(value, kind):
+    """Convert a value to another type as SQLite's CAST does."""
+
+    if kind is str:
+        if isinstance(value, float):
+            return format_real(value)
+
+        return str(int(value)) if isinstance(value, (bool, int)) else value
+
+    if kind in (bool, int):
+        if isinstance(value, str):
+            match = re.match(r"\s*([+-]?[0-9]+)", value)
+            return int(match.group(1)) if match is not None else 0
+
+        return int(value)
+
+    if isinstance(value, str):
+        match = re.match(r"\s*([+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?)", value)
+        return float(match.group(1)) if match is not None else 0.0
+
+    return float(value)
+
+
+def substr(value, start, length=None):
+    """Take a substring as SQLite's SUBSTR does, counting from one (or, if negative, from the end)."""
+
+    size = len(value)
+    length = size if length is None else length
+
+    if start < 0:
+        start += size
+        if start < 0:
+            length = max(0, length + start)
+            start = 0
+
+    elif start > 0:
+        start -= 1
+
+    elif length > 0:
+        length -= 1
+
+    if length < 0:
+        start, length = start + length, -length
+        if start < 0:
+            length, start = length + start, 0
+
+    return value[start:start + max(0, min(length, size - start))]
+
+
+ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+ASCII_UPPER = str.maketrans("abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+# The SQLite functions that a rule set may use through the foreign function interface, keyed by
+# their SQL names. An engine can be given others, or replacements for these, when it is created.
+FUNCTIONS = {
+    "ABS": abs,
+    "INSTR": lambda x, y: x.find(y) + 1,
+    "LENGTH": len,
+    "LOWER": lambda x: x.translate(ASCII_LOWER),
+    "LTRIM": lambda x, y=" ": x.lstrip(y),
+    "MAX": max,
+    "MIN": min,
+    "REGEXP": lambda pattern, value: re.search(pattern, value) is not None,
+    "REPLACE": lambda x, y, z: x.replace(y, z) if len(y) > 0 else x,
+    "RTRIM": lambda x, y=" ": x.rstrip(y),
+    "SUBSTR": substr,
+    "TRIM": lambda x, y=" ": x.strip(y),
+    "UPPER": lambda x: x.translate(ASCII_UPPER)
+}
+
+######################################################################
+#
+# The description of a compiled engine. The generated module builds
+# these, with its expressions compiled to functions: those of a fact
+# take a tuple of its fields' values, in the order of the fields'
+# names, and those of a frame take a dictionary of its locals, keyed
+# by their names in lower case.
+#
+######################################################################
+
+
+class FactClass:
+    """A fact class."""
+
+    def __init__(self, name, fields, types, output=False):
+        self.name = name          # The name of the fact class.
+        self.fields = fields      # The names of its fields, sorted.
+        self.types = types        # The type of each field.
+        self.output = output      # True if its facts are kept even if no rule could match them.
+
+
+class Parameter:
+    """A parameter, whose values are the facts of the fact class of the same name."""
+
+    def __init__(self, name, default, lower=None, upper=None, dictionary=False):
+        self.name = name              # The name of the parameter.
+        self.default = default        # The default value of a single-valued parameter.
+        self.lower = lower            # The lowest value allowed, if the parameter is numeric.
+        self.upper = upper            # The highest value allowed, if the parameter is numeric.
+        self.dictionary = dictionary  # True if the parameter maps keys to values.
+
+
+class Match:
+    """A match, or inverted match, on a fact class, or the facts that a rule suppresses."""
+
+    def __init__(self, fact, constants=(), alpha=None, fact_key=None, frame_key=None, join=None, assigned=(), assign=None):
+        self.fact = fact            # The name of the fact class matched.
+        self.constants = constants  # (field number, value) for each test of a field for equality with a constant.
+        self.alpha = alpha          # The match's other tests that don't depend on the frame, or None.
+        self.fact_key = fact_key    # The fields tested for equality with expressions over the frame's locals, or None.
+        self.frame_key = frame_key  # Those expressions, in the same order, or None.
+        self.join = join            # The match's remaining tests, given the fact and the frame, or None.
+        self.assigned = assigned    # The locals assigned by the match.
+        self.assign = assign        # Their values, given the fact and the frame.
+
+
+class Rule:
+    """A rule, which either produces a fact or suppresses facts."""
+
+    def __init__(self, name, description, locals, matches, inverted=(), predicate=None, produced=None, produce=None, distinct=False,
+                 suppressed=None):
+        self.name = name                # The name of the rule.
+        self.description = description  # Its description.
+        self.locals = locals            # The names of its locals, in lower case.
+        self.matches = matches          # Its matches, in order.
+        self.inverted = inverted        # Its inverted matches.
+        self.predicate = predicate      # The rule's final predicate over the locals, or None.
+        self.produced = produced        # The name of the fact class produced, or None.
+        self.produce = produce          # The values of the produced fact's fields, given the frame.
+        self.distinct = distinct        # True if the fact is only produced if no identical fact exists.
+        self.suppressed = suppressed    # The Match selecting the facts suppressed, or None.
+
+######################################################################
+#
+# The Rete network.
+#
+######################################################################
+
+MATCH, BLOCK, DISTINCT = range(3)        # The kinds of stage.
+POSITIVE, INVERTED, SUPPRESSION = range(3)  # The kinds of alpha memory.
+
+
+class Memory:
+    """Facts or frames by ID, in the order they arrived, with hash indexes on keys computed from them."""
+
+    def __init__(self):
+        self.items = {}    # The items, keyed by ID.
+        self.indexes = []  # (key function, {key: {ID: item}}) for each index.
+
+    def add_index(self, key):
+        self.indexes.append((key, {}))
+        return len(self.indexes) - 1
+
+    def add(self, item):
+        self.items[item.id] = item
+        for key, index in self.indexes:
+            index.setdefault(key(item), {})[item.id] = item
+
+    def remove(self, item):
+        del self.items[item.id]
+        for key, index in self.indexes:
+            value = key(item)
+            del index[value][item.id]
+            if len(index[value]) == 0:
+                del index[value]
+
+    def lookup(self, index, key):
+        """Return the items with the given key in the given index, or all of them if the index is None."""
+
+        if index is None:
+            return list(self.items.values())
+
+        return list(self.indexes[index][1].get(key, {}).values())
+
+
+class Fact:
+    """A fact, in a fact class or suppressed."""
+
+    __slots__ = ("id", "kind", "values", "rule", "frame", "present", "memories", "frames", "blocking", "suppressor")
+
+    def __init__(self, kind, values, rule, frame):
+        self.id = None           # The fact's ID, which changes if it is suppressed and restored.
+        self.kind = kind         # The fact class's state.
+        self.values = values     # The values of its fields.
+        self.rule = rule         # The rule that produced it, or None.
+        self.frame = frame       # The frame that produced it, or None.
+        self.present = False     # True while the fact is in its fact class (and not suppressed).
+        self.memories = []       # The alpha memories holding it.
+        self.frames = {}         # The frames that matched it.
+        self.blocking = {}       # The frames of distinct productions that it blocks.
+        self.suppressor = None   # The frame suppressing it, if any.
+
+
+class Frame:
+    """A partial match of a rule, at one of its stages."""
+
+    __slots__ = ("id", "stage", "parent", "children", "locals", "fact", "counts", "blocker", "opened", "alive", "produced",
+                 "suppressed")
+
+    def __init__(self, frame_id, stage, parent, locals, fact):
+        self.id = frame_id     # The frame's ID.
+        self.stage = stage     # Its stage.
+        self.parent = parent   # The frame of the previous stage, or None.
+        self.children = {}     # The frames of the next stage derived from it.
+        self.locals = locals   # Its locals.
+        self.fact = fact       # The fact it matched, at a positive match.
+        self.counts = None     # The number of facts blocking each inverted match, at a blocking stage.
+        self.blocker = None    # The fact identical to the one the rule would produce, at a distinct stage.
+        self.opened = False    # True if the next stage (or the rule's action) has been given this frame.
+        self.alive = True      # False once the frame is deleted.
+        self.produced = None   # The fact produced, at the last stage.
+        self.suppressed = []   # The facts suppressed, at the last stage.
+
+    def unblocked(self):
+        if self.stage.kind == BLOCK:
+            return not any(self.counts)
+
+        if self.stage.kind == DISTINCT:
+            return self.blocker is None
+
+        return True
+
+
+class Stage:
+    """The frames of a rule at one of its positive matches, its inverted matches, or its distinct production."""
+
+    def __init__(self, rule, kind, number, match=None):
+        self.rule = rule                 # The rule.
+        self.kind = kind                 # MATCH, BLOCK, or DISTINCT.
+        self.number = number             # The stage's position in the rule.
+        self.match = match               # The positive match, for a MATCH stage.
+        self.memory = None               # The alpha memory of the positive match, for a MATCH stage.
+        self.previous = None             # The previous stage, if any.
+        self.next = None                 # The next stage, or None if this is the last.
+        self.frames = Memory()           # The frames.
+        self.next_index = None           # The index of the frames joined by the next stage, if it is a MATCH stage.
+        self.blocking_indexes = []       # The index of the frames joined by each inverted match, for a BLOCK stage.
+        self.blocking_memories = []      # The alpha memory of each inverted match, for a BLOCK stage.
+        self.suppression_index = None    # The index of the frames joined by the suppressed facts, for the last stage.
+        self.suppression_memory = None   # The alpha memory of the suppressed facts, for the last stage.
+
+
+class AlphaMemory:
+    """The facts of a fact class that pass the tests of a match that don't depend on its frame."""
+
+    def __init__(self, match, kind, stage, number, order):
+        self.match = match          # The match.
+        self.kind = kind            # POSITIVE, INVERTED, or SUPPRESSION.
+        self.stage = stage          # The stage this memory activates: the match's, the blocking stage, or the last.
+        self.number = number        # The inverted match's position among the rule's inverted matches.
+        self.order = order          # The order in which the memory's activations are made.
+        self.tests = match.constants
+        self.facts = Memory()
+        self.index = None if match.fact_key is None else self.facts.add_index(lambda x: match.fact_key(x.values))
+
+    def accepts(self, values):
+        return all(values[x] == y for x, y in self.tests) and (self.match.alpha is None or self.match.alpha(values))
+
+
+class Kind:
+    """The state of a fact class: its facts, and the alpha memories that test them."""
+
+    def __init__(self, fact_class, parameter):
+        self.fact_class = fact_class  # The fact class.
+        self.parameter = parameter    # The parameter, if the fact class is one.
+        self.facts = {}               # The facts present, by ID.
+        self.next_id = 1              # The ID of the next fact.
+        self.memories = []            # The alpha memories.
+        self.hashed = {}              # {field number: {value: [alpha memory]}} for the memories that hash a field.
+        self.scanned = []             # The memories that don't.
+        self.identical = None         # {values: {ID: fact}}, if a rule produces the fact class distinctly.
+        self.fields = dict((x.lower(), i) for i, x in enumerate(fact_class.fields))
+
+    def build(self):
+        """Hash each memory on the field that the most memories test for equality with a constant."""
+
+        counts = {}
+        for memory in self.memories:
+            for field in set(x for x, y in memory.match.constants):
+                counts[field] = counts.get(field, 0) + 1
+
+        for memory in self.memories:
+            if len(memory.match.constants) == 0:
+                self.scanned.append(memory)
+                continue
+
+            field, value = max(memory.match.constants, key=lambda x: (counts[x[0]], -x[0]))
+            memory.tests = [x for x in memory.match.constants if x != (field, value)]
+            self.hashed.setdefault(field, {}).setdefault(value, []).append(memory)
+
+    def accepting(self, values):
+        """Return the alpha memories accepting a fact, in order."""
+
+        result = [x for x in self.scanned if x.accepts(values)]
+        for field, table in self.hashed.items():
+            result += [x for x in table.get(values[field], ()) if x.accepts(values)]
+
+        return sorted(result, key=lambda x: x.order)
+
+    def pruned(self, memories):
+        """Return true if a fact accepted by these memories is discarded, as no rule could match it."""
+
+        if self.parameter is not None or self.fact_class.output:
+            return False
+
+        return any(x.kind != SUPPRESSION for x in self.memories) and not any(x.kind != SUPPRESSION for x in memories)
+
+######################################################################
+#
+# The engine.
+#
+######################################################################
+
+
+class Engine:
+    """
+    An engine. The Python backend generates a subclass, which sets the
+    prefix, facts, and parameters attributes and the network method.
+    """
+
+    prefix = "giles"  # The prefix the engine was compiled with.
+    facts = ()        # The fact classes.
+    parameters = ()   # The parameters.
+
+    @staticmethod
+    def network(functions):
+        """Return the rules, with their expressions calling foreign functions through the given dictionary."""
+
+        return ()
+
+    def __init__(self, functions=None):
+        """
+        Create an engine, with its parameters set to their defaults and
+        its initial fact inserted. The functions argument maps SQL
+        function names to Python functions, to add to or replace those
+        in FUNCTIONS.
+        """
+
+        self.functions = dict(FUNCTIONS)
+        self.functions.update((x.upper(), y) for x, y in (functions or {}).items())
+
+        parameters = dict((x.name.lower(), x) for x in self.parameters)
+        self.kinds = dict((x.name.lower(), Kind(x, parameters.get(x.name.lower()))) for x in self.facts)
+        self.rules = self.network(self.functions)
+        self.next_frame = 1
+
+        order = 0
+        for rule in self.rules:
+            stages = [Stage(rule, MATCH, i, x) for i, x in enumerate(rule.matches)]
+            if len(rule.inverted) > 0:
+                stages.append(Stage(rule, BLOCK, len(stages)))
+
+            if rule.distinct:
+                stages.append(Stage(rule, DISTINCT, len(stages)))
+                self.kinds[rule.produced.lower()].identical = {}
+
+            for previous, stage in zip(stages, stages[1:]):
+                previous.next = stage
+                stage.previous = previous
+
+            for stage in stages[:len(rule.matches)]:
+                stage.memory = self.add_memory(stage.match, POSITIVE, stage, None, order)
+                order += 1
+
+                if stage.previous is not None and stage.match.frame_key is not None:
+                    stage.previous.next_index = stage.previous.frames.add_index(lambda x, key=stage.match.frame_key: key(x.locals))
+
+            for i, match in enumerate(rule.inverted):
+                stage = stages[len(rule.matches)]
+                stage.blocking_memories.append(self.add_memory(match, INVERTED, stage, i, order))
+                stage.blocking_indexes.append(None if match.frame_key is None else
+                                              stage.frames.add_index(lambda x, key=match.frame_key: key(x.locals)))
+                order += 1
+
+            if rule.suppressed is not None:
+                stage = stages[-1]
+                stage.suppression_memory = self.add_memory(rule.suppressed, SUPPRESSION, stage, None, order)
+                if rule.suppressed.frame_key is not None:
+                    stage.suppression_index = stage.frames.add_index(lambda x, key=rule.suppressed.frame_key: key(x.locals))
+
+                order += 1
+
+        for kind in self.kinds.values():
+            kind.build()
+
+        for parameter in sorted(self.parameters, key=lambda x: x.name.lower()):
+            if not parameter.dictionary:
+                self.insert(parameter.name, Value=parameter.default)
+
+        self.insert("InitialFact", InitializationTime=int(time.time()))
+
+    def add_memory(self, match, kind, stage, number, order):
+        memory = AlphaMemory(match, kind, stage, number, order)
+        self.kinds[match.fact.lower()].memories.append(memory)
+        return memory
+
+    ##################################################################
+    #
+    # The public interface.
+    #
+    ##################################################################
+
+    def kind_of(self, fact):
+        if fact.lower() not in self.kinds:
+            raise Exception("Unknown fact '%s'" % fact)
+
+        return self.kinds[fact.lower()]
+
+    def insert(self, fact, **fields):
+        """Insert a fact, returning its ID, or None if no rule could match it and it was discarded."""
+
+        kind = self.kind_of(fact)
+        names = dict((x.lower(), y) for x, y in fields.items())
+        for name in names:
+            if name not in kind.fields:
+                raise Exception("Unknown field '%s' in fact '%s'" % (name, kind.fact_class.name))
+
+        values = []
+        for name, field_type in zip(kind.fact_class.fields, kind.fact_class.types):
+            if name.lower() not in names:
+                raise Exception("Field '%s' of fact '%s' is required" % (name, kind.fact_class.name))
+
+            values.append(self.convert(kind, name, field_type, names[name.lower()]))
+
+        values = tuple(values)
+        if kind.parameter is not None:
+            self.check_parameter(kind, values)
+
+        fact = self.assert_fact(kind, values, None, None)
+        return fact.id if fact is not None else None
+
+    def retract(self, fact, fact_id):
+        """Retract a fact that was inserted from outside the engine. Returns False if there is no such fact."""
+
+        kind = self.kind_of(fact)
+        if fact_id not in kind.facts:
+            return False
+
+        if kind.facts[fact_id].frame is not None:
+            raise Exception("Cannot delete internal facts.")
+
+        self.remove_fact(kind.facts[fact_id])
+        return True
+
+    def query(self, fact):
+        """Return the facts of a fact class, as dictionaries of their fields and IDs."""
+
+        kind = self.kind_of(fact)
+        result = []
+        for item in kind.facts.values():
+            values = dict(zip(kind.fact_class.fields, item.values))
+            values["id"] = item.id
+            result.append(values)
+
+        return result
+
+    def set_parameter(self, name, value, key=None):
+        """Set a single-valued parameter, or a key of a dictionary parameter."""
+
+        kind = self.kinds.get(name.lower())
+        if kind is None or kind.parameter is None:
+            raise Exception("Invalid parameter name")
+
+        if kind.parameter.dictionary:
+            self.insert(name, Key=key, Value=value)
+
+        elif key is not None:
+            raise Exception("Parameter '%s' is single-valued." % kind.parameter.name)
+
+        else:
+            values = (self.convert(kind, "Value", kind.fact_class.types[0], value),)
+            self.check_parameter(kind, values)
+            for item in list(kind.facts.values()):
+                self.remove_fact(item)
+
+            self.assert_fact(kind, values, None, None)
+
+    def delete_parameter(self, name, key):
+        """Delete a key of a dictionary parameter."""
+
+        kind = self.kinds.get(name.lower())
+        if kind is None or kind.parameter is None:
+            raise Exception("Invalid parameter name")
+
+        if not kind.parameter.dictionary:
+            raise Exception("Parameter '%s' is single-valued." % kind.parameter.name)
+
+        for item in list(kind.facts.values()):
+            if item.values[kind.fields["key"]] == key:
+                self.remove_fact(item)
+
+    def convert(self, kind, name, field_type, value):
+        """Check a value for a field, converting it as SQLite's column affinities would."""
+
+        if field_type is str and isinstance(value, str):
+            return value
+
+        if field_type is bool and value in (0, 1) and not isinstance(value, float):
+            return bool(value)
+
+        if field_type is int and (isinstance(value, int) or (isinstance(value, float) and value.is_integer())):
+            return int(value)
+
+        if field_type is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+
+        raise Exception("Invalid value for field '%s' of fact '%s'" % (name, kind.fact_class.name))
+
+    def check_parameter(self, kind, values):
+        value = values[kind.fields["value"]]
+        if kind.parameter.lower is not None and (value < kind.parameter.lower or value > kind.parameter.upper):
+            raise Exception("Value of parameter '%s' is out of range" % kind.parameter.name)
+
+        if kind.parameter.dictionary:
+            key = values[kind.fields["key"]]
+            if len(key) == 0:
+                raise Exception("Keys of parameter '%s' must not be empty" % kind.parameter.name)
+
+            if any(x.values[kind.fields["key"]] == key for x in kind.facts.values()):
+                raise Exception("Key '%s' of parameter '%s' is already set" % (key, kind.parameter.name))
+
+    ##################################################################
+    #
+    # Asserting and retracting facts.
+    #
+    ##################################################################
+
+    def assert_fact(self, kind, values, rule, frame):
+        """Assert a fact, returning it, or None if it was discarded."""
+
+        memories = kind.accepting(values)
+        if kind.pruned(memories):
+            return None
+
+        fact = Fact(kind, values, rule, frame)
+        self.add_fact(fact, memories)
+        return fact
+
+    def add_fact(self, fact, memories):
+        """Add a new or restored fact to its fact class and activate the matches that accept it."""
+
+        kind = fact.kind
+        fact.id = kind.next_id
+        kind.next_id += 1
+
+        # A fact that an open frame suppresses goes straight to that frame.
+        for memory in memories:
+            if memory.kind == SUPPRESSION:
+                frame = self.find_suppressor(memory, fact)
+                if frame is not None:
+                    fact.suppressor = frame
+                    frame.suppressed.append(fact)
+                    return
+
+        fact.present = True
+        fact.memories = memories
+        kind.facts[fact.id] = fact
+        if kind.identical is not None:
+            kind.identical.setdefault(fact.values, {})[fact.id] = fact
+
+        for memory in memories:
+            memory.facts.add(fact)
+
+        # The fact blocks the frames that its inverted matches join...
+        for memory in memories:
+            if memory.kind == INVERTED:
+                for frame in self.joined_frames(memory, fact):
+                    frame.counts[memory.number] += 1
+                    if frame.opened and not frame.unblocked():
+                        self.close_frame(frame)
+
+        # ...and then joins the frames of its positive matches, the later matches of each rule first, so that a fact
+        # matched by more than one of them is joined with itself only once.
+        for memory in reversed(memories):
+            if memory.kind == POSITIVE and fact.present:
+                stage = memory.stage
+                if stage.previous is None:
+                    self.create_frame(stage, None, fact)
+
+                else:
+                    for frame in self.joined_frames(memory, fact):
+                        if fact.present:
+                            self.create_frame(stage, frame, fact)
+
+    def remove_fact(self, fact):
+        """Remove a fact from its fact class, retracting everything derived from it."""
+
+        kind = fact.kind
+        fact.present = False
+        del kind.facts[fact.id]
+        if kind.identical is not None:
+            del kind.identical[fact.values][fact.id]
+            if len(kind.identical[fact.values]) == 0:
+                del kind.identical[fact.values]
+
+        memories, fact.memories = fact.memories, []
+        for memory in memories:
+            memory.facts.remove(fact)
+
+        unblocked = []
+        for memory in memories:
+            if memory.kind == INVERTED:
+                for frame in self.joined_frames(memory, fact):
+                    frame.counts[memory.number] -= 1
+                    if frame.counts[memory.number] == 0:
+                        unblocked.append(frame)
+
+        for frame in list(fact.frames.values()):
+            self.delete_frame(frame)
+
+        for frame in unblocked:
+            if frame.alive and not frame.opened and frame.unblocked():
+                self.open_frame(frame)
+
+        # The distinct productions it blocked look for another identical fact, and fire if there is none.
+        for frame in list(fact.blocking.values()):
+            del fact.blocking[frame.id]
+            if frame.alive:
+                frame.blocker = self.find_identical(frame)
+                if frame.blocker is None:
+                    self.open_frame(frame)
+
+    def joined_frames(self, memory, fact):
+        """Return the live frames that a fact accepted by an alpha memory joins."""
+
+        match = memory.match
+        if memory.kind == INVERTED:
+            index = memory.stage.blocking_indexes[memory.number]
+            stage = memory.stage
+
+        elif memory.kind == SUPPRESSION:
+            index = memory.stage.suppression_index
+            stage = memory.stage
+
+        else:
+            index = memory.stage.previous.next_index
+            stage = memory.stage.previous
+
+        frames = stage.frames.lookup(index, match.fact_key(fact.values) if index is not None else None)
+        return [x for x in frames if x.alive and (match.join is None or match.join(fact.values, x.locals))]
+
+    def joined_facts(self, memory, frame):
+        """Return the facts in an alpha memory that a frame joins."""
+
+        match = memory.match
+        facts = memory.facts.lookup(memory.index, match.frame_key(frame.locals) if memory.index is not None else None)
+        return [x for x in facts if x.present and (match.join is None or match.join(x.values, frame.locals))]
+
+    ##################################################################
+    #
+    # Creating and deleting frames.
+    #
+    ##################################################################
+
+    def create_frame(self, stage, parent, fact):
+        locals = dict(parent.locals) if parent is not None else dict((x, None) for x in stage.rule.locals)
+        if stage.kind == MATCH and stage.match.assign is not None:
+            locals.update(zip(stage.match.assigned, stage.match.assign(fact.values, parent.locals if parent is not None else locals)))
+
+        frame = Frame(self.next_frame, stage, parent, locals, fact)
+        self.next_frame += 1
+
+        if fact is not None:
+            fact.frames[frame.id] = frame
+
+        if parent is not None:
+            parent.children[frame.id] = frame
+
+        if stage.kind == BLOCK:
+            frame.counts = [len(self.joined_facts(x, frame)) for x in stage.blocking_memories]
+
+        elif stage.kind == DISTINCT:
+            frame.blocker = self.find_identical(frame)
+
+        stage.frames.add(frame)
+        if frame.unblocked():
+            self.open_frame(frame)
+
+    def delete_frame(self, frame):
+        if not frame.alive:
+            return
+
+        frame.alive = False
+        frame.stage.frames.remove(frame)
+        if frame.parent is not None:
+            frame.parent.children.pop(frame.id, None)
+
+        if frame.fact is not None:
+            frame.fact.frames.pop(frame.id, None)
+
+        if frame.blocker is not None:
+            frame.blocker.blocking.pop(frame.id, None)
+
+        if frame.opened:
+            self.close_frame(frame)
+
+    def open_frame(self, frame):
+        """Pass an unblocked frame to the next stage, or take the rule's action if this is the last."""
+
+        frame.opened = True
+        stage = frame.stage.next
+        if stage is None:
+            self.fire(frame)
+
+        elif stage.kind == MATCH:
+            for fact in self.joined_facts(stage.memory, frame):
+                if frame.alive and frame.opened:
+                    self.create_frame(stage, frame, fact)
+
+        else:
+            self.create_frame(stage, frame, None)
+
+    def close_frame(self, frame):
+        """Undo everything done by a frame that is deleted or has become blocked."""
+
+        frame.opened = False
+        if frame.stage.next is None:
+            self.unfire(frame)
+
+        else:
+            for child in list(frame.children.values()):
+                self.delete_frame(child)
+
+    def find_identical(self, frame):
+        """Find a fact identical to the one a distinct production would produce, and mark it as blocking the frame."""
+
+        rule = frame.stage.rule
+        kind = self.kinds[rule.produced.lower()]
+        values = self.produced_values(kind, rule, frame)
+        for fact in kind.identical.get(values, {}).values():
+            fact.blocking[frame.id] = frame
+            return fact
+
+        return None
+
+    def find_suppressor(self, memory, fact):
+        for frame in self.joined_frames(memory, fact):
+            if frame.opened and frame.unblocked() and (memory.stage.rule.predicate is None or memory.stage.rule.predicate(frame.locals)):
+                return frame
+
+        return None
+
+    ##################################################################
+    #
+    # Taking and undoing a rule's action.
+    #
+    ##################################################################
+
+    def produced_values(self, kind, rule, frame):
+        values = rule.produce(frame.locals)
+        return tuple(self.convert(kind, x, y, z) for x, y, z in zip(kind.fact_class.fields, kind.fact_class.types, values))
+
+    def fire(self, frame):
+        rule = frame.stage.rule
+        if rule.predicate is not None and not rule.predicate(frame.locals):
+            return
+
+        if rule.produced is not None:
+            kind = self.kinds[rule.produced.lower()]
+            frame.produced = self.assert_fact(kind, self.produced_values(kind, rule, frame), rule, frame)
+
+        else:
+            for fact in self.joined_facts(frame.stage.suppression_memory, frame):
+                if fact.present and frame.opened:
+                    self.remove_fact(fact)
+                    fact.suppressor = frame
+                    frame.suppressed.append(fact)
+
+    def unfire(self, frame):
+        fact, frame.produced = frame.produced, None
+        if fact is not None:
+            if fact.suppressor is not None:
+                fact.suppressor.suppressed.remove(fact)
+                fact.suppressor = None
+
+            elif fact.present:
+                self.remove_fact(fact)
+
+        suppressed, frame.suppressed = frame.suppressed, []
+        for fact in suppressed:
+            fact.suppressor = None
+            self.add_fact(fact, fact.kind.accepting(fact.values))
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Save and restore the external facts of a compiled engine.
+#
+######################################################################
+
+"""
+snapshot.py - save and restore the external facts of a compiled engine
+
+Everything an engine knows follows from the facts that were inserted from
+outside it and the values of its parameters; its frames, produced facts,
+and indexes can be rebuilt from them. A snapshot holds only those facts,
+including any that are currently suppressed, so it is much smaller than
+the database it was taken from.
+
+A snapshot is a binary file. It begins with a magic number and a table of
+contents listing each fact class and its fields, followed by the facts
+of each fact class in turn, in blocks. Each block holds a row count and
+then, for each field, all of that field's values, compressed with zlib:
+integers as 64-bit little-endian signed integers, reals as 64-bit
+little-endian doubles, and text as the lengths of the UTF-8 encoded
+values as 32-bit little-endian unsigned integers followed by the values
+themselves. A block with no rows ends each fact class.
+
+Restoring a snapshot inserts its facts into a new engine, parameters
+first, with one prepared statement executed for every fact of a block,
+and lets the engine's rules derive everything else.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import re
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+from giles import get_release_string
+from giles.migrate import fact_classes, parameter_names, plan, TYPE_DEFAULTS
+from giles.profile import write_table
+
+######################################################################
+#
+# The Snapshot Format
+#
+######################################################################
+
+MAGIC = b"GILES-SNAPSHOT\x00\x01"
+
+# The codes for the declared types of columns.
+TYPES = ["INTEGER", "REAL", "TEXT"]
+
+# The column holding the time an external fact was inserted, for fact classes that have one.
+TIMESTAMP = "inserted_at"
+
+
+def write_string(output, s):
+    """Write a length-prefixed UTF-8 string."""
+
+    data = s.encode("utf-8")
+    output.write(struct.pack("<H", len(data)) + data)
+
+
+def read_exactly(source, size):
+    """Read exactly the given number of bytes, or raise ValueError."""
+
+    data = source.read(size)
+    if len(data) != size:
+        raise ValueError("the snapshot is truncated")
+    return data
+
+
+def read_string(source):
+    """Read a length-prefixed UTF-8 string."""
+
+    return read_exactly(source, struct.unpack("<H", read_exactly(source, 2))[0]).decode("utf-8")
+
+
+def encode_column(declared, values):
+    """Return the compressed encoding of a column of values of a declared type.
+
+    >>> decode_column("TEXT", 3, encode_column("TEXT", ["a", "", "été"]))
+    ['a', '', 'été']
+    >>> decode_column("INTEGER", 2, encode_column("INTEGER", [-1, 1 << 40]))
+    [-1, 1099511627776]
+    >>> decode_column("REAL", 1, encode_column("REAL", [0.5]))
+    [0.5]
+    """
+
+    if declared == "INTEGER":
+        data = struct.pack("<%dq" % len(values), *values)
+    elif declared == "REAL":
+        data = struct.pack("<%dd" % len(values), *values)
+    else:
+        encoded = [x.encode("utf-8") for x in values]
+        data = struct.pack("<%dI" % len(encoded), *[len(x) for x in encoded]) + b"".join(encoded)
+
+    return zlib.compress(data)
+
+
+def decode_column(declared, count, data):
+    """Return the values of a column of a declared type from its compressed encoding."""
+
+    data = zlib.decompress(data)
+    if declared == "INTEGER":
+        return list(struct.unpack("<%dq" % count, data))
+    elif declared == "REAL":
+        return list(struct.unpack("<%dd" % count, data))
+
+    lengths = struct.unpack_from("<%dI" % count, data)
+    values = []
+    offset = 4 * count
+    for length in lengths:
+        values.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    return values
+
+
+def write_contents(output, classes):
+    """Write the magic number and the table of contents: (name, is a parameter, [(field, declared type)]) for each class."""
+
+    output.write(MAGIC + struct.pack("<I", len(classes)))
+    for name, parameter, columns in classes:
+        write_string(output, name)
+        output.write(struct.pack("<BH", 1 if parameter else 0, len(columns)))
+        for field, declared in columns:
+            write_string(output, field)
+            output.write(struct.pack("<B", TYPES.index(declared)))
+
+
+def read_contents(source):
+    """Read the magic number and the table of contents."""
+
+    if read_exactly(source, len(MAGIC)) != MAGIC:
+        raise ValueError("not a snapshot, or a snapshot from an incompatible version")
+
+    classes = []
+    for _ in range(struct.unpack("<I", read_exactly(source, 4))[0]):
+        name = read_string(source)
+        parameter, count = struct.unpack("<BH", read_exactly(source, 3))
+        columns = []
+        for _ in range(count):
+            field = read_string(source)
+            columns.append((field, TYPES[struct.unpack("<B", read_exactly(source, 1))[0]]))
+        classes.append((name, parameter != 0, columns))
+
+    return classes
+
+
+def write_block(output, columns, rows):
+    """Write a block of rows; an empty block ends a fact class."""
+
+    output.write(struct.pack("<I", len(rows)))
+    for i, (field, declared) in enumerate(columns if rows else []):
+        data = encode_column(declared, [x[i] for x in rows])
+        output.write(struct.pack("<I", len(data)) + data)
+
+
+def read_blocks(source, columns):
+    """Yield the blocks of rows of a fact class, each as a list of columns.
+
+    >>> import io
+    >>> output = io.BytesIO()
+    >>> columns = [("Name", "TEXT"), ("Age", "INTEGER")]
+    >>> write_contents(output, [("Person", False, columns)])
+    >>> write_block(output, columns, [("Rob", 34), ("Joel", 30)])
+    >>> write_block(output, columns, [])
+    >>> source = io.BytesIO(output.getvalue())
+    >>> read_contents(source)
+    [('Person', False, [('Name', 'TEXT'), ('Age', 'INTEGER')])]
+    >>> list(read_blocks(source, columns))
+    [[['Rob', 'Joel'], [34, 30]]]
+    """
+
+    while True:
+        count = struct.unpack("<I", read_exactly(source, 4))[0]
+        if count == 0:
+            break
+
+        block = []
+        for field, declared in columns:
+            size = struct.unpack("<I", read_exactly(source, 4))[0]
+            block.append(decode_column(declared, count, read_exactly(source, size)))
+        yield block
+
+######################################################################
+#
+# Taking Snapshots
+#
+######################################################################
+
+
+def has_timestamps(db, schema, table):
+    """Return true if the named table records when each fact was inserted."""
+
+    return any(x[1].lower() == TIMESTAMP for x in db.execute("PRAGMA \"%s\".table_info(\"%s\")" % (schema, table)))
+
+
+def external_facts(db, prefix, name, columns, batch):
+    """Yield the externally-inserted facts of a fact class in blocks, those in its shadow table last."""
+
+    fields = ", ".join("CAST(\"%s\" AS %s)" % x for x in columns)
+    for table, key in (("_%s_%s_actual" % (prefix, name), "id"), ("_%s_%s_shadow" % (prefix, name), "rowid")):
+        last = -1
+        while True:
+            rows = db.execute("SELECT %s, %s FROM \"%s\" WHERE frame IS NULL AND %s > ? ORDER BY %s LIMIT ?" %
+                              (fields, key, table, key, key), (last, batch)).fetchall()
+            if len(rows) == 0:
+                break
+            last = rows[-1][-1]
+            yield rows
+
+
+def take_snapshot(db, prefix, output, batch, progress):
+    """Write a snapshot of an engine's external facts, returning (name, facts) for each fact class."""
+
+    parameters = parameter_names(db, "main", prefix)
+    classes = []
+    for key, (name, fields) in sorted(fact_classes(db, "main", prefix).items(), key=lambda x: (x[0] not in parameters, x[0])):
+        if has_timestamps(db, "main", "_%s_%s_actual" % (prefix, name)):
+            fields = fields + [(TIMESTAMP, "INTEGER")]
+        classes.append((name, key in parameters, fields))
+
+    write_contents(output, classes)
+
+    counts = []
+    for name, parameter, columns in classes:
+        count = 0
+        for rows in external_facts(db, prefix, name, columns, batch):
+            write_block(output, columns, rows)
+            count += len(rows)
+            progress(name, count)
+        write_block(output, columns, [])
+        counts.append((name, count))
+
+    return counts
+
+######################################################################
+#
+# Restoring Snapshots
+#
+######################################################################
+
+
+def restore_snapshot(db, prefix, source, progress):
+    """Insert the facts in a snapshot into an engine, returning (name, facts) for each fact class and any warnings."""
+
+    contents = read_contents(source)
+    destination = fact_classes(db, "main", prefix)
+    snapshot = dict((name.lower(), (name, [x for x in columns if x[0] != TIMESTAMP])) for name, parameter, columns in contents)
+    copies, warnings = plan(snapshot, destination, parameter_names(db, "main", prefix), ({}, {}), {})
+    copies = dict((x.old.lower(), x) for x in copies)
+
+    counts = []
+    for name, parameter, columns in contents:
+        copy = copies.get(name.lower())
+        if copy is None:
+            for block in read_blocks(source, columns):
+                pass
+            continue
+
+        # Each new field is filled from a column of the snapshot or with a default.
+        positions = dict((x[0].lower(), i) for i, x in enumerate(columns))
+        sources = [(positions[x[1].lower()], None) if x[1] is not None else
+                   (None, x[3] if x[3] is not None else TYPE_DEFAULTS.get(x[2], "")) for x in copy.columns]
+        fields = [x[0] for x in copy.columns]
+        if TIMESTAMP in positions and has_timestamps(db, "main", "_%s_%s_actual" % (prefix, copy.new)):
+            fields.append(TIMESTAMP)
+            sources.append((positions[TIMESTAMP], None))
+
+        if copy.parameters:
+            # Parameters are set through the parameters view, so that a single-valued parameter replaces its default.
+            key = [i for i, x in enumerate(fields) if x.lower() == "key"]
+            value = [i for i, x in enumerate(fields) if x.lower() == "value"][0]
+            sources = [sources[key[0]] if key else (None, None), sources[value]]
+            statement = "INSERT INTO \"%s_parameters\"(name, key, value) VALUES('%s', ?, ?)" % (prefix, copy.new)
+        else:
+            statement = "INSERT INTO \"_%s_%s_actual\"(%s) VALUES(%s)" % (prefix, copy.new, ", ".join("\"%s\"" % x for x in fields),
+                                                                          ", ".join("?" * len(fields)))
+
+        count = 0
+        for block in read_blocks(source, columns):
+            size = len(block[0]) if block else 0
+            values = [block[i] if i is not None else [constant] * size for i, constant in sources]
+            db.execute("BEGIN")
+            db.executemany(statement, zip(*values))
+            db.execute("COMMIT")
+            count += size
+            progress(copy.new, count)
+
+        counts.append((copy.new, count))
+
+    return counts, warnings
+
+######################################################################
+#
+# The main entry points.
+#
+######################################################################
+
+
+def connect(path):
+    """Open an engine database for restoring a snapshot."""
+
+    db = sqlite3.connect(path, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: re.search(x, y) is not None)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA recursive_triggers = ON")
+    return db
+
+
+def write_summary(output, counts, elapsed, size):
+    """Write the number of facts of each fact class that was saved or restored."""
+
+    output.write("%d facts in %.1f s, %d bytes\n\n" % (sum(x[1] for x in counts), elapsed, size))
+    write_table(output, "Fact classes", ["facts", "fact"], [[count, name] for name, count in counts], 0)
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Save the external facts of a compiled engine to a snapshot")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-b', '--batch', dest='batch', default=100000, type=int,
+                            help="store this many facts in each block", metavar="COUNT")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-q', '--quiet', dest='quiet', default=False, action='store_const', const=True,
+                            help="do not report progress or the summary")
+    arg_parser.add_argument('database', type=str, help="the database holding the engine", metavar="DATABASE")
+    arg_parser.add_argument('snapshot', type=str, help="the snapshot to write", metavar="SNAPSHOT")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if arguments.batch < 1:
+        arg_parser.error("the batch size must be at least 1")
+
+    def progress(name, count):
+        if not arguments.quiet:
+            sys.stderr.write("%s: %d facts\n" % (name, count))
+
+    db = sqlite3.connect("file:%s?mode=ro" % arguments.database, uri=True, isolation_level=None)
+    started = time.perf_counter()
+
+    # The snapshot is only created once there is something to put in it.
+    if len(fact_classes(db, "main", arguments.prefix)) == 0:
+        sys.stderr.write("No fact classes with the prefix %s were found in %s; is the prefix correct?\n" %
+                         (arguments.prefix, arguments.database))
+        sys.exit(1)
+
+    output = sys.stdout.buffer if arguments.snapshot == "-" else open(arguments.snapshot, "wb")
+
+    # Read every fact class in one transaction, so that the snapshot is consistent even if the engine is in use.
+    db.execute("BEGIN")
+    counts = take_snapshot(db, arguments.prefix, output, arguments.batch, progress)
+    db.execute("COMMIT")
+    db.close()
+
+    size = output.tell()
+    output.close()
+    if not arguments.quiet:
+        write_summary(sys.stdout, counts, time.perf_counter() - started, size)
+
+    sys.exit(0)
+
+
+def restore_main(*args):
+    arg_parser = argparse.ArgumentParser(description="Restore the external facts of a compiled engine from a snapshot")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-c', '--schema', dest='schema_file', default=None, type=argparse.FileType('r'),
+                            help="load this compiled schema into the database first", metavar="SCHEMA")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-q', '--quiet', dest='quiet', default=False, action='store_const', const=True,
+                            help="do not report progress, warnings, or the summary")
+    arg_parser.add_argument('snapshot', type=argparse.FileType('rb'), help="the snapshot to restore", metavar="SNAPSHOT")
+    arg_parser.add_argument('database', type=str, help="the database holding the engine", metavar="DATABASE")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    def progress(name, count):
+        if not arguments.quiet:
+            sys.stderr.write("%s: %d facts\n" % (name, count))
+
+    db = connect(arguments.database)
+    if arguments.schema_file is not None:
+        db.executescript(arguments.schema_file.read())
+
+    started = time.perf_counter()
+    try:
+        counts, warnings = restore_snapshot(db, arguments.prefix, arguments.snapshot, progress)
+    except (ValueError, zlib.error, struct.error) as e:
+        sys.stderr.write("Cannot read %s: %s\n" % (arguments.snapshot.name, e))
+        sys.exit(1)
+    except sqlite3.Error as e:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        sys.stderr.write("Cannot restore %s: %s\n" % (arguments.snapshot.name, e))
+        sys.exit(1)
+
+    size = arguments.snapshot.tell()
+    db.close()
+
+    if not arguments.quiet:
+        for warning in warnings:
+            sys.stderr.write("warning: %s\n" % warning)
+        write_summary(sys.stdout, counts, time.perf_counter() - started, size)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
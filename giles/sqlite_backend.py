@@ -48,7 +48,7 @@ from itertools import chain
 
 domains = {}      # Domains for the only_once routines
 prefix = "giles"  # Default prefix for object names
-indexes = {}      # The indexes on each fact table
+indexes = {}      # The indexes on each fact table, keyed by table and partial index predicate
 
 ######################################################################
 #
@@ -148,24 +148,184 @@ def flatten_predicate(when):
     return predicates
 
 
-def generate_predicate_wrapper(fact, when):
-    results = generate_predicate(fact, when)
+def generate_predicate_wrapper(fact, when, fact_prefix='new'):
+    results = generate_predicate(fact, when, fact_prefix)
     if len(results) == 0:
         return "1"
     else:
         return " AND ".join(results)
 
 
-def generate_predicate(fact, when):
+def generate_predicate(fact, when, fact_prefix='new'):
     """
-    fact - the fact being matched
-    when  - the predicate
+    fact        - the fact being matched
+    when        - the predicate
+    fact_prefix - fact prefix
     """
 
+    return [x[1] for x in generate_alpha_tests(fact, when, fact_prefix)]
+
+
+def generate_alpha_tests(fact, when, fact_prefix='new'):
+    """Return the constant tests of a predicate as (cost, SQL) pairs, cheapest first."""
+
     tests = flatten_predicate(when)
-    tests.sort(key=lambda x: str(x.arg1.variable).lower())
+    tests.sort(key=lambda x: (test_cost(x), str(x.arg1.variable).lower()))
+
+    return [(test_cost(x), generate_expression(x, fact, None, fact_prefix)) for x in tests]
+
+######################################################################
+#
+# Estimate the relative cost of evaluating an expression. Comparing
+# numbers is cheapest, then comparing strings, then pattern matching
+# with LIKE, and calling out to a function (including the regular
+# expression matcher, which calls back into Python) is dearest.
+#
+######################################################################
+
+
+def test_cost(value):
+    if isinstance(value, expression.BinaryOpNode):
+        if value.operation in ("REGEXP", "NOT REGEXP"):
+            cost = 16
+        elif value.operation in ("LIKE", "NOT LIKE"):
+            cost = 4
+        elif str in (value.type, getattr(value.arg1, "type", type(value.arg1))):
+            cost = 2
+        else:
+            cost = 1
+        return cost + test_cost(value.arg1) + test_cost(value.arg2)
+
+    elif isinstance(value, expression.UnaryOpNode):
+        return 1 + test_cost(value.arg1)
+
+    elif isinstance(value, expression.IfNode):
+        return 1 + test_cost(value.predicate) + max(test_cost(value.if_true), test_cost(value.if_false))
+
+    elif isinstance(value, expression.CastNode):
+        return 1 + test_cost(value.expression)
+
+    elif isinstance(value, expression.FunctionNode):
+        return 16 + sum(test_cost(x) for x in value.args)
+
+    return 0
+
+######################################################################
+#
+# Build the alpha discrimination network for a fact class. A fact is
+# worth keeping if it passes the constant tests of any match against
+# its class. Rather than testing each match's predicate in turn, the
+# predicates are folded together: duplicate predicates are dropped, a
+# predicate is dropped if another one needs only some of its tests
+# (since anything passing it passes the other), and a test shared by
+# several predicates is factored out and performed once for all of
+# them. Tests are performed cheapest first, so that SQLite's
+# short-circuiting skips the dearer ones whenever it can.
+#
+# The result is a SQL expression that is true if the fact is worth
+# keeping, or None if every fact is.
+#
+######################################################################
+
+
+def generate_alpha_network(predicates):
+    costs = {}
+    for predicate in predicates:
+        costs.update((sql, cost) for cost, sql in predicate)
+
+    def order(tests):
+        return sorted(tests, key=lambda x: (costs[x], x))
+
+    def discriminate(sets):
+        if len(sets) == 0:
+            return "0"
+
+        if any(len(x) == 0 for x in sets):
+            return None
+
+        sets = set(sets)
+        sets = [x for x in sets if not any(y < x for y in sets)]
+
+        counts = {}
+        for tests in sets:
+            for test in tests:
+                counts[test] = counts.get(test, 0) + 1
+
+        shared = min(counts, key=lambda x: (-counts[x], costs[x], x))
+        if counts[shared] == 1:
+            return " OR ".join("(%s)" % " AND ".join(order(x)) for x in sorted(sets, key=lambda x: (sum(costs[y] for y in x), order(x))))
+
+        rest = discriminate([x - set([shared]) for x in sets if shared in x])
+        result = "(%s)" % shared if rest is None else "(%s AND (%s))" % (shared, rest)
+
+        others = [x for x in sets if shared not in x]
+        if len(others) > 0:
+            result += " OR " + discriminate(others)
+
+        return result
+
+    return discriminate([frozenset(x[1] for x in predicate) for predicate in predicates])
+
+######################################################################
+#
+# Group the positive matches on a fact class into dispatcher triggers.
+# SQLite runs every statement of a trigger that fires, so rather than
+# one trigger for the whole fact class, there is one for each group of
+# matches that test a field for equality with the same value, like the
+# buckets of a hashed alpha memory. The test shared by the most matches
+# is chosen first. Each trigger's WHEN clause makes the tests that all
+# of its matches share, and each statement the rest of its match's.
+# A match that shares no such test keeps a trigger to itself, and the
+# matches without tests share a trigger with no WHEN clause.
+#
+# Each unit is the list of a rule's activations on the fact class,
+# which stay together and in order, and the tests they all share, as
+# (cost, SQL, equality) triples; the predicates give every activation's
+# tests as (cost, SQL) pairs. The result is a list of (WHEN, list of
+# (activation, guard)) pairs.
+#
+######################################################################
+
+
+def generate_dispatch_groups(units, predicates):
+    costs = {}
+    for predicate in predicates.values():
+        costs.update((sql, cost) for cost, sql in predicate)
+
+    def order(tests):
+        return sorted(tests, key=lambda x: (costs[x], x))
+
+    def group(members):
+        shared = set.intersection(*(set(x[1] for x in tests) for activations, tests in members))
+        guarded = []
+        for activation in (x for activations, tests in members for x in activations):
+            rest = order(set(x[1] for x in predicates[activation]) - shared)
+            guarded.append((activation, " AND ".join(rest) if len(rest) > 0 else None))
+
+        return " AND ".join(order(shared)) if len(shared) > 0 else None, guarded
+
+    groups = []
+    unconditional = [x for x in units if len(x[1]) == 0]
+    if len(unconditional) > 0:
+        groups.append(group(unconditional))
+
+    remaining = [x for x in units if len(x[1]) > 0]
+    while len(remaining) > 0:
+        counts = {}
+        for activations, tests in remaining:
+            for cost, sql, equality in tests:
+                if equality:
+                    counts[sql] = counts.get(sql, 0) + 1
 
-    return [generate_expression(x, fact, None, 'new') for x in tests]
+        if len(counts) == 0 or max(counts.values()) < 2:
+            groups += [group([x]) for x in remaining]
+            break
+
+        shared = min(counts, key=lambda x: (-counts[x], costs[x], x))
+        groups.append(group([x for x in remaining if any(y[1] == shared for y in x[1])]))
+        remaining = [x for x in remaining if not any(y[1] == shared for y in x[1])]
+
+    return groups
 
 ######################################################################
 #
@@ -202,6 +362,35 @@ def find_locals(value):
     else:
         return []
 
+
+def find_fields(value):
+    if isinstance(value, expression.ThisReferenceNode):
+        return [value.variable]
+
+    elif isinstance(value, expression.BinaryOpNode):
+        return find_fields(value.arg1) + find_fields(value.arg2)
+
+    elif isinstance(value, expression.UnaryOpNode):
+        return find_fields(value.arg1)
+
+    elif isinstance(value, expression.IfNode):
+        return find_fields(value.predicate) + find_fields(value.if_true) + find_fields(value.if_false)
+
+    elif isinstance(value, expression.FunctionNode):
+        fields = []
+        for arg in value.args:
+            fields += find_fields(arg)
+        return fields
+
+    elif isinstance(value, expression.CastNode):
+        return find_fields(value.expression)
+
+    elif isinstance(value, expression.JoinNode):
+        return find_fields(value.left) + find_fields(value.right)
+
+    else:
+        return []
+
 ######################################################################
 #
 # Add an index for a table. If an index already exists for that table
@@ -212,36 +401,61 @@ def find_locals(value):
 # list of indexed fields is in the same order as the fields were
 # specified in the query).
 #
+# Partial indexes (those with a "where" predicate) are tracked
+# separately for each distinct predicate, since an index is only
+# usable by a query whose predicate implies the index's predicate.
+#
 ######################################################################
 
 
-def add_index(table, fields):
+def add_index(table, fields, where=None):
     table = table.lower()
 
     if len(fields) == 0:
         return
 
-    if table not in indexes:
-        indexes[table] = {}
+    if (table, where) not in indexes:
+        indexes[(table, where)] = {}
 
-    current = indexes[table]
+    current = indexes[(table, where)]
     for field in fields:
         if field not in current:
             current[field] = {}
         current = current[field]
 
+######################################################################
+#
+# Determine if a test can be used as the predicate of a partial index.
+# Only simple comparisons of a field against a literal constant are
+# allowed: SQLite prohibits non-deterministic functions (like a
+# user-supplied REGEXP) in partial index predicates, and the query
+# planner only uses a partial index if each of its terms appears
+# verbatim in the query.
+#
+######################################################################
+
+partial_index_operations = ("=", "!=", "<", "<=", ">", ">=")
+
+
+def is_partial_index_test(test):
+    return isinstance(test.arg1, expression.ThisReferenceNode) and \
+        type(test.arg2) in (bool, float, int, str) and \
+        test.operation in partial_index_operations
+
 ######################################################################
 #
 # Generate a join expression. This takes all of the tests against
 # a given fact and applies them (optionally excluding the constant
 # tests). Equalities are sorted and placed in front of any
 # inequalities, which allows for better index usage and query
-# optimization.
+# optimization. If frame_column is given, the query also tests that
+# column of the frames table, and it is indexed after the equality
+# variables.
 #
 ######################################################################
 
 
-def generate_join(when, fact, frame_prefix=None, fact_prefix=None, include_constants=True):
+def generate_join(when, fact, frame_prefix=None, fact_prefix=None, include_constants=True, frame_column=None):
     result = ""
     equalities = []
     inequalities = []
@@ -284,6 +498,9 @@ def generate_join(when, fact, frame_prefix=None, fact_prefix=None, include_const
         for predicate in equalities:
             equality_variables += find_locals(predicate)
 
+        if frame_column is not None:
+            equality_variables.append(frame_column)
+
         if len(inequalities) > 0:
             add_index(frame_prefix, equality_variables + find_locals(inequalities[0]))
 
@@ -291,18 +508,70 @@ def generate_join(when, fact, frame_prefix=None, fact_prefix=None, include_const
             add_index(frame_prefix, equality_variables)
 
     if fact_prefix not in ('new', 'old'):  # Don't add indexes for expressions over immediately-available data (i.e. new/old frames/facts)
-        equality_variables = []
-        for predicate in equalities:
-            equality_variables.append(predicate.arg1.variable)
+        constant_tests = [x for x in equalities + inequalities if is_partial_index_test(x)]
+        join_equalities = [x for x in equalities if not is_partial_index_test(x)]
+        join_inequalities = [x for x in inequalities if not is_partial_index_test(x)]
 
-        if len(inequalities) > 0:
-            add_index(fact_prefix, equality_variables + [inequalities[0].arg1.variable])
+        # If the join also filters on constants, index only the rows that pass those constant tests.
+        # This keeps the index small when the constant tests are selective.
+        if len(constant_tests) > 0 and len(join_equalities + join_inequalities) > 0:
+            where = " AND ".join(generate_expression(x, fact, None, None) for x in constant_tests)
+            equality_variables = [x.arg1.variable for x in join_equalities]
 
-        elif len(equality_variables) > 0:
-            add_index(fact_prefix, equality_variables)
+            if len(join_inequalities) > 0:
+                add_index(fact_prefix, equality_variables + [join_inequalities[0].arg1.variable], where)
+
+            else:
+                add_index(fact_prefix, equality_variables, where)
+
+        else:
+            equality_variables = []
+            for predicate in equalities:
+                equality_variables.append(predicate.arg1.variable)
+
+            if len(inequalities) > 0:
+                add_index(fact_prefix, equality_variables + [inequalities[0].arg1.variable])
+
+            elif len(equality_variables) > 0:
+                add_index(fact_prefix, equality_variables)
 
     return result
 
+######################################################################
+#
+# Find the blocking key of an inverted match. If the only tests that
+# join an inverted match to its frame are equalities between fields
+# of the fact and expressions over locals, the facts blocking a frame
+# are exactly those with the right values in those fields, and so
+# they can be counted once per distinct value rather than once per
+# frame. Returns the equalities sorted by field, or None if the join
+# can't be keyed this way.
+#
+######################################################################
+
+
+def blocking_key(when):
+    tests = []
+
+    def flatten(n):
+        if isinstance(n, expression.JoinNode):
+            flatten(n.left)
+            flatten(n.right)
+
+        elif isinstance(n, expression.BinaryOpNode) and n.type == bool and isinstance(n.arg1, expression.ThisReferenceNode):
+            if len(find_locals(n.arg2)) > 0:
+                tests.append(n)
+
+    flatten(when)
+
+    if any(x.operation != "=" or len(find_fields(x.arg2)) > 0 for x in tests):
+        return None
+
+    if len(set(str(x.arg1.variable).lower() for x in tests)) != len(tests):
+        return None
+
+    return sorted(tests, key=lambda x: str(x.arg1.variable).lower())
+
 ######################################################################
 #
 # Print out a value only when called with it the first time.
@@ -419,6 +688,172 @@ def generate_synthetic_assignment(predicate, rule, prev_clause, synthetic_name):
 
     prev_clause["assignments"][synthetic_name] = predicate
 
+######################################################################
+#
+# Compile a match's temporal constraints into ordinary join tests.
+# The preceding match computes the bounds of the window from its
+# fact's insertion time and stores them in its frame, and this match
+# compares its own fact's insertion time against those bounds. The
+# upper bound is tested first, so that the indexes built for the join
+# lead with it: a new fact then only has to look at the frames whose
+# windows are still open.
+#
+######################################################################
+
+time_column = "inserted_at"
+
+
+def generate_temporal_constraints(rule, i):
+    match = rule["matches"][i]
+    prev_clause = rule["matches"][i - 1]
+    this_time = expression.ThisReferenceNode(time_column, int)
+    tests = []
+
+    for bound, offset, operation in (("window_end_%d" % i, match["within"], "<="),
+                                     ("window_start_%d" % i, match["after"] or 0, ">=")):
+        if offset is None:
+            continue
+
+        bound = CS(bound)
+        rule["locals"][bound] = int
+        prev_clause["assignments"][bound] = this_time + offset if offset != 0 else this_time
+        tests.append(expression.BinaryOpNode(operation, this_time, expression.LocalReferenceNode(bound, int), bool))
+
+    when = tests[0] if len(tests) == 1 else expression.JoinNode(tests[0], tests[1])
+    match["when"] = when if match["when"] is None else expression.JoinNode(when, match["when"])
+
+######################################################################
+#
+# Prepare an aggregate for the template. An aggregate is maintained
+# in a counters table with one row per group, updated by triggers on
+# the aggregated fact class; a synthetic fact exists for each group
+# whose counters satisfy the constant tests of the aggregate match.
+#
+# If the rule reads the aggregate's value (other than in those
+# constant tests), the synthetic fact is replaced whenever the value
+# changes. Otherwise it is only asserted and retracted as the group
+# crosses the threshold, so that the rule doesn't refire on every
+# change.
+#
+######################################################################
+
+
+def generate_aggregate(name, aggregate):
+    match = aggregate["match"]
+    source = aggregate["source"]
+    source_table = "%s_%s_actual" % (prefix, source)
+
+    aggregate["filter_new"] = generate_predicate_wrapper(source, aggregate["filter"], 'new')
+    aggregate["filter_old"] = generate_predicate_wrapper(source, aggregate["filter"], 'old')
+    aggregate["filter_all"] = generate_predicate_wrapper(source, aggregate["filter"], None)
+    aggregate["threshold"] = generate_predicate_wrapper(name, match["when"], 'new')
+
+    reads = []
+    for value in match["assignments"].values():
+        reads += find_fields(value)
+
+    for test in flatten_local_predicates(match["when"]):
+        reads += find_fields(test)
+
+    aggregate["value_used"] = aggregate["name"] in reads
+
+    # Maintaining a minimum or maximum requires finding the new extreme when the current one is deleted.
+    if aggregate["function"] in ("min", "max"):
+        tests = flatten_predicate(aggregate["filter"])
+        if len(tests) > 0 and all(is_partial_index_test(x) for x in tests):
+            add_index(source_table, aggregate["group_by"] + [aggregate["field"]], aggregate["filter_all"])
+
+        else:
+            add_index(source_table, aggregate["group_by"] + [aggregate["field"]])
+
+######################################################################
+#
+# Determine which local variables and matched fact IDs are stored in
+# each of a rule's frames tables. A rule has a stage for each of
+# its match clauses, a single blocking stage for all of its inverted
+# matches, and a stage for its distinct production, if any.
+#
+# By default, every frame stores every local variable and carries
+# forward the IDs of all previously-matched facts. In compact mode,
+# a frame stores only the locals it binds, plus those locals that
+# some later stage (a join, an assignment, a blocking match, or the
+# rule's action) reads. Matched fact IDs are not carried forward at
+# all; they're recovered from the parent chain when needed.
+#
+######################################################################
+
+
+def generate_frame_layout(rule, compact):
+    matches = rule["matches"]
+    rule["blocking_stages"] = 1 if len(rule["inverted_matches"]) > 0 else 0
+    stages = matches + ([rule["inverted_matches"]] if rule["blocking_stages"] else []) + ([None] if rule.get("distinct") else [])
+
+    frame_locals = []
+    fact_columns = []
+    carried_facts = []
+
+    if not compact:
+        for i, stage in enumerate(stages):
+            frame_locals.append(rule["locals"])
+            fact_columns.append(list(range(0, i)))
+            carried_facts.append(list(range(0, i if i < len(matches) else len(matches))))
+
+    else:
+        # The variables read by the rule's action.
+        final_reads = set(find_locals(rule["final_predicate"]))
+        if "produced_fact" in rule:
+            for value in rule["produced_fields"].values():
+                final_reads.update(find_locals(value))
+
+        else:
+            final_reads.update(find_locals(rule["suppressed_when"]))
+
+        # The variables read by each stage, and the variables each stage needs from itself (as opposed to from its parent).
+        reads = []
+        own_reads = []
+        assigned = []
+        for i, stage in enumerate(stages):
+            if stage is None:  # The distinct stage looks up the produced fact using its own frame.
+                reads.append(set(final_reads))
+                own_reads.append(set(final_reads))
+                assigned.append(set())
+
+            elif isinstance(stage, list):  # The blocking stage joins each of the inverted matches using its own frame.
+                stage_reads = set()
+                for inverted_match in stage:
+                    stage_reads.update(find_locals(inverted_match["when"]))
+
+                reads.append(stage_reads)
+                own_reads.append(stage_reads)
+                assigned.append(set())
+
+            else:
+                stage_reads = set(find_locals(stage["when"]))
+                for value in stage.get("assignments", {}).values():
+                    stage_reads.update(find_locals(value))
+
+                reads.append(stage_reads)
+                own_reads.append(stage_reads if i >= len(matches) else set())
+                assigned.append(set(stage.get("assignments", {}).keys()))
+
+        needed_later = set(final_reads)
+        needed = [None] * len(stages)
+        for i in range(len(stages) - 1, -1, -1):
+            needed[i] = set(needed_later)
+            needed_later.update(reads[i])
+
+        available = set()
+        for i, stage in enumerate(stages):
+            available.update(assigned[i])
+            stored = (assigned[i] | own_reads[i] | needed[i]) & available
+            frame_locals.append({k: v for k, v in rule["locals"].items() if k in stored})
+            fact_columns.append([])
+            carried_facts.append([])
+
+    rule["frame_locals"] = frame_locals
+    rule["fact_columns"] = fact_columns
+    rule["carried_facts"] = carried_facts
+
 ######################################################################
 #
 # Generate the SQL.
@@ -426,7 +861,8 @@ def generate_synthetic_assignment(predicate, rule, prev_clause, synthetic_name):
 ######################################################################
 
 
-def generate(new_prefix, filename, description, facts, parameters, rules):
+def generate(new_prefix, filename, description, facts, parameters, rules, compact_frames=False, retention=None, aggregates=None,
+             instrument=False, gauges=False, provenance=False, dispatch=False):
     ####################################################################
     #
     # Reset global state.
@@ -459,12 +895,41 @@ def generate(new_prefix, filename, description, facts, parameters, rules):
     class OutputFact(dict):
         is_output = True
 
+    aggregates = aggregates if aggregates is not None else {}
+
     for rule_clause in rules.values():
         for match in rule_clause["matches"] + rule_clause["inverted_matches"]:
             predicate = generate_predicate(match["fact"], match["when"])
             if len(predicate) == 0:
                 facts[CS(match["fact"])] = OutputFact(facts[CS(match["fact"])])
 
+    for aggregate in aggregates.values():
+        predicate = generate_predicate(aggregate["source"], aggregate["filter"])
+        if len(predicate) == 0:
+            facts[CS(aggregate["source"])] = OutputFact(facts[CS(aggregate["source"])])
+
+    ####################################################################
+    #
+    # Compile temporal constraints. Any fact class involved in one, or
+    # with a retention policy, records the time each fact was inserted.
+    #
+    ####################################################################
+
+    retention = retention if retention is not None else {}
+    timestamped = set(retention.keys())
+    windows = []
+
+    for rule_name, rule in rules.items():
+        for i, match_clause in enumerate(rule["matches"]):
+            if match_clause.get("within") is not None or match_clause.get("after") is not None:
+                generate_temporal_constraints(rule, i)
+                timestamped.add(CS(match_clause["fact"]))
+                timestamped.add(CS(rule["matches"][i - 1]["fact"]))
+
+                if match_clause["within"] is not None:
+                    windows.append((rule_name, i))
+                    add_index("%s_%s_%d_frames" % (prefix, rule_name, i - 1), ["window_end_%d" % i])
+
     ####################################################################
     #
     # Optimize any match clauses that have expressions using assignments
@@ -487,6 +952,111 @@ def generate(new_prefix, filename, description, facts, parameters, rules):
                             generate_synthetic_assignment(clause.arg2, rule, prev_clause, synthetic_name)
                             clause.arg2 = expression.LocalReferenceNode(synthetic_name, clause.arg2.type)
 
+    ####################################################################
+    #
+    # Assign each rule a small integer ID. Facts and shadow facts refer
+    # to their producing and suppressing rules by these IDs.
+    #
+    ####################################################################
+
+    for rule_id, rule_name in enumerate(sorted(rules.keys(), key=lambda x: str(x).lower()), 1):
+        rules[rule_name]["id"] = rule_id
+
+    ####################################################################
+    #
+    # Prepare the aggregates.
+    #
+    ####################################################################
+
+    for name, aggregate in aggregates.items():
+        generate_aggregate(name, aggregate)
+
+    ####################################################################
+    #
+    # Build the alpha discrimination network for each fact class.
+    #
+    ####################################################################
+
+    alpha_predicates = dict((CS(x), []) for x in facts.keys())
+    for rule_clause in rules.values():
+        for match in rule_clause["matches"] + rule_clause["inverted_matches"]:
+            alpha_predicates[CS(match["fact"])].append(generate_alpha_tests(match["fact"], match["when"]))
+
+    for aggregate in aggregates.values():
+        alpha_predicates[CS(aggregate["source"])].append(generate_alpha_tests(aggregate["source"], aggregate["filter"]))
+
+    alpha_networks = dict((x, generate_alpha_network(y)) for x, y in alpha_predicates.items())
+
+    ####################################################################
+    #
+    # Lay out the frames tables for each rule.
+    #
+    ####################################################################
+
+    for rule in rules.values():
+        generate_frame_layout(rule, compact_frames)
+
+    ####################################################################
+    #
+    # Index the facts produced by distinct productions. The distinct
+    # stage looks up the produced fact by every one of its fields each
+    # time a frame reaches it or a produced fact is retracted.
+    #
+    ####################################################################
+
+    for rule in rules.values():
+        if rule.get("distinct"):
+            add_index("%s_%s_actual" % (prefix, rule["produced_fact"]),
+                      sorted(facts[CS(rule["produced_fact"])].keys(), key=lambda x: str(x).lower()))
+
+    ####################################################################
+    #
+    # List the tables whose sizes are gauged.
+    #
+    ####################################################################
+
+    gauge_list = []
+    if gauges:
+        for fact_name in sorted(facts.keys(), key=lambda x: str(x).lower()):
+            gauge_list.append({"kind": "facts", "name": fact_name, "stage": None, "table": "%s_%s_actual" % (prefix, fact_name)})
+
+        for rule_name in sorted(rules.keys(), key=lambda x: str(x).lower()):
+            for stage in range(len(rules[rule_name]["frame_locals"])):
+                gauge_list.append({"kind": "frames", "name": rule_name, "stage": stage,
+                                   "table": "%s_%s_%d_frames" % (prefix, rule_name, stage)})
+
+        for gauge_id, gauge in enumerate(gauge_list, 1):
+            gauge["id"] = gauge_id
+
+    ####################################################################
+    #
+    # Group the positive matches on each fact class for the dispatcher
+    # triggers. A rule's matches on the same fact class are activated
+    # in the order in which SQLite would have fired their own triggers,
+    # the most recently created first: otherwise a fact matching more
+    # than one of them could be joined with itself twice.
+    #
+    ####################################################################
+
+    dispatchers = {}
+    if dispatch:
+        units = {}
+        predicates = {}
+        for rule_name in sorted(rules.keys(), key=lambda x: str(x).lower()):
+            matches = {}
+            for match_number, match in enumerate(rules[rule_name]["matches"]):
+                matches.setdefault(CS(match["fact"]), []).insert(0, match_number)
+                predicates[(rule_name, match_number)] = generate_alpha_tests(match["fact"], match["when"])
+
+            for fact, match_numbers in matches.items():
+                tests = set.intersection(*(set((test_cost(y), generate_expression(y, rules[rule_name]["matches"][x]["fact"], None, 'new'),
+                                                y.operation == "=")
+                                               for y in flatten_predicate(rules[rule_name]["matches"][x]["when"]))
+                                           for x in match_numbers))
+                units.setdefault(fact, []).insert(0, ([(rule_name, x) for x in match_numbers], sorted(tests)))
+
+        dispatchers = dict((x, generate_dispatch_groups(y, predicates)) for x, y in units.items())
+
     ####################################################################
     #
     # Open the template and run it.
@@ -501,6 +1071,7 @@ def generate(new_prefix, filename, description, facts, parameters, rules):
         "generate_join": generate_join,
         "generate_expression": generate_expression,
         "generate_predicate": generate_predicate_wrapper,
+        "blocking_key": blocking_key,
         "description": description,
         "facts": facts,
         "file": filename,
@@ -508,7 +1079,18 @@ def generate(new_prefix, filename, description, facts, parameters, rules):
         "only_once": only_once,
         "prefix": prefix,
         "public_prefix": new_prefix,
+        "retention": retention,
+        "aggregates": aggregates,
+        "alpha_networks": alpha_networks,
+        "timestamped": timestamped,
+        "time_column": time_column,
+        "windows": windows,
         "rules": rules,
+        "compact_frames": compact_frames,
+        "instrument": instrument,
+        "gauges": gauge_list,
+        "provenance": provenance,
+        "dispatchers": dispatchers,
         "bool": bool,
         "int": int,
         "float": float,
@@ -535,14 +1117,15 @@ def generate(new_prefix, filename, description, facts, parameters, rules):
             for k, v in tree.items():
                 dft(v, leaf_callback, path + [k])
 
-    def callback(table, path):
+    def callback(table, where, path):
         nonlocal index_number
         nonlocal result
 
         index_number += 1
-        result += "\nCREATE INDEX %s_auto_index_%d ON %s(%s);" % (prefix, index_number, table, ",".join(path))
+        result += "\nCREATE INDEX %s_auto_index_%d ON %s(%s)%s;" % (prefix, index_number, table, ",".join(path),
+                                                                    " WHERE %s" % where if where is not None else "")
 
-    for table, tree in indexes.items():
-        dft(tree, lambda path: callback(table, path))
+    for (table, where), tree in indexes.items():
+        dft(tree, lambda path: callback(table, where, path))
 
     return result
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Report the storage used by a compiled engine.
+#
+######################################################################
+
+"""
+storage.py - report the storage used by a compiled engine
+
+The report totals the pages and bytes used by each table and index in an
+engine database, as reported by SQLite's dbstat virtual table, and
+charges each to the rule or fact class it belongs to. Frames tables,
+blocker counts, and aggregates belong to rules; actual and shadow tables
+belong to fact classes; an index belongs to whatever its table belongs
+to.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import re
+import sqlite3
+import sys
+
+from giles import get_release_string
+from giles.profile import write_table
+
+######################################################################
+#
+# Ownership
+#
+######################################################################
+
+
+# The roles of the tables a rule or fact class owns, as patterns for the
+# rest of a table's name after the owner's; the group that matched names
+# the role. A rule owns its frames, the blocker counts of its MatchNone
+# stages, and the counters and synthetic facts of its aggregates; a fact
+# class owns its actual and shadow tables. Matching the whole name keeps
+# a rule from claiming the tables of a fact class with the same name.
+ROLES = (("rule", r"\d+_(frames)|\d+_(blockers)_\d+|[A-Za-z0-9]+_\d+_(counters|actual|shadow)"),
+         ("fact", r"(actual|shadow)"))
+
+
+def owner_of(table, prefix, rules, facts):
+    """Return ("rule" or "fact", name, role) for a table, or None if it belongs to neither.
+
+    >>> owner_of("_Giles_Rule_2_frames", "_Giles", ["Rule"], ["Fact"])
+    ('rule', 'Rule', 'frames')
+    >>> owner_of("_Giles_Rule_2_blockers_0", "_Giles", ["Rule"], ["Fact"])
+    ('rule', 'Rule', 'blockers')
+    >>> owner_of("_Giles_Rule_Fact_0_counters", "_Giles", ["Rule"], ["Fact"])
+    ('rule', 'Rule', 'counters')
+    >>> owner_of("_Giles_Fact_shadow", "_Giles", ["Rule"], ["Fact"])
+    ('fact', 'Fact', 'shadow')
+    >>> owner_of("_Giles_Alert_actual", "_Giles", ["Alert"], ["Alert"])
+    ('fact', 'Alert', 'actual')
+    >>> owner_of("_Giles_Alert_0_frames", "_Giles", ["Alert"], ["Alert"])
+    ('rule', 'Alert', 'frames')
+    >>> owner_of("_Giles_rules", "_Giles", ["Rule"], ["Fact"]) is None
+    True
+    """
+
+    if not table.lower().startswith(prefix.lower() + "_"):
+        return None
+    rest = table[len(prefix) + 1:]
+
+    for kind, roles in ROLES:
+        for name in (rules if kind == "rule" else facts):
+            match = re.match(r"(?i)%s_(?:%s)$" % (re.escape(name), roles), rest)
+            if match is not None:
+                return kind, name, next(x for x in match.groups() if x is not None).lower()
+
+    return None
+
+
+def storage(db, prefix):
+    """Return the storage used by each object as (name, type, table, pages, bytes, unused) tuples."""
+
+    objects = dict((x[0].lower(), (x[0], x[1], x[2])) for x in
+                   db.execute("SELECT name, type, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+    objects["sqlite_master"] = ("sqlite_master", "table", "sqlite_master")
+    objects["sqlite_schema"] = ("sqlite_schema", "table", "sqlite_schema")
+
+    result = []
+    for name, pages, size, unused in db.execute("SELECT name, COUNT(*), SUM(pgsize), SUM(unused) FROM dbstat GROUP BY name"):
+        name, kind, table = objects.get(name.lower(), (name, "table", name))
+        result.append((name, kind, table, pages, size, unused))
+
+    return result
+
+######################################################################
+#
+# Reporting
+#
+######################################################################
+
+
+def write_report(output, prefix, rules, facts, objects, limit):
+    """Write the ranked storage report."""
+
+    total = sum(x[4] for x in objects)
+
+    def size(n):
+        return "%.1f KiB" % (n / 1024.0)
+
+    def percent(n):
+        return "%.1f%%" % (100.0 * n / total if total > 0 else 0.0)
+
+    owners = {}
+    for name, kind, table, pages, used, unused in objects:
+        owner = owner_of(table, prefix, rules, facts)
+        key = owner[:2] if owner is not None else ("engine", "(engine)")
+        entry = owners.setdefault(key, {"tables": 0, "indexes": 0, "pages": 0, "roles": {}})
+        entry["tables" if kind == "table" else "indexes"] += used
+        entry["pages"] += pages
+        if owner is not None and kind == "table":
+            entry["roles"][owner[2]] = entry["roles"].get(owner[2], 0) + used
+
+    output.write("%d pages, %s\n\n" % (sum(x[3] for x in objects), size(total)))
+
+    def ranked(kind):
+        return sorted([(k[1], v) for k, v in owners.items() if k[0] == kind], key=lambda x: (-(x[1]["tables"] + x[1]["indexes"]), x[0]))
+
+    write_table(output, "Rules by size", ["total", "share", "tables", "indexes", "pages", "rule"],
+                [[size(v["tables"] + v["indexes"]), percent(v["tables"] + v["indexes"]), size(v["tables"]), size(v["indexes"]),
+                  v["pages"], k] for k, v in ranked("rule")], limit)
+
+    write_table(output, "Fact classes by size", ["total", "share", "actual", "shadow", "indexes", "fact"],
+                [[size(v["tables"] + v["indexes"]), percent(v["tables"] + v["indexes"]), size(v["roles"].get("actual", 0)),
+                  size(v["roles"].get("shadow", 0)), size(v["indexes"]), k] for k, v in ranked("fact")], limit)
+
+    write_table(output, "Objects by size", ["size", "share", "pages", "unused", "object"],
+                [[size(x[4]), percent(x[4]), x[3], size(x[5]), x[0] if x[1] == "table" else "%s (index on %s)" % (x[0], x[2])]
+                 for x in sorted(objects, key=lambda x: (-x[4], x[0]))], limit)
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Report the storage used by a compiled engine, by rule and fact class")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-n', '--limit', dest='limit', default=20, type=int,
+                            help="show at most this many rows per table (0 shows all)", metavar="LIMIT")
+    arg_parser.add_argument('-o', '--output', dest='report_file', default=sys.stdout, type=argparse.FileType('w'),
+                            help="write the report to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('database', type=str, help="the database to examine", metavar="DATABASE")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    db = sqlite3.connect("file:%s?mode=ro" % arguments.database, uri=True)
+    prefix = "_" + arguments.prefix
+
+    try:
+        objects = storage(db, prefix)
+    except sqlite3.Error as e:
+        sys.stderr.write("Cannot read storage statistics (SQLite must be built with the dbstat virtual table): %s\n" % e)
+        sys.exit(1)
+
+    try:
+        rules = [x[0] for x in db.execute("SELECT name FROM %s_rules" % prefix)]
+    except sqlite3.Error:
+        sys.stderr.write("No rules registry named %s_rules; is the prefix correct?\n" % prefix)
+        sys.exit(1)
+
+    facts = [x[0][len(prefix) + 1:-len("_actual")] for x in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+             if re.match(r"(?i)^%s_[A-Za-z0-9]+_actual$" % re.escape(prefix), x[0])]
+
+    write_report(arguments.report_file, prefix, rules, facts, objects, arguments.limit)
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
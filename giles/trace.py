@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# coding=utf-8
+######################################################################
+#
+# $Id$
+#
+######################################################################
+#
+# Copyright 2011-2014 KoreLogic, Inc. All Rights Reserved.
+#
+# This software, having been partly or wholly developed and/or
+# sponsored by KoreLogic, Inc., is hereby released under the terms
+# and conditions set forth in the project's "README.LICENSE" file.
+# For a list of all contributors and sponsors, please refer to the
+# project's "README.CREDITS" file.
+#
+######################################################################
+#
+# Purpose: Trace the cascade caused by a single statement.
+#
+######################################################################
+
+"""
+trace.py - trace the cascade caused by a single statement
+
+The tracer executes one statement against a compiled engine, rebuilds
+the tree of triggers and trigger statements it caused from the events
+the profiler's hooks report (see profile.py), stores the tree in a
+bounded table in the database under a new trace ID, and prints it.
+
+SQLite adds the rows changed by a statement to the connection's total
+only once the statement finishes, so the total seen at each event is
+the sum of the statements that finished since the previous event.
+A statement whose rows fire triggers is credited with one row per row it
+fired triggers for, which is exact; whatever remains of the total is
+credited to the innermost statement that finished without firing any.
+Rows deleted by foreign key cascades are counted in that remainder.
+"""
+
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2011-2014 KoreLogic, Inc. All Rights Reserved."
+__credits__ = []
+__license__ = "See README.LICENSE"
+__version__ = "$Id$"
+__maintainer__ = "Rob King"
+__email__ = "rking@korelogic.com"
+__status__ = "Alpha"
+
+import argparse
+import re
+import sqlite3
+import sys
+import time
+
+from giles import get_release_string
+from giles.profile import Frame, Hooks, Schema, find_parent, find_statement, root_frame, split_trigger_name, statement_target
+
+######################################################################
+#
+# Building the Cascade Tree
+#
+######################################################################
+
+
+class Step:
+    """A trigger invocation or a statement in the cascade tree."""
+
+    def __init__(self, kind, name, depth, started, target=None, verb=None):
+        self.kind = kind          # "statement" or "trigger"
+        self.name = name
+        self.depth = depth
+        self.started = started
+        self.finished = started
+        self.target = target      # Table written by a statement
+        self.verb = verb
+        self.children = []
+        self.rows = None
+        self.effect = None
+        self.table = None         # Table a trigger fired on
+
+
+def effect_of(trigger, verb, target):
+    """Describe what a statement in a trigger does to the engine.
+
+    >>> effect_of("_Giles_Rule_fire_productions_after_insert", "INSERT", "_giles_alert_actual")
+    'produced'
+    >>> effect_of("_Giles_Alert_facts_do_insert", "INSERT", "_giles_alert_actual")
+    'asserted'
+    >>> effect_of("_Giles_Quiet_suppress_after_insert", "DELETE", "_giles_alert_actual")
+    'suppressed'
+    >>> effect_of("_Giles_Rule_1_beta_activation", "INSERT", "_giles_rule_1_frames")
+    'frames'
+    """
+
+    if target is None:
+        return None
+    elif target.endswith("_frames"):
+        return "frames"
+    elif not target.endswith("_actual"):
+        return None
+    elif "suppress" in trigger.lower() or "restore" in trigger.lower():
+        return "suppressed" if verb == "DELETE" else "restored"
+    elif verb == "DELETE":
+        return "retracted"
+    elif trigger.lower().endswith("_do_insert"):
+        return "asserted"
+    else:
+        return "produced"
+
+
+def build_tree(schema, statement, events, start, end, changes):
+    """Rebuild the cascade tree from the events the hooks reported.
+
+    Events are (time, total changes, SQL) tuples; changes is the
+    connection's total when the statement finished.
+    """
+
+    frame = root_frame(schema, statement)
+    verb, target = statement_target(statement)
+    root = Step("statement", frame.name, 0, start, target, verb)
+    frame.step = root
+    stack = [frame]
+    last_changes = events[0][1] if len(events) > 0 else changes
+
+    def finish(steps, when, total):
+        nonlocal last_changes
+        for step in steps:
+            step.finished = when
+        credit(schema, steps, total - last_changes)
+        last_changes = total
+
+    for when, total, sql in events:
+        if sql.startswith("-- TRIGGER "):
+            name = sql[len("-- TRIGGER "):].strip()
+            table, body = schema.triggers.get(name, (None, ""))
+
+            finish(popped(stack, find_parent(schema, stack, name), when), when, total)
+
+            step = Step("trigger", name, stack[-1].step.depth + 1, when)
+            step.table = table
+            stack[-1].step.children.append(step)
+            frame = Frame(name, body, set())
+            frame.step = step
+            frame.trigger = step
+            stack.append(frame)
+
+        elif sql.startswith("-- "):
+            text = re.sub(r"\s", " ", sql[3:])
+            depth = find_statement(stack, text)
+            if depth is None:
+                continue
+
+            finished = popped(stack, depth, when)
+            if stack[-1].step is not stack[-1].trigger:
+                finished.append(stack[-1].step)
+                stack[-1].step.finished = when
+            finish(finished, when, total)
+
+            verb, target = statement_target(text)
+            trigger = stack[-1].trigger
+            step = Step("statement", " ".join(text.split()), trigger.depth + 1, when, target, verb)
+            step.effect = effect_of(trigger.name, verb, target)
+            trigger.children.append(step)
+            stack[-1].step = step
+            stack[-1].begin(step.name, schema.writes(text))
+
+    finish(popped(stack, 0, end) + [root], end, changes)
+
+    return root
+
+
+def popped(stack, depth, when):
+    """Pop the frames above a depth, returning the statements they were running."""
+
+    result = []
+    for frame in reversed(stack[depth + 1:]):
+        frame.trigger.finished = when
+        if frame.step is not frame.trigger:
+            result.append(frame.step)
+    del stack[depth + 1:]
+
+    return result
+
+
+def row_groups(schema, step):
+    """Return the number of rows a statement fired triggers for, or None if it fired none.
+
+    Each row written fires the same triggers on the written table in the
+    same order (even those whose WHEN clause fails), so a new row starts
+    each time the first of them fires again. Rows whose BEFORE triggers
+    ignore them fire no AFTER triggers and are not counted.
+    """
+
+    fired = [x for x in step.children if x.table == step.target]
+    if len(fired) == 0:
+        return None
+
+    groups = []
+    for child in fired:
+        if child.name == fired[0].name:
+            groups.append([])
+        groups[-1].append(child)
+
+    if all(x.name in schema.before for x in fired):
+        return len(groups)
+
+    return len([x for x in groups if any(y.name not in schema.before for y in x)])
+
+
+def credit(schema, steps, changes):
+    """Credit the change in the total to the statements that just finished, innermost first."""
+
+    unknown = []
+    for step in steps:
+        step.rows = row_groups(schema, step)
+        if step.rows is None:
+            unknown.append(step)
+        elif step.target not in schema.views:
+            changes -= step.rows
+
+    for step in unknown:
+        step.rows = max(changes, 0)
+        changes = 0
+
+
+def walk(step):
+    """Yield the steps of a tree in order."""
+
+    yield step
+    for child in step.children:
+        for x in walk(child):
+            yield x
+
+######################################################################
+#
+# Storing Traces
+#
+######################################################################
+
+
+def create_buffer(db, prefix):
+    """Create the trace table if it does not exist."""
+
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS %s_trace_steps(
+            trace   INTEGER NOT NULL,
+            step    INTEGER NOT NULL,
+            depth   INTEGER NOT NULL,
+            kind    TEXT NOT NULL,
+            name    TEXT NOT NULL,
+            rule    TEXT,
+            stage   INTEGER,
+            target  TEXT,
+            effect  TEXT,
+            rows    INTEGER,
+            elapsed REAL NOT NULL,
+            PRIMARY KEY(trace, step)
+        )""" % prefix)
+
+
+def store(db, prefix, schema, root, capacity):
+    """Store a tree under a new trace ID, evicting the oldest traces to stay within capacity steps."""
+
+    steps = list(walk(root))[:capacity]
+    trace = db.execute("SELECT COALESCE(MAX(trace), 0) + 1 FROM %s_trace_steps" % prefix).fetchone()[0]
+
+    while True:
+        used, oldest = db.execute("SELECT COUNT(*), MIN(trace) FROM %s_trace_steps" % prefix).fetchone()
+        if used + len(steps) <= capacity:
+            break
+        db.execute("DELETE FROM %s_trace_steps WHERE trace = ?" % prefix, (oldest,))
+
+    for i, step in enumerate(steps):
+        rule, stage, kind = split_trigger_name(step.name, schema.prefix, schema.rules) if step.kind == "trigger" else (None, None, None)
+        db.execute("INSERT INTO %s_trace_steps VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % prefix,
+                   (trace, i, step.depth, step.kind, step.name, rule, stage, step.target, step.effect, step.rows,
+                    step.finished - step.started))
+
+    return trace
+
+######################################################################
+#
+# Rendering Traces
+#
+######################################################################
+
+
+def render(db, prefix, trace, output):
+    """Print a stored trace as a tree, followed by a summary."""
+
+    rows = db.execute("SELECT depth, kind, name, target, effect, rows, elapsed FROM %s_trace_steps WHERE trace = ? ORDER BY step" % prefix,
+                      (trace,)).fetchall()
+    if len(rows) == 0:
+        return False
+
+    output.write("Trace %d\n\n" % trace)
+    output.write("%10s  %6s  %s\n" % ("ms", "rows", "step"))
+    touched = {}
+    for depth, kind, name, target, effect, count, elapsed in rows:
+        label = name if kind == "trigger" or depth == 0 else name[:100]
+        output.write("%10.3f  %6s  %s%s%s\n" % (elapsed * 1000.0, count if kind == "statement" else "", "  " * depth,
+                                                label, " [%s]" % effect if effect is not None else ""))
+        if effect is not None and count:
+            verb, _ = statement_target(name)
+            key = (effect, target, verb if effect == "frames" else "")
+            touched[key] = touched.get(key, 0) + count
+
+    output.write("\n%d triggers fired\n" % len([x for x in rows if x[1] == "trigger"]))
+    for (effect, target, verb), count in sorted(touched.items()):
+        output.write("%10s  %6d  %s %s\n" % (effect, count, verb, target) if verb else "%10s  %6d  %s\n" % (effect, count, target))
+
+    return True
+
+######################################################################
+#
+# The main entry point.
+#
+######################################################################
+
+
+def main(*args):
+    arg_parser = argparse.ArgumentParser(description="Trace the cascade of triggers caused by a single statement")
+    arg_parser.add_argument('-v', '--version', action="version", version="Giles {0}".format(get_release_string()))
+    arg_parser.add_argument('-c', '--commit', dest='commit', default=False, action='store_const', const=True,
+                            help="commit the statement's changes rather than rolling them back")
+    arg_parser.add_argument('-k', '--keep', dest='capacity', default=10000, type=int,
+                            help="keep at most this many steps of stored traces", metavar="STEPS")
+    arg_parser.add_argument('-o', '--output', dest='output_file', default=sys.stdout, type=argparse.FileType('w'),
+                            help="write the trace to this file", metavar="OUTPUT")
+    arg_parser.add_argument('-p', '--prefix', dest='prefix', default="Giles",
+                            help="the prefix the engine was compiled with", metavar="PREFIX")
+    arg_parser.add_argument('-s', '--schema', dest='schema_file', default=None, type=argparse.FileType('r'),
+                            help="load this compiled schema into the database first", metavar="SCHEMA")
+    arg_parser.add_argument('-t', '--trace', dest='trace', default=None, type=int,
+                            help="print this stored trace rather than executing a statement", metavar="TRACE")
+    arg_parser.add_argument('database', type=str, help="the database holding the engine", metavar="DATABASE")
+    arg_parser.add_argument('statement', type=str, nargs='?', help="the statement to trace", metavar="STATEMENT")
+    arguments = arg_parser.parse_args(args if len(args) > 0 else None)
+
+    if (arguments.trace is None) == (arguments.statement is None):
+        arg_parser.error("exactly one of a statement or -t must be given")
+
+    db = sqlite3.connect(arguments.database, isolation_level=None)
+    db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) is not None else 0)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA recursive_triggers = ON")
+
+    if arguments.schema_file is not None:
+        db.executescript(arguments.schema_file.read())
+
+    prefix = "_" + arguments.prefix
+    trace = arguments.trace
+
+    if arguments.statement is not None:
+        schema = Schema(db, prefix)
+        hooks = Hooks(db)
+
+        events = []
+        db.execute("BEGIN")
+        hooks.install()
+        hooks.callback = lambda sql: events.append((time.perf_counter(), db.total_changes, sql))
+        start = time.perf_counter()
+        try:
+            db.execute(arguments.statement)
+        except sqlite3.Error as e:
+            hooks.callback = None
+            db.execute("ROLLBACK")
+            sys.stderr.write("Statement failed: %s\n" % e)
+            sys.exit(1)
+        end = time.perf_counter()
+        changes = db.total_changes
+        hooks.callback = None
+        hooks.remove()
+
+        if not arguments.commit:
+            db.execute("ROLLBACK")
+            db.execute("BEGIN")
+
+        root = build_tree(schema, arguments.statement, events, start, end, changes)
+
+        create_buffer(db, prefix)
+        trace = store(db, prefix, schema, root, arguments.capacity)
+        db.execute("COMMIT")
+
+    if not render(db, prefix, trace, arguments.output_file):
+        sys.stderr.write("No such trace: %d\n" % trace)
+        sys.exit(1)
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -47,7 +47,14 @@ setup(
     test_suite='tests.test_all',
     entry_points={
         'console_scripts': [
-            'giles = giles.giles:main'
+            'giles = giles.giles:main',
+            'giles-audit = giles.audit:main',
+            'giles-migrate = giles.migrate:main',
+            'giles-profile = giles.profile:main',
+            'giles-restore = giles.snapshot:restore_main',
+            'giles-snapshot = giles.snapshot:main',
+            'giles-storage = giles.storage:main',
+            'giles-trace = giles.trace:main'
         ]
     }
 )
@@ -38,29 +38,44 @@ import glob
 import os
 import os.path
 import re
+import shutil
 import sqlite3
+import tempfile
 import unittest
 
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
 from giles.giles import main
+from giles import audit
 from giles import caseless_string
 from giles import forbidden_names
+from giles import migrate
+from giles import profile
 from giles import pyre
+from giles import rete
+from giles import snapshot
+from giles import storage
+from giles import trace
 from giles import validate
 
 
 class GilesCompilationTestCase(unittest.TestCase):
 
-    def __init__(self, path):
+    def __init__(self, path, *options):
         super().__init__()
         self.path = path
+        self.options = options
         self.output_path = "{0}.sql".format(self.path)
 
     def __str__(self):
-        return "Compiling example engine {1}".format(str(self.__class__), self.path)
+        return "Compiling example engine {1} {2}".format(str(self.__class__), self.path, " ".join(self.options)).strip()
 
     def runTest(self):
         with self.assertRaises(SystemExit) as cm:
-            main("-r", "-c", "-o", self.output_path, self.path)
+            main("-r", "-c", "-o", self.output_path, *(self.options + (self.path,)))
 
         self.assertEqual(cm.exception.code, 0, "compilation failed")
 
@@ -79,15 +94,747 @@ class GilesCompilationTestCase(unittest.TestCase):
             db.close()
 
 
+class GilesQueryPlanTestCase(unittest.TestCase):
+
+    def __init__(self, path, *options):
+        super().__init__()
+        self.path = path
+        self.options = options
+        self.output_path = "{0}.sql".format(self.path)
+        self.baseline_path = "{0}.scans".format(os.path.splitext(self.path)[0])
+
+    def __str__(self):
+        return "Auditing query plans of example engine {1} {2}".format(str(self.__class__), self.path, " ".join(self.options)).strip()
+
+    def runTest(self):
+        with self.assertRaises(SystemExit) as cm:
+            main("-r", "-c", "-o", self.output_path, *(self.options + (self.path,)))
+
+        self.assertEqual(cm.exception.code, 0, "compilation failed")
+
+        with self.assertRaises(SystemExit) as cm:
+            audit.main("-b", self.baseline_path, "-o", os.devnull, self.output_path)
+
+        self.assertEqual(cm.exception.code, 0, "new table scans were found (see giles-audit)")
+
+
+class GilesReplayTestCase(unittest.TestCase):
+    """
+    Runs an example's input against compiled SQLite engines, which are written to a temporary directory. The input can be replayed:
+    each fact is inserted in turn, and then they are all retracted in the reverse order.
+    """
+
+    def __init__(self, path, input_path):
+        super().__init__()
+        self.path = path
+        self.input_path = input_path
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="giles-test-")
+
+        with open(self.input_path, "r") as input_file:
+            self.text = re.sub(r"/\*.*?\*/|--[^\n]*", "", input_file.read(), flags=re.DOTALL)
+
+        self.prefix = re.search(r"INSERT INTO ([A-Za-z0-9]+)_", self.text).group(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compile(self, name, *options):
+        output_path = os.path.join(self.directory, name)
+        with self.assertRaises(SystemExit) as cm:
+            main("-r", "-c", "-p", self.prefix, "-o", output_path, *(options + (self.path,)))
+
+        self.assertEqual(cm.exception.code, 0, "compilation failed")
+
+        with open(output_path, "r") as output_file:
+            return output_file.read()
+
+    def sqlite_engine(self, *options):
+        db = sqlite3.connect(":memory:")
+        db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) else 0)
+        db.execute("PRAGMA foreign_keys = 1")
+        db.execute("PRAGMA recursive_triggers = 1")
+        db.executescript(self.compile("engine.sql", *options))
+        return db
+
+    def fact_classes(self, db):
+        views = db.execute("SELECT name FROM sqlite_master WHERE type = 'view' AND name LIKE ? AND name NOT LIKE '%InitialFact%'",
+                           (self.prefix + "_%_facts",))
+        return [x[len(self.prefix) + 1:-len("_facts")] for (x,) in views]
+
+    def facts(self, cursor, fact):
+        """Return the facts of a class, without their identifiers, from a cursor on any engine with SQL views."""
+
+        cursor.execute("SELECT * FROM {0}_{1}_facts".format(self.prefix, fact))
+        columns = [x[0].lower() != "id" for x in cursor.description]
+        return sorted(tuple(x for x, keep in zip(row, columns) if keep) for row in cursor.fetchall())
+
+    def replay(self, db):
+        """
+        Insert each fact into db and then retract them in the reverse order, yielding after every step the fact class, the statement
+        that inserted the fact (or None, if it was retracted), its fields, and its identifier in db (or None, if it was discarded).
+        """
+
+        def external(fact):
+            return set(x for (x,) in db.execute("SELECT id FROM _{0}_{1}_actual WHERE frame IS NULL".format(self.prefix, fact)))
+
+        inserted = []
+        for statement in self.text.split(";"):
+            match = re.match(r"\s*INSERT INTO \w+?_(\w+)_facts\s*\(([^)]*)\)\s*VALUES\s*\((.*)\)\s*$", statement, re.DOTALL | re.IGNORECASE)
+            if match is not None:
+                fact = match.group(1)
+                before = external(fact)
+                db.execute(statement)
+                fields = dict(zip((x.strip() for x in match.group(2).split(",")), db.execute("SELECT " + match.group(3)).fetchone()))
+                inserted.append((fact, statement.strip(), fields, (external(fact) - before or {None}).pop()))
+                yield inserted[-1]
+
+        for fact, statement, fields, fact_id in reversed(inserted):
+            if fact_id is not None:
+                db.execute("DELETE FROM {0}_{1}_facts WHERE id = ?".format(self.prefix, fact), (fact_id,))
+
+            yield fact, None, fields, fact_id
+
+
+class GilesOptionsTestCase(GilesReplayTestCase):
+    """
+    Compares an engine compiled with some options, such as dispatcher triggers or compact frames, with the engine compiled without
+    them, by the facts they hold once the example's input has been run.
+    """
+
+    def __init__(self, path, input_path, *options):
+        super().__init__(path, input_path)
+        self.options = options
+
+    def __str__(self):
+        return "Comparing the default engine with {0} in example engine {1}".format(" ".join(self.options), self.path)
+
+    def run_engine(self, *options):
+        db = self.sqlite_engine(*options)
+        db.executescript(self.text)
+        facts = dict((x, self.facts(db.cursor(), x)) for x in self.fact_classes(db))
+        db.close()
+        return facts
+
+    def runTest(self):
+        self.assertEqual(self.run_engine(), self.run_engine(*self.options), "{0} produced different facts".format(" ".join(self.options)))
+
+
+class GilesProfileTestCase(GilesReplayTestCase):
+    """
+    Profiles an example's input, checking that the profiler sees the triggers of every rule fire and the statements they run, and
+    that the engine's triggers are restored afterwards.
+    """
+
+    def __str__(self):
+        return "Profiling example engine {0}".format(self.path)
+
+    def runTest(self):
+        db = self.sqlite_engine()
+        db.isolation_level = None
+        triggers = db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall()
+
+        results = profile.Profile(profile.Schema(db, "_" + self.prefix))
+        hooks = profile.Hooks(db)
+        db.execute("BEGIN")
+        hooks.install()
+        for statement in profile.read_statements(self.text.splitlines(True)):
+            results.replay(db, hooks, statement)
+        hooks.remove()
+        db.execute("COMMIT")
+
+        self.assertGreater(results.trigger_events, 0, "no triggers were seen to fire")
+        self.assertEqual(sum(results.calls.values()), results.trigger_events)
+        self.assertGreater(sum(x[0] for x in results.statements.values()), 0, "no trigger statements were seen to run")
+
+        rules = results.rollup(lambda rule, stage, kind: rule)
+        for rule in results.schema.rules:
+            self.assertGreater(rules.get(rule, [0])[0], 0, "no triggers of rule {0} were seen to fire".format(rule))
+
+        self.assertEqual(db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall(), triggers,
+                         "the engine's triggers were not restored")
+        db.close()
+
+
+class GilesTraceTestCase(GilesReplayTestCase):
+    """
+    Traces statements against the family example engine once its input has been run, checking the depth of each cascade and the
+    facts it produced or retracted.
+    """
+
+    # The statements to trace, and the effects expected of them on the rows of each fact table.
+    STATEMENTS = [("INSERT INTO Giles_PersonIsNamed_Facts(FirstName, LastName) VALUES('Mary', 'Smith')",
+                   {("asserted", "_giles_personisnamed_actual"): 1, ("produced", "_giles_mightbelongtofamily_actual"): 1}),
+                  ("INSERT INTO Giles_KnownException_Facts(FirstName, Family) VALUES('ROB', 'KING')",
+                   {("asserted", "_giles_knownexception_actual"): 1, ("retracted", "_giles_mightbelongtofamily_actual"): 1})]
+
+    def __str__(self):
+        return "Tracing statements against example engine {0}".format(self.path)
+
+    def runTest(self):
+        path = os.path.join(self.directory, "engine.db")
+        db = sqlite3.connect(path)
+        db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) else 0)
+        db.executescript(self.compile("engine.sql"))
+        db.executescript(self.text)
+        triggers = db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall()
+        db.close()
+
+        for trace_id, (statement, effects) in enumerate(self.STATEMENTS, 1):
+            with self.assertRaises(SystemExit) as cm:
+                trace.main("-p", self.prefix, "-o", os.devnull, path, statement)
+
+            self.assertEqual(cm.exception.code, 0, "tracing failed")
+
+            db = sqlite3.connect(path)
+            depth = db.execute("SELECT MAX(depth) FROM _{0}_trace_steps WHERE trace = ?".format(self.prefix), (trace_id,)).fetchone()[0]
+            self.assertGreater(depth, 1, "no trigger statements were traced for {0}".format(statement))
+
+            found = {}
+            for effect, target, rows in db.execute("SELECT effect, target, rows FROM _{0}_trace_steps WHERE trace = ? AND effect IN "
+                                                   "('asserted', 'produced', 'retracted')".format(self.prefix), (trace_id,)):
+                found[(effect, target)] = found.get((effect, target), 0) + rows
+
+            self.assertEqual(found, effects, "wrong effects traced for {0}".format(statement))
+            self.assertEqual(db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY rowid").fetchall(), triggers,
+                             "the engine's triggers were not restored")
+            db.close()
+
+
+class GilesBlockingTestCase(GilesReplayTestCase):
+    """
+    Blocks and unblocks the rules of the blocking test engine, one blocking fact class at a time and then several at once. A frame
+    must stay blocked until the last fact blocking it is retracted, whether the facts are counted by a key or in the frame itself,
+    and whichever of its rule's MatchNone clauses they match.
+    """
+
+    # The fact classes that block the production of each fact class, and the facts that do and do not block the request.
+    BLOCKERS = {"Award": ("Embargo",), "Approval": ("Ceiling",), "Payout": ("Embargo", "Ceiling")}
+    BLOCKING = {"Embargo": ({"Name": "Alice"}, {"Name": "Bob"}), "Ceiling": ({"Amount": 4}, {"Amount": 9})}
+
+    def __init__(self, path, input_path, *options):
+        super().__init__(path, input_path)
+        self.options = options
+
+    def __str__(self):
+        return "Blocking and unblocking the rules of example engine {0} {1}".format(self.path, " ".join(self.options)).strip()
+
+    def insert(self, db, fact, fields):
+        db.execute("INSERT INTO {0}_{1}_facts({2}) VALUES({3})".format(self.prefix, fact, ", ".join(fields), ", ".join("?" * len(fields))),
+                   list(fields.values()))
+        return db.execute("SELECT MAX(id) FROM _{0}_{1}_actual".format(self.prefix, fact)).fetchone()[0]
+
+    def retract(self, db, fact, fact_id):
+        db.execute("DELETE FROM {0}_{1}_facts WHERE id = ?".format(self.prefix, fact), (fact_id,))
+
+    def check(self, db, blocked, action):
+        for fact, blockers in self.BLOCKERS.items():
+            expected = [] if blocked & set(blockers) else [("Alice", 5)]
+            found = db.execute("SELECT Name, Amount FROM {0}_{1}_facts".format(self.prefix, fact)).fetchall()
+            self.assertEqual(found, expected, "wrong {0} facts after {1}".format(fact, action))
+
+    def runTest(self):
+        db = self.sqlite_engine(*self.options)
+
+        # Make sure that both ways of counting blocking facts are tested.
+        tables = [x for (x,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        columns = [x[1] for table in tables if table.endswith("_frames") for x in db.execute("PRAGMA table_info({0})".format(table))]
+        self.assertTrue(any(re.search(r"_blockers_\d+$", x) for x in tables), "no blocking facts are counted by a key")
+        self.assertTrue(any(re.match(r"blockers_\d+$", x) for x in columns), "no blocking facts are counted in their frames")
+
+        request = self.insert(db, "Request", {"Name": "Alice", "Amount": 5})
+        self.check(db, set(), "inserting a request")
+
+        for blocker, (fields, other_fields) in sorted(self.BLOCKING.items()):
+            other = self.insert(db, blocker, other_fields)
+            self.check(db, set(), "inserting a {0} fact that does not block the request".format(blocker))
+            first = self.insert(db, blocker, fields)
+            self.check(db, {blocker}, "inserting a {0} fact".format(blocker))
+            second = self.insert(db, blocker, fields)
+            self.check(db, {blocker}, "inserting a second {0} fact".format(blocker))
+            self.retract(db, blocker, first)
+            self.check(db, {blocker}, "retracting the first {0} fact".format(blocker))
+            self.retract(db, blocker, second)
+            self.check(db, set(), "retracting the second {0} fact".format(blocker))
+            third = self.insert(db, blocker, fields)
+            self.check(db, {blocker}, "inserting a {0} fact again".format(blocker))
+            self.retract(db, blocker, third)
+            self.retract(db, blocker, other)
+            self.check(db, set(), "retracting every {0} fact".format(blocker))
+
+        # A rule with several MatchNone clauses blocks its frames in a single stage until none of the clauses match.
+        frames = [x for x in tables if re.match(r"_{0}_PayRequests_\d+_frames$".format(self.prefix), x)]
+        self.assertEqual(len(frames), 2, "the MatchNone clauses of a rule are not in a single stage")
+
+        for first_blocker, second_blocker in (("Embargo", "Ceiling"), ("Ceiling", "Embargo")):
+            first = self.insert(db, first_blocker, self.BLOCKING[first_blocker][0])
+            second = self.insert(db, second_blocker, self.BLOCKING[second_blocker][0])
+            self.check(db, {first_blocker, second_blocker}, "inserting an Embargo and a Ceiling fact")
+            self.retract(db, first_blocker, first)
+            self.check(db, {second_blocker}, "retracting the {0} fact".format(first_blocker))
+            first = self.insert(db, first_blocker, self.BLOCKING[first_blocker][0])
+            self.check(db, {first_blocker, second_blocker}, "inserting the {0} fact again".format(first_blocker))
+            self.retract(db, second_blocker, second)
+            self.check(db, {first_blocker}, "retracting the {0} fact".format(second_blocker))
+            self.retract(db, first_blocker, first)
+            self.check(db, set(), "retracting both facts")
+
+        self.retract(db, "Request", request)
+        for fact in self.BLOCKERS:
+            self.assertEqual(self.facts(db.cursor(), fact), [], "{0} facts are left after retracting the request".format(fact))
+
+        db.close()
+
+
+class GilesScriptTestCase(GilesReplayTestCase):
+    """
+    Runs a test engine's script against a compiled SQLite engine and compares each query's rows with the transcript expected of it,
+    which is kept beside the script. Scripts cover what the other backends do not support, such as aggregates, windows and retention;
+    they control time by passing Now to the expire view and by asserting facts into their actual tables with an explicit time. A
+    script's first line can name the options that its engine must be compiled with, as in "-- Options: -j".
+    """
+
+    def __init__(self, path, input_path, *options):
+        super().__init__(path, input_path)
+        self.options = options
+
+    def __str__(self):
+        return "Running script {0} against test engine {1} {2}".format(self.input_path, self.path, " ".join(self.options)).strip()
+
+    def transcript(self, db):
+        lines = []
+        for statement in self.text.split(";"):
+            statement = " ".join(statement.split())
+            if statement:
+                rows = db.execute(statement).fetchall()
+                if statement.upper().startswith("SELECT"):
+                    lines.append("> {0};".format(statement))
+                    lines.extend("|".join("" if x is None else str(x) for x in row) for row in rows)
+                    lines.append("")
+
+        return "\n".join(lines)
+
+    def runTest(self):
+        with open(self.input_path, "r") as input_file:
+            match = re.match(r"--\s*Options:(.*)", input_file.readline())
+
+        with open(os.path.splitext(self.input_path)[0] + ".out", "r") as expected_file:
+            expected = expected_file.read()
+
+        db = self.sqlite_engine(*(tuple(match.group(1).split() if match else ()) + self.options))
+        self.maxDiff = None
+        self.assertEqual(self.transcript(db).rstrip("\n"), expected.rstrip("\n"), "the script's queries returned the wrong rows")
+        db.close()
+
+
+class GilesMigrateTestCase(GilesReplayTestCase):
+    """
+    Migrates the facts of the migration test engine's first version into its second, which renames a fact class and one of its
+    fields, drops a field and adds another, and narrows its rule. The facts asserted into the first version must be carried over,
+    and their consequences derived again by the second version's rules.
+    """
+
+    def __init__(self, path, input_path, new_path):
+        super().__init__(path, input_path)
+        self.new_path = new_path
+
+    def __str__(self):
+        return "Migrating the facts of test engine {0} to {1}".format(self.path, self.new_path)
+
+    def migrate(self, *args):
+        with self.assertRaises(SystemExit) as cm:
+            migrate.main("-q", *args)
+
+        return cm.exception.code
+
+    def runTest(self):
+        old_path = os.path.join(self.directory, "old.db")
+        db = sqlite3.connect(old_path)
+        db.executescript(self.compile("old.sql"))
+        db.executescript(self.text)
+        self.assertEqual(self.facts(db.cursor(), "Exposed"), [("10.0.0.1", 22), ("10.0.0.1", 8080), ("10.0.0.2", 443)])
+        db.close()
+
+        schema_path = os.path.join(self.directory, "new.sql")
+        with self.assertRaises(SystemExit) as cm:
+            main("-r", "-c", "-p", self.prefix, "-o", schema_path, self.new_path)
+
+        self.assertEqual(cm.exception.code, 0, "compilation failed")
+
+        new_path = os.path.join(self.directory, "new.db")
+        self.assertEqual(self.migrate("-c", schema_path, "-m", "Server=Machine", "-m", "Server.Addr=Address", "-d", "Machine.Keeper=nobody",
+                                      old_path, new_path), 0, "migration failed")
+
+        db = sqlite3.connect(new_path)
+        self.assertEqual(self.facts(db.cursor(), "Machine"), [("10.0.0.1", "nobody"), ("10.0.0.2", "nobody")], "wrong machines migrated")
+        # The service on port 8080 can never match the narrowed rule, so the new engine discards it.
+        self.assertEqual(self.facts(db.cursor(), "Service"), [("10.0.0.1", 22), ("10.0.0.2", 443), ("10.0.0.3", 80)],
+                         "wrong services migrated")
+        self.assertEqual(self.facts(db.cursor(), "Exposed"), [("10.0.0.1", 22), ("10.0.0.2", 443)], "wrong services exposed")
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM _{0}_Exposed_actual WHERE frame IS NULL".format(self.prefix)).fetchone()[0], 0,
+                         "produced facts were copied")
+        db.close()
+
+        # Migrating from or to a database without fact classes for the prefix is an error.
+        self.assertEqual(self.migrate("-s", "Other", old_path, new_path), 1, "a source without fact classes was migrated")
+        self.assertEqual(self.migrate("-s", self.prefix, "-p", "Other", old_path, new_path), 1,
+                         "a destination without fact classes was migrated")
+
+
+class GilesSnapshotTestCase(GilesReplayTestCase):
+    """
+    Takes a snapshot of an engine once its input and any further statements have been run, restores it into a freshly compiled
+    engine, and compares every row of the two engines' actual and shadow tables, including the times facts were inserted and the
+    values of parameters. The identifiers of facts and frames are not compared, since restoring a snapshot renumbers them.
+    """
+
+    def __init__(self, path, input_path, *statements):
+        super().__init__(path, input_path)
+        self.statements = statements
+
+    def __str__(self):
+        return "Taking and restoring a snapshot of example engine {0}".format(self.path)
+
+    def rows(self, db):
+        result = {}
+        for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE '%InitialFact%'"):
+            if re.search(r"_(actual|shadow)$", table):
+                cursor = db.execute("SELECT * FROM {0}".format(table))
+                columns = [x[0].lower() for x in cursor.description]
+                rows = []
+                for row in cursor.fetchall():
+                    row = dict(zip(columns, row))
+                    # Produced facts are inserted when they are derived again.
+                    if row.get("frame") is not None:
+                        row.pop("inserted_at", None)
+                    rows.append(sorted((x, y) for x, y in row.items() if x not in ("id", "frame", "suppressing_frame")))
+                result[table] = sorted(rows, key=repr)
+
+        return result
+
+    def runTest(self):
+        schema = self.compile("engine.sql")
+        database_path = os.path.join(self.directory, "engine.db")
+        db = sqlite3.connect(database_path)
+        db.create_function("regexp", 2, lambda x, y: 1 if re.search(x, y) else 0)
+        db.execute("PRAGMA foreign_keys = 1")
+        db.execute("PRAGMA recursive_triggers = 1")
+        db.executescript(schema)
+        db.executescript(self.text)
+        for statement in self.statements:
+            db.execute(statement)
+        db.commit()
+        expected = self.rows(db)
+        db.close()
+
+        snapshot_path = os.path.join(self.directory, "engine.snapshot")
+        with self.assertRaises(SystemExit) as cm:
+            snapshot.main("-q", "-b", "2", "-p", self.prefix, database_path, snapshot_path)
+
+        self.assertEqual(cm.exception.code, 0, "taking the snapshot failed")
+
+        restored_path = os.path.join(self.directory, "restored.db")
+        with self.assertRaises(SystemExit) as cm:
+            snapshot.restore_main("-q", "-c", os.path.join(self.directory, "engine.sql"), "-p", self.prefix, snapshot_path, restored_path)
+
+        self.assertEqual(cm.exception.code, 0, "restoring the snapshot failed")
+
+        db = sqlite3.connect(restored_path)
+        self.maxDiff = None
+        self.assertEqual(self.rows(db), expected, "the restored engine holds different facts")
+        db.close()
+
+        # A snapshot is not written for a prefix without fact classes.
+        os.remove(snapshot_path)
+        with self.assertRaises(SystemExit) as cm:
+            snapshot.main("-q", "-p", "Other", database_path, snapshot_path)
+
+        self.assertEqual(cm.exception.code, 1, "a snapshot was taken without fact classes")
+        self.assertFalse(os.path.exists(snapshot_path), "a snapshot was written without fact classes")
+
+
+class GilesBackendTestCase(GilesReplayTestCase):
+    """
+    Compares an engine compiled with another backend with the SQLite engine, fact for fact, at every step of the replay. Subclasses
+    start and stop the engine, and insert, retract, and query its facts.
+    """
+
+    backend = None
+    backend_name = None
+
+    def __str__(self):
+        return "Comparing the {0} backend with the SQLite backend in example engine {1}".format(self.backend_name, self.path)
+
+    def runTest(self):
+        db = self.sqlite_engine()
+        self.start(self.compile("engine." + self.backend, "-b", self.backend))
+
+        try:
+            identifiers = []
+            for fact, statement, fields, sqlite_id in self.replay(db):
+                if statement is not None:
+                    identifiers.append(self.insert(fact, statement, fields))
+                    action = statement
+                else:
+                    fact_id = identifiers.pop()
+                    if fact_id is not None:
+                        self.retract(fact, fact_id)
+
+                    action = "retracting a {0} fact".format(fact)
+
+                for name in self.fact_classes(db):
+                    self.assertEqual(self.query(name), self.facts(db.cursor(), name), "{0} facts differ after {1}".format(name, action))
+
+        finally:
+            self.stop()
+            db.close()
+
+
+class GilesInstrumentationTestCase(GilesReplayTestCase):
+    """
+    Checks the rule statistics of an instrumented engine against its tables at every step of the replay: the counters never
+    decrease, and the facts a rule has produced and not retracted are those it has live, whether they are suppressed or not.
+    """
+
+    COUNTERS = ("alpha_activations", "frames", "productions", "retractions", "suppressions", "blocks")
+
+    def __str__(self):
+        return "Checking the rule statistics of example engine {0}".format(self.path)
+
+    def count(self, db, table, where, *parameters):
+        return sum(db.execute("SELECT COUNT(*) FROM {0} WHERE {1}".format(x, where), parameters).fetchone()[0] for x in table)
+
+    def runTest(self):
+        db = self.sqlite_engine("-i")
+        tables = [x for (x,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        rules = dict(db.execute("SELECT id, name FROM _{0}_rules".format(self.prefix)))
+        facts = [x for x in tables if re.match(r"^_{0}_\w+_(actual|shadow)$".format(self.prefix), x)]
+        shadows = [x for x in facts if x.endswith("_shadow")]
+
+        previous = None
+        suppressed = False
+        for fact, statement, fields, fact_id in self.replay(db):
+            action = statement or "retracting a {0} fact".format(fact)
+            stats = {}
+            for row in db.execute("SELECT rule, {1} FROM _{0}_rule_stats".format(self.prefix, ", ".join(self.COUNTERS))):
+                stats[row[0]] = dict(zip(self.COUNTERS, row[1:]))
+
+            for rule, name in rules.items():
+                counters = stats[rule]
+                frames = [x for x in tables if re.match(r"^_{0}_{1}_\d+_frames$".format(self.prefix, name), x)]
+
+                if previous is not None:
+                    for counter in self.COUNTERS:
+                        self.assertGreaterEqual(counters[counter], previous[rule][counter],
+                                                "{0} of rule {1} decreased after {2}".format(counter, name, action))
+
+                self.assertEqual(counters["productions"] - counters["retractions"], self.count(db, facts, "rule = ?", rule),
+                                 "rule {0} counts the wrong number of live productions after {1}".format(name, action))
+                self.assertGreaterEqual(counters["suppressions"], self.count(db, shadows, "suppressing_rule = ?", rule),
+                                        "rule {0} counts too few suppressions after {1}".format(name, action))
+                self.assertGreaterEqual(counters["frames"], self.count(db, frames, "1"),
+                                        "rule {0} counts too few frames after {1}".format(name, action))
+
+            suppressed = suppressed or self.count(db, shadows, "suppressing_rule IS NOT NULL") > 0
+            previous = stats
+
+        for counter in ("alpha_activations", "frames", "productions", "retractions"):
+            self.assertGreater(sum(x[counter] for x in previous.values()), 0, "no {0} were counted".format(counter))
+
+        if suppressed:
+            self.assertGreater(sum(x["suppressions"] for x in previous.values()), 0, "no suppressions were counted")
+
+        db.close()
+
+
+class GilesGaugeTestCase(GilesReplayTestCase):
+    """
+    Checks the gauges of an engine against the row counts of the tables they measure at every step of the replay. A high-water mark
+    never decreases until the gauges are reset, and it is at least the largest count seen, but it may be larger: a table can grow and
+    shrink again within a single statement.
+    """
+
+    def __str__(self):
+        return "Checking the gauges of example engine {0}".format(self.path)
+
+    def gauges(self, db):
+        gauges = {}
+        for gauge_id, kind, name, stage, rows, high_water in db.execute("SELECT * FROM _{0}_gauges".format(self.prefix)):
+            if kind == "facts":
+                table = "_{0}_{1}_actual".format(self.prefix, name)
+            else:
+                table = "_{0}_{1}_{2}_frames".format(self.prefix, name, stage)
+
+            gauges[table] = (rows, high_water, db.execute("SELECT COUNT(*) FROM {0}".format(table)).fetchone()[0])
+
+        return gauges
+
+    def runTest(self):
+        db = self.sqlite_engine("-i", "-g")
+        initial = self.gauges(db)
+        previous = initial
+        highest = dict((table, count) for table, (rows, high_water, count) in initial.items())
+
+        for fact, statement, fields, fact_id in self.replay(db):
+            action = statement or "retracting a {0} fact".format(fact)
+            gauges = self.gauges(db)
+            for table, (rows, high_water, count) in gauges.items():
+                highest[table] = max(highest[table], count)
+                self.assertEqual(rows, count, "the gauge of {0} is wrong after {1}".format(table, action))
+                self.assertGreaterEqual(high_water, highest[table], "the high-water mark of {0} is too low after {1}".format(table, action))
+                self.assertGreaterEqual(high_water, previous[table][1], "the high-water mark of {0} fell after {1}".format(table, action))
+
+            previous = gauges
+
+        self.assertGreater(sum(highest.values()), sum(x[2] for x in initial.values()), "no rows were ever counted")
+        for table, (rows, high_water, count) in previous.items():
+            self.assertEqual(count, initial[table][2], "{0} has rows left after retracting every fact".format(table))
+
+        db.execute("INSERT INTO {0}_reset_gauges VALUES(NULL)".format(self.prefix))
+        for table, (rows, high_water, count) in self.gauges(db).items():
+            self.assertEqual(high_water, count, "the high-water mark of {0} was not reset".format(table))
+
+        db.close()
+
+
+class GilesPythonBackendTestCase(GilesBackendTestCase):
+
+    backend = "python"
+    backend_name = "Python"
+
+    def start(self, source):
+        module = {}
+        exec(compile(source, os.path.join(self.directory, "engine.python"), "exec"), module)
+        self.engine = module["Engine"]()
+
+    def insert(self, fact, statement, fields):
+        return self.engine.insert(fact, **fields)
+
+    def retract(self, fact, fact_id):
+        self.engine.retract(fact, fact_id)
+
+    def query(self, fact):
+        fields = next(x.fields for x in self.engine.facts if x.name == fact)
+        return sorted(tuple(x[y] for y in fields) for x in self.engine.query(fact))
+
+    def stop(self):
+        pass
+
+
+class GilesPostgreSQLBackendTestCase(GilesBackendTestCase):
+
+    backend = "postgresql"
+    backend_name = "PostgreSQL"
+
+    def setUp(self):
+        # The server to test against is given by a libpq connection string, such as "host=/tmp port=5432 dbname=giles".
+        if psycopg2 is None or "GILES_POSTGRESQL" not in os.environ:
+            self.skipTest("set GILES_POSTGRESQL to a PostgreSQL connection string to test the PostgreSQL backend")
+
+        super().setUp()
+        self.connection = None
+
+    def start(self, source):
+        # Each example gets a schema of its own, which is dropped afterwards.
+        self.schema = "giles_test_{0}".format(os.getpid())
+        self.connection = psycopg2.connect(os.environ["GILES_POSTGRESQL"])
+        self.connection.autocommit = True
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("DROP SCHEMA IF EXISTS {0} CASCADE".format(self.schema))
+        self.cursor.execute("CREATE SCHEMA {0}".format(self.schema))
+        self.cursor.execute("SET search_path TO {0}".format(self.schema))
+        self.cursor.execute(source)
+
+    def external(self, fact):
+        self.cursor.execute("SELECT id FROM _{0}_{1}_actual WHERE frame IS NULL".format(self.prefix, fact))
+        return set(x for (x,) in self.cursor.fetchall())
+
+    def insert(self, fact, statement, fields):
+        before = self.external(fact)
+        self.cursor.execute(statement)
+        return (self.external(fact) - before or {None}).pop()
+
+    def retract(self, fact, fact_id):
+        self.cursor.execute("DELETE FROM {0}_{1}_facts WHERE id = %s".format(self.prefix, fact), (fact_id,))
+
+    def query(self, fact):
+        return self.facts(self.cursor, fact)
+
+    def stop(self):
+        if self.connection is not None:
+            self.cursor.execute("DROP SCHEMA {0} CASCADE".format(self.schema))
+            self.connection.close()
+
+
 def test_all():
     suite = unittest.TestSuite()
+    suite.addTests(doctest.DocTestSuite(audit))
     suite.addTests(doctest.DocTestSuite(caseless_string))
     suite.addTests(doctest.DocTestSuite(forbidden_names))
+    suite.addTests(doctest.DocTestSuite(migrate))
+    suite.addTests(doctest.DocTestSuite(profile))
     suite.addTests(doctest.DocTestSuite(pyre))
+    suite.addTests(doctest.DocTestSuite(rete))
+    suite.addTests(doctest.DocTestSuite(snapshot))
+    suite.addTests(doctest.DocTestSuite(storage))
+    suite.addTests(doctest.DocTestSuite(trace))
     suite.addTests(doctest.DocTestSuite(validate))
 
+    for engine in glob.glob(os.path.join(os.getcwd(), "tests", "engines", "*", "*.yml")):
+        for input_path in glob.glob(os.path.join(os.path.dirname(engine), "input*.sql")):
+            suite.addTest(GilesOptionsTestCase(engine, input_path, "-d"))
+            suite.addTest(GilesOptionsTestCase(engine, input_path, "-f"))
+            suite.addTest(GilesOptionsTestCase(engine, input_path, "-f", "-d"))
+            suite.addTest(GilesInstrumentationTestCase(engine, input_path))
+            suite.addTest(GilesGaugeTestCase(engine, input_path))
+            suite.addTest(GilesProfileTestCase(engine, input_path))
+            suite.addTest(GilesPythonBackendTestCase(engine, input_path))
+            suite.addTest(GilesPostgreSQLBackendTestCase(engine, input_path))
+
+    family = os.path.join(os.getcwd(), "examples", "family")
+    suite.addTest(GilesTraceTestCase(os.path.join(family, "family.yml"), os.path.join(family, "input.sql")))
+
+    blocking = os.path.join(os.getcwd(), "tests", "engines", "blocking")
+    suite.addTest(GilesBlockingTestCase(os.path.join(blocking, "blocking.yml"), os.path.join(blocking, "input.sql")))
+    suite.addTest(GilesBlockingTestCase(os.path.join(blocking, "blocking.yml"), os.path.join(blocking, "input.sql"), "-f"))
+    suite.addTest(GilesBlockingTestCase(os.path.join(blocking, "blocking.yml"), os.path.join(blocking, "input.sql"), "-d"))
+
+    for script in glob.glob(os.path.join(os.getcwd(), "tests", "engines", "*", "script*.sql")):
+        engine = glob.glob(os.path.join(os.path.dirname(script), "*.yml"))[0]
+        suite.addTest(GilesScriptTestCase(engine, script))
+        suite.addTest(GilesScriptTestCase(engine, script, "-f"))
+        suite.addTest(GilesScriptTestCase(engine, script, "-d"))
+
+    migration = os.path.join(os.getcwd(), "tests", "engines", "migration")
+    suite.addTest(GilesMigrateTestCase(os.path.join(migration, "version1.yml"), os.path.join(migration, "facts.sql"),
+                                       os.path.join(migration, "version2.yml")))
+
+    engine = os.path.join(os.getcwd(), "tests", "engines", "snapshot")
+    suite.addTest(GilesSnapshotTestCase(os.path.join(engine, "snapshot.yml"), os.path.join(engine, "facts.sql"),
+                                        "INSERT INTO Giles_parameters(name, key, value) VALUES('Threshold', NULL, 12)"))
+    windows = os.path.join(os.getcwd(), "tests", "engines", "windows")
+    suite.addTest(GilesSnapshotTestCase(os.path.join(windows, "windows.yml"), os.path.join(windows, "script.sql")))
+
     for example in glob.glob(os.path.join(os.getcwd(), "examples", "*", "*.yml")):
         suite.addTest(GilesCompilationTestCase(example))
+        suite.addTest(GilesCompilationTestCase(example, "-f"))
+        suite.addTest(GilesCompilationTestCase(example, "-d"))
+        suite.addTest(GilesCompilationTestCase(example, "-i", "-g", "-j"))
+        suite.addTest(GilesQueryPlanTestCase(example))
+        suite.addTest(GilesQueryPlanTestCase(example, "-f"))
+        suite.addTest(GilesQueryPlanTestCase(example, "-i", "-g", "-j"))
+
+        for input_path in glob.glob(os.path.join(os.path.dirname(example), "*.sql")):
+            if os.path.basename(input_path) != "output.sql" and not input_path.endswith(".yml.sql"):
+                suite.addTest(GilesOptionsTestCase(example, input_path, "-d"))
+                suite.addTest(GilesOptionsTestCase(example, input_path, "-f"))
+                suite.addTest(GilesOptionsTestCase(example, input_path, "-f", "-d"))
+                suite.addTest(GilesInstrumentationTestCase(example, input_path))
+                suite.addTest(GilesGaugeTestCase(example, input_path))
+                suite.addTest(GilesProfileTestCase(example, input_path))
+                suite.addTest(GilesPythonBackendTestCase(example, input_path))
+                suite.addTest(GilesPostgreSQLBackendTestCase(example, input_path))
 
     return suite
 
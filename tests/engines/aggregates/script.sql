@@ -0,0 +1,58 @@
+-- Two payments and a refund: the refund is filtered out of the count and
+-- the maximum, but is the smallest payment. No threshold has been crossed.
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'USD', 40);
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'USD', 30);
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'EUR', -5);
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Bob', 'USD', 200);
+SELECT Account, Payments, members FROM _Giles_FlagBusyAccounts_Payment_0_counters ORDER BY Account;
+SELECT Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+SELECT Account, Amount FROM Giles_Smallest_facts ORDER BY Account;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
+
+-- Two more payments cross every threshold.
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'USD', 60);
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'EUR', 150);
+SELECT id, Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
+
+-- Another payment: the count only acts as a threshold, so the Busy fact is
+-- not replaced, but the total is read by its rule, which fires again.
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'USD', 10);
+SELECT Account, Payments, members FROM _Giles_FlagBusyAccounts_Payment_0_counters ORDER BY Account;
+SELECT id, Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+
+-- Retracting the smallest payment recovers the next smallest.
+DELETE FROM Giles_Payment_facts WHERE Account = 'Ann' AND Amount = -5;
+SELECT Account, Amount FROM Giles_Smallest_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+
+-- Retracting the largest payments recovers the next largest, until it is
+-- below the threshold; the totals in both currencies fall below theirs too.
+DELETE FROM Giles_Payment_facts WHERE Account = 'Ann' AND Amount = 150;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
+DELETE FROM Giles_Payment_facts WHERE Account = 'Ann' AND Amount = 60;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+SELECT id, Account FROM Giles_Busy_facts ORDER BY Account;
+
+-- Falling below a threshold retracts the fact, and crossing it again
+-- asserts a new one.
+DELETE FROM Giles_Payment_facts WHERE Account = 'Ann' AND Amount = 10;
+SELECT Account, Payments, members FROM _Giles_FlagBusyAccounts_Payment_0_counters ORDER BY Account;
+SELECT id, Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Amount FROM Giles_Smallest_facts ORDER BY Account;
+INSERT INTO Giles_Payment_facts(Account, Currency, Amount) VALUES('Ann', 'USD', 70);
+SELECT id, Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
+
+-- Retracting every payment of a group retracts its facts.
+DELETE FROM Giles_Payment_facts WHERE Account = 'Ann';
+SELECT Account, Payments, members FROM _Giles_FlagBusyAccounts_Payment_0_counters ORDER BY Account;
+SELECT Account FROM Giles_Busy_facts ORDER BY Account;
+SELECT Account, Currency, Total FROM Giles_Spending_facts ORDER BY Account, Currency;
+SELECT Account, Amount FROM Giles_Smallest_facts ORDER BY Account;
+SELECT Account, Amount FROM Giles_Largest_facts ORDER BY Account;
@@ -0,0 +1,12 @@
+PRAGMA foreign_keys = 1;
+PRAGMA recursive_triggers = 1;
+
+INSERT INTO Giles_Request_Facts(Name, Amount) VALUES('Alice', 5);
+INSERT INTO Giles_Embargo_Facts(Name) VALUES('Alice');
+INSERT INTO Giles_Ceiling_Facts(Amount) VALUES(8);
+INSERT INTO Giles_Request_Facts(Name, Amount) VALUES('Bob', 10);
+INSERT INTO Giles_Embargo_Facts(Name) VALUES('Alice');
+INSERT INTO Giles_Ceiling_Facts(Amount) VALUES(3);
+INSERT INTO Giles_Request_Facts(Name, Amount) VALUES('Carol', 2);
+INSERT INTO Giles_Embargo_Facts(Name) VALUES('Bob');
+INSERT INTO Giles_Ceiling_Facts(Amount) VALUES(1);
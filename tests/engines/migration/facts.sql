@@ -0,0 +1,6 @@
+INSERT INTO Giles_Server_facts(Addr, Seen) VALUES('10.0.0.1', 5);
+INSERT INTO Giles_Server_facts(Addr, Seen) VALUES('10.0.0.2', 7);
+INSERT INTO Giles_Service_facts(Address, Port) VALUES('10.0.0.1', 22);
+INSERT INTO Giles_Service_facts(Address, Port) VALUES('10.0.0.1', 8080);
+INSERT INTO Giles_Service_facts(Address, Port) VALUES('10.0.0.2', 443);
+INSERT INTO Giles_Service_facts(Address, Port) VALUES('10.0.0.3', 80);
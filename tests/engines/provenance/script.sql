@@ -0,0 +1,39 @@
+-- Options: -j
+-- Socrates is mortal twice over, once for being human and once for being
+-- a philosopher, and so has two graves and two memorials. Plato is only
+-- known to be human, and has no epitaph.
+INSERT INTO Giles_Human_facts(Name) VALUES('Socrates');
+INSERT INTO Giles_Philosopher_facts(Name) VALUES('Socrates');
+INSERT INTO Giles_Human_facts(Name) VALUES('Plato');
+INSERT INTO Giles_Epitaph_facts(Name) VALUES('Socrates');
+SELECT id, Name FROM Giles_Mortal_facts ORDER BY id;
+SELECT id, Name FROM Giles_Grave_facts ORDER BY id;
+SELECT id, Name FROM Giles_Memorial_facts ORDER BY id;
+
+-- Each memorial is explained all the way back to the facts it came from,
+-- and, being the end of the chain, has no consequences.
+INSERT INTO Giles_explain(fact, fact_id) SELECT 'Memorial', id FROM Giles_Memorial_facts;
+SELECT * FROM Giles_derivations ORDER BY root_id, fact, fact_id, position;
+SELECT * FROM Giles_consequences ORDER BY root_id, fact, fact_id;
+
+-- Everything that follows from Socrates being human, and from Plato being
+-- human, which does not include a memorial.
+DELETE FROM Giles_explain;
+INSERT INTO Giles_explain(fact, fact_id) SELECT 'Human', id FROM Giles_Human_facts;
+SELECT * FROM Giles_consequences ORDER BY root_id, fact, fact_id;
+SELECT * FROM Giles_derivations ORDER BY root_id, fact, fact_id, position;
+
+-- Retracting Socrates' humanity retracts its consequences and their
+-- provenance, but leaves his other derivation.
+DELETE FROM Giles_Human_facts WHERE Name = 'Socrates';
+SELECT * FROM Giles_consequences ORDER BY root_id, fact, fact_id;
+SELECT fact, fact_id, position, matched_fact, matched_id FROM _Giles_provenance ORDER BY fact, fact_id, position;
+DELETE FROM Giles_explain;
+INSERT INTO Giles_explain(fact, fact_id) SELECT 'Memorial', id FROM Giles_Memorial_facts;
+SELECT * FROM Giles_derivations ORDER BY root_id, fact, fact_id, position;
+
+-- Retracting the philosopher retracts the rest of Socrates' facts but his
+-- epitaph.
+DELETE FROM Giles_Philosopher_facts WHERE Name = 'Socrates';
+SELECT * FROM Giles_derivations ORDER BY root_id, fact, fact_id, position;
+SELECT fact, fact_id, position, matched_fact, matched_id FROM _Giles_provenance ORDER BY fact, fact_id, position;
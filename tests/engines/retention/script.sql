@@ -0,0 +1,58 @@
+-- The retention index only covers externally asserted facts.
+SELECT sql FROM sqlite_master WHERE name = '_Giles_Reading_retention';
+
+-- Readings: MaxCount 3. Five readings are asserted in order, and the
+-- newest three survive, as do the alerts raised for them.
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('A', 15);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('B', 20);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('C', 30);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('D', 25);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('E', 40);
+SELECT Sensor, Measure FROM Giles_Alert_facts ORDER BY Sensor;
+
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(NULL, NULL);
+SELECT Sensor, Measure FROM Giles_Reading_facts ORDER BY Sensor;
+SELECT Sensor, Measure FROM Giles_Alert_facts ORDER BY Sensor;
+
+-- Expiring again changes nothing.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(NULL, NULL);
+SELECT Sensor FROM Giles_Reading_facts ORDER BY Sensor;
+
+-- A batch size limits how many of the oldest readings are expired at once.
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('F', 50);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('G', 11);
+INSERT INTO Giles_Reading_facts(Sensor, Measure) VALUES('H', 12);
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(NULL, 1);
+SELECT Sensor FROM Giles_Reading_facts ORDER BY Sensor;
+SELECT Sensor, Measure FROM Giles_Alert_facts ORDER BY Sensor;
+
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(NULL, NULL);
+SELECT Sensor FROM Giles_Reading_facts ORDER BY Sensor;
+SELECT Sensor, Measure FROM Giles_Alert_facts ORDER BY Sensor;
+
+-- Visits: MaxAge 100 and MaxCount 2, asserted at known times. A visit
+-- expires once it is at least 100 seconds old.
+INSERT INTO _Giles_Visit_actual(Visitor, inserted_at) VALUES('Ann', 1000);
+INSERT INTO _Giles_Visit_actual(Visitor, inserted_at) VALUES('Ben', 1100);
+INSERT INTO _Giles_Visit_actual(Visitor, inserted_at) VALUES('Cat', 1150);
+INSERT INTO _Giles_Visit_actual(Visitor, inserted_at) VALUES('Dan', 1160);
+SELECT Visitor FROM Giles_Greeting_facts ORDER BY Visitor;
+
+-- Only the two newest visits are kept.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1100, NULL);
+SELECT Visitor FROM Giles_Visit_facts ORDER BY Visitor;
+SELECT Visitor FROM Giles_Greeting_facts ORDER BY Visitor;
+
+-- Cat is one second short of 100 seconds old, and then exactly 100.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1249, NULL);
+SELECT Visitor FROM Giles_Visit_facts ORDER BY Visitor;
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1250, NULL);
+SELECT Visitor FROM Giles_Visit_facts ORDER BY Visitor;
+SELECT Visitor FROM Giles_Greeting_facts ORDER BY Visitor;
+
+-- Every visit grows too old, but readings have no maximum age.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(100000, NULL);
+SELECT Visitor FROM Giles_Visit_facts ORDER BY Visitor;
+SELECT Visitor FROM Giles_Greeting_facts ORDER BY Visitor;
+SELECT Sensor FROM Giles_Reading_facts ORDER BY Sensor;
+SELECT Sensor, Measure FROM Giles_Alert_facts ORDER BY Sensor;
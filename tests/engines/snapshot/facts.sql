@@ -0,0 +1,11 @@
+-- Readings are asserted at known times, so that a snapshot that lost them
+-- would be noticed.
+INSERT INTO Giles_parameters(name, key, value) VALUES('Threshold', NULL, 20);
+INSERT INTO Giles_parameters(name, key, value) VALUES('Labels', 'north', 'North door');
+INSERT INTO Giles_parameters(name, key, value) VALUES('Labels', 'south', 'South door');
+INSERT INTO _Giles_Reading_actual(Sensor, Measure, inserted_at) VALUES('north', 25, 1000);
+INSERT INTO _Giles_Reading_actual(Sensor, Measure, inserted_at) VALUES('north', 15, 1001);
+INSERT INTO _Giles_Reading_actual(Sensor, Measure, inserted_at) VALUES('south', 30, 1002);
+INSERT INTO _Giles_Reading_actual(Sensor, Measure, inserted_at) VALUES('east', 40, 1003);
+INSERT INTO Giles_Mute_facts(Sensor) VALUES('south');
+INSERT INTO _Giles_Reading_actual(Sensor, Measure, inserted_at) VALUES('south', 35, 1004);
@@ -0,0 +1,11 @@
+PRAGMA foreign_keys = 1;
+PRAGMA recursive_triggers = 1;
+
+INSERT INTO Giles_Sale_Facts(Buyer, Price) VALUES('Alice', 10);
+INSERT INTO Giles_Quiet_Facts(Buyer) VALUES('Alice');
+INSERT INTO Giles_Sale_Facts(Buyer, Price) VALUES('Alice', 20);
+INSERT INTO Giles_Dispute_Facts(Buyer) VALUES('Alice');
+INSERT INTO Giles_Sale_Facts(Buyer, Price) VALUES('Bob', 5);
+INSERT INTO Giles_Quiet_Facts(Buyer) VALUES('Bob');
+INSERT INTO Giles_Sale_Facts(Buyer, Price) VALUES('Carol', 7);
+INSERT INTO Giles_Dispute_Facts(Buyer) VALUES('Carol');
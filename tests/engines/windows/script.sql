@@ -0,0 +1,48 @@
+-- Facts are asserted into their actual tables at known times. Everyone
+-- changes their password at 1000.
+INSERT INTO _Giles_PasswordChange_actual(Person, inserted_at) VALUES('Ann', 1000);
+INSERT INTO _Giles_PasswordChange_actual(Person, inserted_at) VALUES('Bob', 1000);
+INSERT INTO _Giles_PasswordChange_actual(Person, inserted_at) VALUES('Cat', 1000);
+INSERT INTO _Giles_PasswordChange_actual(Person, inserted_at) VALUES('Dan', 1000);
+
+-- Within 100: Ann fails to log in just before the window opens, Bob as it
+-- opens, Cat as it closes, and Dan just after it closes.
+INSERT INTO _Giles_FailedLogin_actual(Person, inserted_at) VALUES('Ann', 999);
+INSERT INTO _Giles_FailedLogin_actual(Person, inserted_at) VALUES('Bob', 1000);
+INSERT INTO _Giles_FailedLogin_actual(Person, inserted_at) VALUES('Cat', 1100);
+INSERT INTO _Giles_FailedLogin_actual(Person, inserted_at) VALUES('Dan', 1101);
+SELECT Person FROM Giles_Suspicion_facts ORDER BY Person;
+
+-- After 10 and Within 50: Bob recovers one second too early and one second
+-- too late, and Cat as the window opens and as it closes.
+INSERT INTO _Giles_Recovery_actual(Person, inserted_at) VALUES('Bob', 1009);
+INSERT INTO _Giles_Recovery_actual(Person, inserted_at) VALUES('Bob', 1051);
+INSERT INTO _Giles_Recovery_actual(Person, inserted_at) VALUES('Cat', 1110);
+INSERT INTO _Giles_Recovery_actual(Person, inserted_at) VALUES('Cat', 1150);
+SELECT Person, COUNT(*) FROM Giles_Lockout_facts GROUP BY Person ORDER BY Person;
+
+-- No window has closed yet, so nothing is pruned.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1050, NULL);
+SELECT Person FROM _Giles_FlagSuspicion_0_frames ORDER BY Person;
+SELECT Person FROM _Giles_LockOut_1_frames ORDER BY Person;
+
+-- Once a window has closed, the partial matches waiting on it are pruned,
+-- unless a later match has already extended them.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1101, NULL);
+SELECT Person FROM _Giles_FlagSuspicion_0_frames ORDER BY Person;
+SELECT Person FROM _Giles_LockOut_0_frames ORDER BY Person;
+SELECT Person FROM _Giles_LockOut_1_frames ORDER BY Person;
+
+-- Bob's partial match has lost its only extension, and Cat's window for a
+-- recovery is still open.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(1150, NULL);
+SELECT Person FROM _Giles_LockOut_0_frames ORDER BY Person;
+SELECT Person FROM _Giles_LockOut_1_frames ORDER BY Person;
+INSERT INTO _Giles_Recovery_actual(Person, inserted_at) VALUES('Cat', 1130);
+SELECT Person, COUNT(*) FROM Giles_Lockout_facts GROUP BY Person ORDER BY Person;
+
+-- Pruning never retracts complete matches.
+INSERT INTO Giles_expire(Now, BatchSize) VALUES(100000, NULL);
+SELECT Person FROM _Giles_LockOut_1_frames ORDER BY Person;
+SELECT Person FROM Giles_Suspicion_facts ORDER BY Person;
+SELECT Person, COUNT(*) FROM Giles_Lockout_facts GROUP BY Person ORDER BY Person;